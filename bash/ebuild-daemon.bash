@@ -260,6 +260,12 @@ __ebd_process_ebuild_phases() {
 						cont=$?
 						__IFS_pop
 						;;
+					framed*)
+						line=${line#framed }
+						__ebd_read_env_frames "${line}" line
+						eval "${line}"
+						cont=$?
+						;;
 					lines)
 						;&
 					*)
@@ -343,21 +349,29 @@ __ebd_process_ebuild_phases() {
 }
 
 __ebd_process_metadata() {
+	local __data
+	if [[ -n $3 ]]; then
+		__ebd_read_env_frames "$1" __data
+	else
+		__ebd_read_size "$1" __data
+	fi
+	__ebd_process_metadata_env "${2:-depend}" "${__data}"
+}
+
+__ebd_process_metadata_env() {
+	# $1 is the phase to run, $2 the env to evaluate prior.
 	# protect the env.
 	# note the local usage is redundant in light of it, but prefer to write it this
 	# way so that if someone ever drops the (), it'll still not bleed out.
 	(
 		# Heavy QA checks (IFS, shopt, etc) are suppressed for speed
 		declare -r PKGCORE_QA_SUPPRESSED=false
-		# Wipe __mode; it bleeds from our parent.
-		unset __mode
-		local __data
+		# Wipe our callers' state; it bleeds from our parent.
+		unset __mode __data __batch __idx __count __size
 		local __ret
-		__ebd_read_size "$1" __data
 		local IFS=$'\0'
-		eval "$__data"
+		eval "$2"
 		__ret=$?
-		unset __data
 		[[ ${__ret} -ne 0 ]] && exit 1
 		unset __ret
 		local IFS=$' \t\n'
@@ -367,12 +381,40 @@ __ebd_process_metadata() {
 		fi
 
 		PORTAGE_SANDBOX_PID=${PPID}
-		__execute_phases "${2:-depend}" && exit 0
+		__execute_phases "$1" && exit 0
 		__ebd_process_sandbox_results
 		exit 1
 	)
 }
 
+__ebd_process_metadata_batch() {
+	# $1 is the number of envs in the batch, each sent as a size line
+	# followed by the env itself.  The whole batch is read up front since
+	# anything else python sends while we're processing is a reply to our
+	# own requests (request_inherit fex); results are streamed back as key
+	# lines terminated by a batch_result line per ebuild.
+	# If $2 is set, each env is sent as a count of key/value frames instead.
+	local __count=$1 __idx __size __data
+	local -a __batch
+	for (( __idx=0; __idx < __count; __idx++ )); do
+		__ebd_read_line __size
+		if [[ -n $2 ]]; then
+			__ebd_read_env_frames "${__size}" __data
+		else
+			__ebd_read_size "${__size}" __data
+		fi
+		__batch[${__idx}]=${__data}
+	done
+	unset __data
+	for (( __idx=0; __idx < __count; __idx++ )); do
+		if __ebd_process_metadata_env depend "${__batch[${__idx}]}"; then
+			__ebd_write_line "batch_result ${__idx} succeeded"
+		else
+			__ebd_write_line "batch_result ${__idx} failed"
+		fi
+	done
+}
+
 __make_preloaded_eclass_func() {
 	eval "__preloaded_eclass_$1() {
 		$2
@@ -381,7 +423,8 @@ __make_preloaded_eclass_func() {
 }
 
 __ebd_main_loop() {
-	DONT_EXPORT_VARS+=" com phases line cont DONT_EXPORT_FUNCS STARTING_PID"
+	DONT_EXPORT_VARS+=" com phases line cont DONT_EXPORT_FUNCS STARTING_PID PKGCORE_EBD_FRAMING"
+	PKGCORE_EBD_FRAMING=
 	SANDBOX_ON=1
 	while :; do
 		local com=''
@@ -430,15 +473,27 @@ __ebd_main_loop() {
 				__ebd_read_size "${line}" PKGCORE_METADATA_PATH
 				__ebd_write_line "metadata_path_received"
 				;;
-			gen_metadata\ *|gen_ebuild_env\ *)
-				local __mode="depend"
+			gen_metadata\ *|gen_ebuild_env\ *|gen_metadata_framed\ *|gen_ebuild_env_framed\ *)
+				local __mode="depend" __framed=
 				[[ ${com} == gen_ebuild_env* ]] && __mode="generate_env"
+				[[ ${com%% *} == *_framed ]] && __framed=1
 				line=${com#* }
-				if __ebd_process_metadata "${line}" "${__mode}"; then
+				if __ebd_process_metadata "${line}" "${__mode}" ${__framed}; then
 					__ebd_write_line "phases succeeded"
 				else
 					__ebd_write_line "phases failed"
 				fi
+				unset __framed
+				;;
+			gen_metadata_batch\ *|gen_metadata_batch_framed\ *)
+				local __framed=
+				[[ ${com%% *} == *_framed ]] && __framed=1
+				__ebd_process_metadata_batch "${com#* }" ${__framed}
+				__ebd_write_line "phases succeeded"
+				unset __framed
+				;;
+			set_framing\ *)
+				__ebd_set_framing "${com#set_framing }"
 				;;
 			*)
 				echo "received unknown com: ${com}" >&2
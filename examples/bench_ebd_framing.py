@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""Compare metadata regen throughput of the ebuild daemon wire formats.
+
+Sources the first N ebuilds of an ebuild repository through an ebuild
+processor using each framing mode, reporting packages/second for each.
+No cache is written.
+"""
+
+import argparse
+from itertools import islice
+import sys
+import time
+
+try:
+    from pkgcore.ebuild import eclass_cache, processor, repository
+    from snakeoil.osutils import pjoin
+except ImportError:
+    print >> sys.stderr, 'Cannot import pkgcore!'
+    print >> sys.stderr, 'Verify it is properly installed and/or ' \
+        'PYTHONPATH is set correctly.'
+    sys.exit(1)
+
+
+def bench(pkgs, ecache, framing, rounds):
+    ebp = processor.EbuildProcessor(False, False, False, None, framing=framing)
+    try:
+        ebp.allow_eclass_caching()
+        # warm up the eclass preloads so both modes are measured equally.
+        for pkg in pkgs:
+            ebp.get_keys(pkg, ecache)
+        start = time.time()
+        for x in xrange(rounds):
+            for pkg in pkgs:
+                ebp.get_keys(pkg, ecache)
+        return time.time() - start
+    finally:
+        ebp.shutdown_processor()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('repo', help='location of an ebuild repository')
+    parser.add_argument('-n', '--count', type=int, default=200,
+                        help='number of ebuilds to source per round')
+    parser.add_argument('-r', '--rounds', type=int, default=3,
+                        help='number of rounds to time')
+    opts = parser.parse_args(argv)
+
+    ecache = eclass_cache.cache(pjoin(opts.repo, 'eclass'))
+    repo = repository._UnconfiguredTree(opts.repo, ecache)
+    pkgs = list(islice(repo, opts.count))
+    if not pkgs:
+        parser.error('no ebuilds found in %s' % (opts.repo,))
+
+    total = len(pkgs) * opts.rounds
+    results = {}
+    for framing in ('line', 'length'):
+        elapsed = results[framing] = bench(pkgs, ecache, framing, opts.rounds)
+        print '%-6s: %i ebuilds in %.2fs, %.1f/s' % (
+            framing, total, elapsed, total / elapsed)
+    print 'length framing speedup: %.2fx' % (results['line'] / results['length'],)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""Compare merge throughput of the merge durability modes.
+
+Generates an image of N files, then times merging it into a scratch
+directory under the target once per durability mode, reporting files/second
+for each.  The flushing done by a mode is included in its time.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    from pkgcore.fs import durability, livefs, ops
+    from snakeoil.osutils import pjoin
+except ImportError:
+    print >> sys.stderr, 'Cannot import pkgcore!'
+    print >> sys.stderr, 'Verify it is properly installed and/or ' \
+        'PYTHONPATH is set correctly.'
+    sys.exit(1)
+
+
+def make_image(path, count, size, per_dir=100):
+    data = os.urandom(size)
+    for i in xrange(count):
+        d = pjoin(path, 'usr', 'share', 'bench', 'd%i' % (i // per_dir))
+        if not i % per_dir:
+            os.makedirs(d)
+        with open(pjoin(d, 'f%i' % i), 'wb') as f:
+            f.write(data)
+
+
+def bench(cset, target, mode, parallelism):
+    dest = tempfile.mkdtemp(dir=target, prefix='bench-merge-')
+    try:
+        # flush anything pending so each mode starts from the same state.
+        durability.syncfs(dest)
+        start = time.time()
+        ops.merge_contents(cset, offset=dest, parallelism=parallelism)
+        durability.sync_paths(
+            (pjoin(dest, x.location.lstrip('/')) for x in cset), mode)
+        if mode != 'none':
+            # what the vdb entry write costs on top.
+            durability.sync_filesystems([dest])
+        return time.time() - start
+    finally:
+        shutil.rmtree(dest)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('target',
+                        help='directory to merge into; its filesystem is '
+                             'the one measured')
+    parser.add_argument('-n', '--count', type=int, default=5000,
+                        help='number of files to merge')
+    parser.add_argument('-s', '--size', type=int, default=4096,
+                        help='size of each file in bytes')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of threads merging files')
+    parser.add_argument('-m', '--mode', action='append',
+                        choices=durability.modes,
+                        help='mode to measure; defaults to all of them')
+    opts = parser.parse_args(argv)
+
+    image = tempfile.mkdtemp(dir=opts.target, prefix='bench-image-')
+    try:
+        make_image(image, opts.count, opts.size)
+        cset = livefs.scan(image, offset=image)
+        for mode in (opts.mode or durability.modes):
+            elapsed = bench(cset, opts.target, mode, opts.jobs)
+            print '%-11s: %i files in %.2fs, %.1f/s' % (
+                mode, opts.count, elapsed, opts.count / elapsed)
+    finally:
+        shutil.rmtree(image)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
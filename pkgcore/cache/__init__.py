@@ -5,7 +5,7 @@
 cache subsystem, typically used for storing package metadata
 """
 
-__all__ = ("base", "bulk")
+__all__ = ("base", "bulk", "convert_entry")
 
 import itertools
 import math
@@ -16,6 +16,7 @@ from snakeoil import klass
 from snakeoil.compatibility import raise_from
 from snakeoil.mappings import (
     ProtectedDict, autoconvert_py3k_methods_metaclass, make_SlottedDict_kls)
+from snakeoil.osutils import pjoin
 
 from pkgcore.cache import errors
 from pkgcore.ebuild.const import metadata_keys
@@ -65,6 +66,9 @@ class base(object):
         self.readonly = readonly
         self.set_sync_rate(self.default_sync_rate)
         self.updates = 0
+        # distinct _eclasses_ serializations are shared by many entries;
+        # intern their deserialized form.
+        self._reconstructed_eclasses = {}
 
     @staticmethod
     def _get_chf_serializer(chf):
@@ -223,14 +227,26 @@ class base(object):
             yield chf, convert(item)
 
     def reconstruct_eclasses(self, cpv, eclass_string):
-        """Turn a string from :obj:`serialize_eclasses` into a dict."""
+        """Turn a string from :obj:`serialize_eclasses` into eclass data.
+
+        :return: tuple of (eclass, ((chf, value), ...)) pairs; this is
+            shared between all callers passing the same string, thus
+            mustn't be modified.
+        """
         if not isinstance(eclass_string, basestring):
             raise TypeError("eclass_string must be basestring, got %r" %
                 eclass_string)
+        o = self._reconstructed_eclasses.get(eclass_string)
+        if o is None:
+            o = self._reconstruct_eclasses(cpv, eclass_string)
+            self._reconstructed_eclasses[eclass_string] = o
+        return o
+
+    def _reconstruct_eclasses(self, cpv, eclass_string):
         eclass_data = eclass_string.strip().split(self.eclass_splitter)
         if eclass_data == [""]:
             # occasionally this occurs in the fs backends.  they suck.
-            return []
+            return ()
 
         l = len(eclass_data)
         chf_funcs = self.eclass_chf_deserializers
@@ -249,8 +265,8 @@ class base(object):
         # a dict; in effect, if 2 chfs, this results in a stream of-
         # (eclass_name, ((chf1,chf1_val), (chf2, chf2_val))).
         try:
-            return [(eclass, tuple(self._deserialize_eclass_chfs(i)))
-                for eclass in i]
+            return tuple((eclass, tuple(self._deserialize_eclass_chfs(i)))
+                for eclass in i)
         except ValueError:
             raise_from(errors.CacheCorruption(
                 cpv, 'ValueError reading %r' % (eclass_string,)))
@@ -314,3 +330,59 @@ class bulk(base):
         if self._pending_updates or force:
             self._write_data()
             self._pending_updates = []
+
+
+class _chf_data(object):
+
+    """holder exposing checksums pulled from a cache entry as attributes"""
+
+    def __init__(self, path=None, **chfs):
+        self.path = path
+        self.__dict__.update(chfs)
+
+
+def _required_chfs(cpv, chfs, required, what):
+    missing = [x for x in required if x not in chfs]
+    if missing:
+        raise errors.CacheCorruption(
+            cpv, "%s lacks the %s checksums required by the target cache"
+            % (what, ', '.join(missing)))
+
+
+def convert_entry(source, target, cpv, entry):
+    """Convert an entry pulled from one cache into a form storable in another.
+
+    Entries returned from a cache carry checksums in that cache's
+    deserialized form; this maps them back to what the target serializes.
+
+    :param source: cache `entry` was pulled from
+    :param target: cache the entry will be stored in
+    :param cpv: key of the entry
+    :param entry: entry as returned by `source`
+    :return: dict that can be assigned into `target`
+    :raise errors.CacheCorruption: if the source doesn't carry the
+        checksums the target requires
+    """
+    d = dict(entry.iteritems())
+    chfs = {}
+    if source._chf_key in d:
+        chfs[source.chf_type] = d.pop(source._chf_key)
+    _required_chfs(cpv, chfs, (target.chf_type,), "entry")
+    d['_chf_'] = _chf_data(**chfs)
+
+    eclasses = d.get('_eclasses_')
+    # validated entries already hold eclass objects; leave those be.
+    if eclasses is not None and not isinstance(eclasses, dict):
+        if isinstance(eclasses, basestring):
+            eclasses = source.reconstruct_eclasses(cpv, eclasses)
+        converted = {}
+        for eclass, eclass_chfs in eclasses:
+            eclass_chfs = dict(eclass_chfs)
+            _required_chfs(cpv, eclass_chfs, target.eclass_chf_types,
+                           "eclass %s" % (eclass,))
+            path = eclass_chfs.pop('eclassdir', None)
+            if path is not None:
+                path = pjoin(path, eclass + '.eclass')
+            converted[eclass] = _chf_data(path=path, **eclass_chfs)
+        d['_eclasses_'] = converted
+    return d
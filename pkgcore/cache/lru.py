@@ -0,0 +1,158 @@
+# License: GPL2/BSD
+
+"""
+bounded in-memory tier in front of another cache backend
+
+Long lived processes, e.g. pquery over every repo or the resolver, pull the
+same entries repeatedly; this keeps the most recently used entries parsed in
+memory while capping how much memory that takes.
+"""
+
+__all__ = ("database",)
+
+from collections import OrderedDict
+import threading
+
+from pkgcore.cache import base
+from pkgcore.config import ConfigHint
+
+
+def _entry_size(cpv, entry):
+    """rough estimate of the memory an entry holds, in bytes"""
+    size = len(cpv)
+    for k, v in entry.iteritems():
+        size += len(k)
+        if isinstance(v, basestring):
+            size += len(v)
+        elif k == '_eclasses_':
+            # names are interned and chfs small; charge a flat rate each.
+            size += 64 * len(v)
+    return size
+
+
+class database(base):
+
+    """
+    LRU of parsed entries, wrapping another cache
+
+    Writes go through to the wrapped cache immediately, dropping the
+    in-memory copy; it's repopulated in the wrapped cache's parsed form on
+    the next lookup.  Iteration is passed straight through, as caching a
+    full walk of the backend would just churn the LRU.
+
+    :ivar hits: lookups served from memory
+    :ivar misses: lookups passed to the wrapped cache
+    :ivar evictions: entries dropped to stay within the caps
+    """
+
+    pkgcore_config_type = ConfigHint(
+        {'backend': 'ref:cache', 'max_entries': 'int', 'max_size': 'int'},
+        required=['backend'],
+        positional=['backend'],
+        typename='cache')
+
+    stat_names = ('hits', 'misses', 'evictions')
+
+    def __init__(self, backend, max_entries=5000, max_size=None):
+        """
+        :param backend: :obj:`pkgcore.cache.base` derivative to wrap
+        :param max_entries: maximum number of entries to hold in memory;
+            None for no limit
+        :param max_size: maximum estimated size in bytes of the entries held
+            in memory; None for no limit
+        """
+        self.backend = backend
+        # mirror the backend's checksum handling, validate_entry and
+        # convert_entry rely on it.
+        self.chf_type = backend.chf_type
+        self.eclass_chf_types = backend.eclass_chf_types
+        self.eclass_splitter = backend.eclass_splitter
+        # base's init resets the sync rate; keep the backend's.
+        self.default_sync_rate = backend.sync_rate
+        base.__init__(self, auxdbkeys=backend._known_keys,
+                      readonly=backend.readonly)
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        for x in self.stat_names:
+            setattr(self, x, 0)
+
+    def stats(self):
+        """:return: dict of the LRU's counters"""
+        return {x: getattr(self, x) for x in self.stat_names}
+
+    def _forget(self, cpv):
+        with self._lock:
+            item = self._entries.pop(cpv, None)
+            if item is not None:
+                self._size -= item[1]
+
+    def __getitem__(self, cpv):
+        with self._lock:
+            item = self._entries.pop(cpv, None)
+            if item is not None:
+                # reinsert as the most recently used.
+                self._entries[cpv] = item
+                self.hits += 1
+        if item is None:
+            entry = self.backend[cpv]
+            item = (entry, _entry_size(cpv, entry))
+            with self._lock:
+                self.misses += 1
+                self._store(cpv, item)
+        # validation replaces the eclass data of what it's given; hand back
+        # a copy so the held entry stays as the backend returned it.
+        return dict(item[0].iteritems())
+
+    def _store(self, cpv, item):
+        old = self._entries.pop(cpv, None)
+        if old is not None:
+            self._size -= old[1]
+        self._entries[cpv] = item
+        self._size += item[1]
+        entries = self._entries
+        while len(entries) > 1 and (
+                (self.max_entries is not None and
+                 len(entries) > self.max_entries) or
+                (self.max_size is not None and self._size > self.max_size)):
+            self._size -= entries.popitem(last=False)[1][1]
+            self.evictions += 1
+
+    def __setitem__(self, cpv, values):
+        self._forget(cpv)
+        self.backend[cpv] = values
+
+    def __delitem__(self, cpv):
+        self._forget(cpv)
+        del self.backend[cpv]
+
+    def __contains__(self, cpv):
+        return cpv in self._entries or cpv in self.backend
+
+    def iterkeys(self):
+        return self.backend.iterkeys()
+
+    def iteritems(self):
+        return self.backend.iteritems()
+
+    def invalidate(self):
+        """drop the in-memory entries; the backend is left alone"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def set_sync_rate(self, rate=0):
+        self.sync_rate = rate
+        self.backend.set_sync_rate(rate)
+
+    def commit(self, force=False):
+        self.backend.commit(force=force)
+
+    def validate_entry(self, cache_item, ebuild_hash_item, eclass_db):
+        return self.backend.validate_entry(
+            cache_item, ebuild_hash_item, eclass_db)
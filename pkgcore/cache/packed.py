@@ -0,0 +1,213 @@
+# License: GPL2/BSD
+
+"""
+read-mostly backend packing every entry into a single memory mapped file
+
+The file starts with a sorted index of cpv, offset, and length triples
+followed by the entries themselves in :obj:`pkgcore.cache.flat_hash` format;
+lookups are a bisect of the index and a slice of the mapping.  This is meant
+to sit in front of a writable cache in a repo's cache stack: stale entries
+are skipped, with the writable cache regenerating and storing them.
+"""
+
+__all__ = ("database",)
+
+from bisect import bisect_left
+import errno
+import mmap
+import os
+
+from snakeoil.compatibility import raise_from
+from snakeoil.demandload import demandload
+from snakeoil.osutils import ensure_dirs
+
+from pkgcore.cache import convert_entry, errors, flat_hash
+from pkgcore.config import ConfigHint
+
+demandload("snakeoil:fileutils")
+
+PACKED_MAGIC = "pkgcore packed cache v1\n"
+
+_empty = ((), (), None)
+
+
+class database(flat_hash.database):
+
+    """
+    stores all entries in one file, read via mmap
+
+    Readonly by default.  If made writable, updates are held in memory until
+    committed, at which point the whole file is rewritten; thus it's best
+    populated via :obj:`pack`, pclonecache, or `pmaint regen --pack`.
+    """
+
+    pkgcore_config_type = ConfigHint(
+        {'readonly': 'bool', 'location': 'str', 'label': 'str',
+         'auxdbkeys': 'list'},
+        required=['location'],
+        positional=['location'],
+        typename='cache')
+
+    autocommits = False
+    # every commit rewrites the file; only do so when explicitly flushed.
+    default_sync_rate = 1000000
+
+    def __init__(self, location, readonly=True, **config):
+        """
+        :param location: path of the packed file; if `label` is given,
+            the file is stored at `label` beneath this directory
+        """
+        flat_hash.database.__init__(self, location, readonly=readonly, **config)
+        self._mapped = None
+        self._pending = {}
+
+    def _load(self):
+        mapped = self._mapped
+        if mapped is None:
+            mapped = self._mapped = self._read_index()
+        return mapped
+
+    def _read_index(self):
+        try:
+            f = open(self.location, 'rb')
+        except EnvironmentError as e:
+            if e.errno == errno.ENOENT:
+                return _empty
+            raise_from(errors.InitializationError(self.__class__, e))
+        try:
+            if not os.fstat(f.fileno()).st_size:
+                return _empty
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        keys, spans = [], []
+        try:
+            if data[:len(PACKED_MAGIC)] != PACKED_MAGIC:
+                raise ValueError("unknown format")
+            pos = len(PACKED_MAGIC)
+            end = data.find("\n", pos)
+            count = int(data[pos:end])
+            pos = end + 1
+            for x in xrange(count):
+                end = data.find("\n", pos)
+                if end == -1:
+                    raise ValueError("truncated index")
+                cpv, offset, length = data[pos:end].split("\t")
+                keys.append(cpv)
+                spans.append((int(offset), int(length)))
+                pos = end + 1
+        except ValueError as e:
+            raise_from(errors.GeneralCacheCorruption(
+                "%s: %s" % (self.location, e)))
+        # offsets are relative to the end of the index.
+        spans = [(offset + pos, offset + pos + length)
+                 for offset, length in spans]
+        if spans and spans[-1][1] > len(data):
+            raise errors.GeneralCacheCorruption(
+                "%s: truncated entries" % (self.location,))
+        return keys, spans, data
+
+    def _get_raw(self, cpv):
+        keys, spans, data = self._load()
+        i = bisect_left(keys, cpv)
+        if i == len(keys) or keys[i] != cpv:
+            return None
+        start, end = spans[i]
+        return data[start:end]
+
+    @staticmethod
+    def _serialize(values):
+        return "\n".join("%s=%s" % (k, v) for k, v in values.iteritems())
+
+    def _getitem(self, cpv):
+        if cpv in self._pending:
+            raw = self._pending[cpv]
+        else:
+            raw = self._get_raw(cpv)
+        if raw is None:
+            raise KeyError(cpv)
+        try:
+            return self._parse_data(raw.split("\n"), None)
+        except (KeyError, ValueError) as e:
+            raise_from(errors.CacheCorruption(cpv, e))
+
+    def _setitem(self, cpv, values):
+        self._pending[cpv] = self._serialize(values)
+
+    def _delitem(self, cpv):
+        if cpv not in self:
+            raise KeyError(cpv)
+        self._pending[cpv] = None
+
+    def __contains__(self, cpv):
+        if cpv in self._pending:
+            return self._pending[cpv] is not None
+        keys = self._load()[0]
+        i = bisect_left(keys, cpv)
+        return i != len(keys) and keys[i] == cpv
+
+    def iterkeys(self):
+        pending = self._pending
+        if not pending:
+            return iter(self._load()[0])
+        keys = set(self._load()[0])
+        keys.update(pending)
+        return (cpv for cpv in sorted(keys) if pending.get(cpv, True) is not None)
+
+    def commit(self, force=False):
+        if not self._pending and not force:
+            return
+        entries = []
+        for cpv in self.iterkeys():
+            raw = self._pending.get(cpv)
+            if raw is None:
+                raw = self._get_raw(cpv)
+            entries.append((cpv, raw))
+        self._write(entries)
+        self._pending = {}
+        self._mapped = None
+
+    def _write(self, entries):
+        if not ensure_dirs(os.path.dirname(self.location), mode=0775,
+                           minimal=False):
+            raise errors.GeneralCacheCorruption(
+                "failed creating the directory for %r" % (self.location,))
+        f = None
+        try:
+            f = fileutils.AtomicWriteFile(
+                self.location, binary=True, perms=self._perms)
+            f.write(PACKED_MAGIC)
+            f.write("%i\n" % len(entries))
+            offset = 0
+            for cpv, raw in entries:
+                f.write("%s\t%i\t%i\n" % (cpv, offset, len(raw)))
+                offset += len(raw)
+            for cpv, raw in entries:
+                f.write(raw)
+            f.close()
+        except EnvironmentError as e:
+            raise_from(errors.GeneralCacheCorruption(e))
+        finally:
+            if f is not None:
+                f.discard()
+        self._ensure_access(self.location)
+
+    def pack(self, source):
+        """Replace the packed file with every entry from another cache.
+
+        This is allowed even if the cache is readonly.
+
+        :param source: :obj:`pkgcore.cache.base` derivative to pack
+        """
+        readonly, self.readonly = self.readonly, False
+        try:
+            self._mapped = _empty
+            self._pending = {}
+            for cpv, entry in source.iteritems():
+                self[cpv] = convert_entry(source, self, cpv, entry)
+            self.commit(force=True)
+        finally:
+            self.readonly = readonly
+            self._pending = {}
+            self._mapped = None
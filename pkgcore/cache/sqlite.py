@@ -0,0 +1,170 @@
+# License: GPL2/BSD
+
+"""
+sqlite based backend, storing all entries in a single database file
+"""
+
+__all__ = ("database",)
+
+import os
+import sqlite3
+import threading
+
+from snakeoil.compatibility import raise_from
+from snakeoil.osutils import ensure_dirs
+
+from pkgcore.cache import fs_template, errors
+from pkgcore.config import ConfigHint
+
+
+class database(fs_template.FsBased):
+
+    """
+    stores cache entries as rows in an sqlite database
+
+    Updates are queued up in a transaction, committed every `sync_rate`
+    updates; lookups within the same process see pending updates.  Regen
+    raises the sync rate for the duration of the regen, batching its writes,
+    unless it runs in multiple processes; sqlite allows a single writer, so
+    each worker then commits every update.
+    """
+
+    pkgcore_config_type = ConfigHint(
+        {'readonly': 'bool', 'location': 'str', 'label': 'str',
+         'auxdbkeys': 'list', 'sync_rate': 'int', 'wal': 'bool'},
+        required=['location'],
+        positional=['location'],
+        typename='cache')
+
+    autocommits = False
+    default_sync_rate = 1
+    eclass_chf_types = ('eclassdir', 'mtime')
+
+    def __init__(self, location, label=None, sync_rate=None, wal=True,
+                 **config):
+        """
+        :param location: path of the database file; if `label` is given,
+            the database is stored at `label` beneath this directory
+        :param sync_rate: number of updates to queue before committing
+        :param wal: use sqlite's write-ahead logging, allowing readers
+            to proceed while a regen is writing to the database
+        """
+        fs_template.FsBased.__init__(self, location, label=label, **config)
+        self.wal = wal
+        # connections are shared between threads, thus serialize access;
+        # they can't be shared across forks however, see _get_connection.
+        self._lock = threading.RLock()
+        self._conn = self._conn_pid = None
+        if sync_rate is not None:
+            self.set_sync_rate(sync_rate)
+
+    def _get_connection(self):
+        pid = os.getpid()
+        if self._conn is not None and self._conn_pid == pid:
+            return self._conn
+        if self.readonly and not os.path.exists(self.location):
+            return None
+        try:
+            if not self.readonly:
+                if not ensure_dirs(os.path.dirname(self.location),
+                                   mode=0775, minimal=False):
+                    raise errors.InitializationError(
+                        self.__class__,
+                        "failed creating the directory for %r" %
+                        (self.location,))
+            conn = sqlite3.connect(
+                self.location, timeout=60, check_same_thread=False)
+            conn.text_factory = str
+            if not self.readonly:
+                if self.wal:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    # WAL is safe from corruption without syncing every
+                    # commit; at worst the last commits are lost.
+                    conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS metadata "
+                    "(cpv TEXT PRIMARY KEY, data TEXT NOT NULL)")
+                conn.commit()
+                self._ensure_access(self.location)
+        except sqlite3.Error as e:
+            raise_from(errors.InitializationError(self.__class__, e))
+        self._conn, self._conn_pid = conn, pid
+        return conn
+
+    def _query(self, key, query, args=()):
+        with self._lock:
+            conn = self._get_connection()
+            if conn is None:
+                return []
+            try:
+                return conn.execute(query, args).fetchall()
+            except sqlite3.Error as e:
+                raise_from(errors.CacheCorruption(key, e))
+
+    def _parse_data(self, cpv, data):
+        d = self._cdict_kls()
+        known = self._known_keys
+        try:
+            for x in data.split("\n"):
+                k, v = x.split("=", 1)
+                if k in known:
+                    d[k] = v
+            d[self._chf_key] = self._chf_deserializer(d[self._chf_key])
+        except (KeyError, ValueError) as e:
+            raise_from(errors.CacheCorruption(cpv, e))
+        return d
+
+    def _getitem(self, cpv):
+        rows = self._query(cpv, "SELECT data FROM metadata WHERE cpv=?", (cpv,))
+        if not rows:
+            raise KeyError(cpv)
+        return self._parse_data(cpv, rows[0][0])
+
+    def _setitem(self, cpv, values):
+        data = "\n".join("%s=%s" % (k, v) for k, v in values.iteritems())
+        with self._lock:
+            conn = self._get_connection()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO metadata (cpv, data) VALUES (?, ?)",
+                    (cpv, data))
+            except sqlite3.Error as e:
+                raise_from(errors.CacheCorruption(cpv, e))
+
+    def _delitem(self, cpv):
+        with self._lock:
+            conn = self._get_connection()
+            try:
+                deleted = conn.execute(
+                    "DELETE FROM metadata WHERE cpv=?", (cpv,)).rowcount
+            except sqlite3.Error as e:
+                raise_from(errors.CacheCorruption(cpv, e))
+        if not deleted:
+            raise KeyError(cpv)
+
+    def __contains__(self, cpv):
+        return bool(self._query(
+            cpv, "SELECT 1 FROM metadata WHERE cpv=?", (cpv,)))
+
+    def iterkeys(self):
+        for row in self._query(None, "SELECT cpv FROM metadata ORDER BY cpv"):
+            yield row[0]
+
+    def iteritems(self):
+        """pull all entries in one query; far cheaper than per key lookups"""
+        self._sync_if_needed()
+        rows = self._query(None, "SELECT cpv, data FROM metadata ORDER BY cpv")
+        for cpv, data in rows:
+            d = self._parse_data(cpv, data)
+            if "_eclasses_" in d:
+                d["_eclasses_"] = self.reconstruct_eclasses(cpv, d["_eclasses_"])
+            yield cpv, d
+
+    def commit(self, force=False):
+        with self._lock:
+            if self._conn is None or self._conn_pid != os.getpid():
+                return
+            try:
+                self._conn.commit()
+            except sqlite3.Error as e:
+                raise_from(errors.GeneralCacheCorruption(e))
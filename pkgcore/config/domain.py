@@ -23,6 +23,10 @@ demandload(
 class domain(object):
 
     fetcher = None
+    # a pkgcore.fs.durability.modes entry
+    merge_durability = "none"
+    # threads merging and unmerging a pkg's files; 1 does so serially.
+    merge_jobs = 1
     _triggers = ()
 
     def _mk_nonconfig_triggers(self):
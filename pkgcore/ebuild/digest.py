@@ -22,7 +22,7 @@ from pkgcore.fs.livefs import iter_scan
 
 demandload(
     "errno",
-    'snakeoil:mappings',
+    'snakeoil:fileutils,mappings',
     "snakeoil.lists:iflatten_instance",
 )
 
@@ -66,20 +66,26 @@ def serialize_manifest(pkgdir, fetchables, chfs=None, thin=False):
                     % (pkgdir, obj.dirname))
             d[pathname] = dict(obj.chksums)
 
-    handle = open(pkgdir + '/Manifest', 'w')
-    # write it in alphabetical order; aux gets flushed now.
-    for path, chksums in sorted(aux.iteritems(), key=_key_sort):
-        _write_manifest(handle, 'AUX', path, chksums)
-
-    # next dist...
-    for fetchable in sorted(fetchables, key=operator.attrgetter('filename')):
-        _write_manifest(handle, 'DIST', basename(fetchable.filename),
-            dict(fetchable.chksums))
-
-    # then ebuild and misc
-    for mtype, inst in (("EBUILD", ebuild), ("MISC", misc)):
-        for path, chksum in sorted(inst.iteritems(), key=_key_sort):
-            _write_manifest(handle, mtype, path, chksum)
+    # written to a temp file and moved into place, so a failure never
+    # leaves a partial manifest behind.
+    handle = fileutils.AtomicWriteFile(pkgdir + '/Manifest', binary=False)
+    try:
+        # write it in alphabetical order; aux gets flushed now.
+        for path, chksums in sorted(aux.iteritems(), key=_key_sort):
+            _write_manifest(handle, 'AUX', path, chksums)
+
+        # next dist...
+        for fetchable in sorted(fetchables, key=operator.attrgetter('filename')):
+            _write_manifest(handle, 'DIST', basename(fetchable.filename),
+                dict(fetchable.chksums))
+
+        # then ebuild and misc
+        for mtype, inst in (("EBUILD", ebuild), ("MISC", misc)):
+            for path, chksum in sorted(inst.iteritems(), key=_key_sort):
+                _write_manifest(handle, mtype, path, chksum)
+        handle.close()
+    finally:
+        handle.discard()
 
 
 def _write_manifest(handle, chf, filename, chksums):
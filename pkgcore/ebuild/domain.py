@@ -44,6 +44,7 @@ demandload(
     're',
     'snakeoil.process:get_proc_count',
     'pkgcore.ebuild.triggers:generate_triggers@ebuild_generate_triggers',
+    'pkgcore.fs:durability',
     'pkgcore.fs.livefs:iter_scan',
 )
 
@@ -122,7 +123,8 @@ class domain(pkgcore.config.domain.domain):
                    'package.accept_keywords'):
         _types[_thing] = 'list'
     for _thing in ('root', 'CHOST', 'CBUILD', 'CTARGET', 'CFLAGS', 'PATH',
-                   'PORTAGE_TMPDIR', 'DISTCC_PATH', 'DISTCC_DIR', 'CCACHE_DIR'):
+                   'PORTAGE_TMPDIR', 'DISTCC_PATH', 'DISTCC_DIR', 'CCACHE_DIR',
+                   'MERGE_DURABILITY', 'MERGE_JOBS'):
         _types[_thing] = 'str'
 
     # TODO this is missing defaults
@@ -152,6 +154,23 @@ class domain(pkgcore.config.domain.domain):
         if 'MAKEOPTS' not in settings:
             settings['MAKEOPTS'] = '-j%i' % get_proc_count()
 
+        # how merged files and vdb entries are flushed to disk.
+        self.merge_durability = settings.get('MERGE_DURABILITY', 'none')
+        if self.merge_durability not in durability.modes:
+            raise Failure(
+                "invalid MERGE_DURABILITY %r, expected one of: %s" %
+                (self.merge_durability, ', '.join(durability.modes)))
+
+        # threads merging and unmerging a pkg's files.
+        try:
+            self.merge_jobs = int(settings.get('MERGE_JOBS', 1))
+            if self.merge_jobs < 1:
+                raise ValueError
+        except ValueError:
+            raise Failure(
+                "invalid MERGE_JOBS %r, expected a positive integer" %
+                (settings['MERGE_JOBS'],))
+
         # map out sectionname -> config manager immediately.
         repositories_collapsed = [r.collapse() for r in repositories]
         repositories = [r.instantiate() for r in repositories_collapsed]
@@ -341,12 +341,9 @@ class package_factory(metadata.factory):
     def _get_ebuild_mtime(self, pkg):
         return os.stat(self._get_ebuild_path(pkg)).st_mtime
 
-    def _get_metadata(self, pkg, ebp=None, force_regen=False):
-        caches = self._cache
-        if force_regen:
-            caches = ()
+    def _get_cached_metadata(self, pkg):
         ebuild_hash = chksum.LazilyHashedPath(pkg.path)
-        for cache in caches:
+        for cache in self._cache:
             if cache is not None:
                 try:
                     data = cache[pkg.cpvstr]
@@ -360,10 +357,60 @@ class package_factory(metadata.factory):
                     logger.warning("caught cache error: %s" % ce)
                     del ce
                     continue
+        return None
+
+    def _get_metadata(self, pkg, ebp=None, force_regen=False):
+        if not force_regen:
+            data = self._get_cached_metadata(pkg)
+            if data is not None:
+                return data
 
         # no cache entries, regen
         return self._update_metadata(pkg, ebp=ebp)
 
+    def _get_metadata_batch(self, pkgs, ebp=None, force_regen=False,
+                            batch_size=32):
+        """Pull metadata for multiple packages, regenerating in batches.
+
+        Packages lacking a valid cache entry are handed to the ebuild
+        processor in batches, avoiding a round trip per ebuild.
+
+        :return: iterable of (pkg, metadata) pairs; metadata is the exception
+            encountered if that package's metadata couldn't be generated.
+        """
+        stale = []
+        for pkg in pkgs:
+            data = None
+            if not force_regen:
+                data = self._get_cached_metadata(pkg)
+            if data is not None:
+                yield pkg, data
+            elif not pkg.eapi_obj.is_supported:
+                yield pkg, {'EAPI': pkg.eapi_obj.magic}
+            else:
+                stale.append(pkg)
+            if len(stale) >= batch_size:
+                for result in self._update_metadata_batch(stale, ebp, batch_size):
+                    yield result
+                stale = []
+        if stale:
+            for result in self._update_metadata_batch(stale, ebp, batch_size):
+                yield result
+
+    def _update_metadata_batch(self, pkgs, ebp, batch_size):
+        with processor.reuse_or_request(ebp) as my_proc:
+            results = list(my_proc.get_keys_batch(
+                pkgs, self._ecache, batch_size=batch_size))
+        for pkg, mydata in results:
+            if mydata is None:
+                yield pkg, metadata_errors.MetadataException(
+                    pkg, 'data', "failed sourcing ebuild")
+                continue
+            try:
+                yield pkg, self._store_metadata(pkg, mydata)
+            except metadata_errors.MetadataException as e:
+                yield pkg, e
+
     def _update_metadata(self, pkg, ebp=None):
         parsed_eapi = pkg.eapi_obj
         if not parsed_eapi.is_supported:
@@ -372,6 +419,10 @@ class package_factory(metadata.factory):
         with processor.reuse_or_request(ebp) as my_proc:
             mydata = my_proc.get_keys(pkg, self._ecache)
 
+        return self._store_metadata(pkg, mydata)
+
+    def _store_metadata(self, pkg, mydata):
+        parsed_eapi = pkg.eapi_obj
         inherited = mydata.pop("INHERITED", None)
         # rewrite defined_phases as needed, since we now know the eapi.
         eapi = get_eapi(mydata["EAPI"])
@@ -33,6 +33,9 @@ class base(object):
 
     def __init__(self, portdir=None, eclassdir=None):
         self._eclass_data_inst_cache = WeakValCache()
+        # validation verdicts for distinct cache entry eclass data, tied to
+        # the eclasses mapping they were computed against.
+        self._rebuild_memo = (None, {})
         # generate this.
         # self.eclasses = {} # {"Name": ("location", "_mtime_")}
         self.portdir = portdir
@@ -62,24 +65,53 @@ class base(object):
 
     eclasses = jit_attr_ext_method("_load_eclasses", "_eclasses")
 
+    def reload(self):
+        """Force the on disk eclasses to be rescanned on next access.
+
+        This invalidates any memoized cache entry validations.
+        """
+        try:
+            del self._eclasses
+        except AttributeError:
+            pass
+        self._eclass_data_inst_cache = WeakValCache()
+
     def rebuild_cache_entry(self, entry_eclasses):
         """Check if eclass data is still valid.
 
         Given a dict as returned by get_eclass_data, walk it comparing
-        it to internal eclass view.
+        it to internal eclass view.  Each distinct set of eclass data is
+        only checked once until the eclasses are reloaded.
 
-        :return: a boolean representing whether that eclass data is still
-            up to date, or not
+        :return: mapping of eclass to its current data if the eclass data is
+            still up to date, None otherwise
         """
         ec = self.eclasses
-        d = {}
+        memo_ec, memo = self._rebuild_memo
+        if memo_ec is not ec:
+            memo = {}
+            self._rebuild_memo = (ec, memo)
+        try:
+            return memo[entry_eclasses]
+        except TypeError:
+            # unhashable; normalize it.
+            entry_eclasses = tuple(
+                (eclass, tuple(chksums)) for eclass, chksums in entry_eclasses)
+            if entry_eclasses in memo:
+                return memo[entry_eclasses]
+        except KeyError:
+            pass
 
+        d = {}
         for eclass, chksums in entry_eclasses:
             data = ec.get(eclass)
             if any(val != getattr(data, chf, None) for chf, val in chksums):
-                return None
+                d = None
+                break
             d[eclass] = data
-
+        if d is not None:
+            d = ImmutableDict(d)
+        memo[entry_eclasses] = d
         return d
 
 
@@ -145,3 +177,8 @@ class StackedCaches(base):
 
     def _load_eclasses(self):
         return StackedDict(*[ec.eclasses for ec in self._caches])
+
+    def reload(self):
+        for ec in self._caches:
+            ec.reload()
+        base.reload(self)
@@ -0,0 +1,171 @@
+# License: GPL2/BSD
+
+"""
+persistent profile of how often eclasses are inherited within a repo
+
+Used by regen to decide which eclasses are worth preloading into ebuild
+processors, and to order ebuilds so those sharing inherits are sourced
+back to back.
+"""
+
+__all__ = ("EclassProfile", "default_profile_path", "cached_inherits",
+           "order_by_inherits")
+
+from collections import defaultdict
+import re
+
+from snakeoil import compatibility
+from snakeoil.demandload import demandload
+
+demandload(
+    "errno",
+    "snakeoil:fileutils",
+    "pkgcore.cache:errors@cache_errors",
+    "pkgcore.ebuild.regen_journal:cache_sidecar_path",
+    "pkgcore.log:logger",
+)
+
+PROFILE_HEADER = "pkgcore eclass profile v1"
+
+_inherit_re = re.compile(r"^[ \t]*inherit[ \t]+([^\n;&|#]+)", re.M)
+_eclass_name_re = re.compile(r"^[A-Za-z0-9_.+-]+$")
+
+
+def default_profile_path(repo):
+    """Return the default profile location for a repo, or None."""
+    return cache_sidecar_path(repo, '.eclass-profile')
+
+
+def cached_inherits(repo, cpv):
+    """Return the sorted eclasses a package inherited per the repo's caches.
+
+    Entries aren't validated; this is meant for heuristics where stale data
+    is acceptable.  An empty tuple is returned if nothing is cached.
+    """
+    for cache in getattr(repo, 'cache', ()):
+        try:
+            data = cache[cpv]
+        except KeyError:
+            continue
+        except cache_errors.CacheError:
+            continue
+        eclasses = data.get('_eclasses_')
+        if eclasses is None:
+            eclasses = data.get('INHERITED', '').split()
+        return tuple(sorted(eclasses))
+    return ()
+
+
+def order_by_inherits(repo, pkgs):
+    """Sort packages so those with the same inherit set are adjacent.
+
+    This maximizes reuse of the eclass functions a processor has preloaded.
+    """
+    return sorted(
+        pkgs, key=lambda pkg: (cached_inherits(repo, pkg.cpvstr), pkg.cpvstr))
+
+
+def _eclass_inherits(eclass_cache, eclass):
+    source = eclass_cache.get_eclass(eclass)
+    if source is None:
+        return ()
+    try:
+        text = source.text_fileobj().read()
+    except EnvironmentError:
+        return ()
+    inherits = set()
+    for match in _inherit_re.finditer(text):
+        inherits.update(
+            x for x in match.group(1).split() if _eclass_name_re.match(x))
+    return inherits
+
+
+class EclassProfile(object):
+
+    """
+    Record of how many ebuilds inherit each eclass.
+
+    :ivar counts: mapping of eclass name to the number of inheriting ebuilds
+    """
+
+    def __init__(self, path):
+        """
+        :param path: on disk location of the profile
+        """
+        self.path = path
+        self.counts = self._read(path)
+
+    @staticmethod
+    def _read(path):
+        counts = {}
+        try:
+            with open(path, 'r') as f:
+                if f.readline().rstrip('\n') != PROFILE_HEADER:
+                    logger.warning(
+                        "ignoring eclass profile %s: unknown format", path)
+                    return {}
+                for line in f:
+                    count, eclass = line.split()
+                    counts[eclass] = int(count)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                logger.warning("failed reading eclass profile %s: %s", path, e)
+            return {}
+        except compatibility.IGNORED_EXCEPTIONS:
+            raise
+        except Exception as e:
+            logger.warning("corrupt eclass profile %s: %s; ignoring it", path, e)
+            return {}
+        return counts
+
+    def update(self, inherits):
+        """Replace the profile's counts.
+
+        :param inherits: iterable of the eclasses inherited by each ebuild in
+            the repo
+        """
+        counts = defaultdict(int)
+        for eclasses in inherits:
+            for eclass in eclasses:
+                counts[eclass] += 1
+        self.counts = dict(counts)
+
+    def scan(self, repo):
+        """Generate the profile from the repo's metadata caches."""
+        self.update(cached_inherits(repo, cpv)
+                    for cpv in (pkg.cpvstr for pkg in repo))
+
+    def top(self, count):
+        """Return the `count` most inherited eclasses, most frequent first."""
+        ranked = sorted(self.counts.iteritems(), key=lambda x: (-x[1], x[0]))
+        return [eclass for eclass, n in ranked[:count]]
+
+    def preload_set(self, count, eclass_cache):
+        """Return the eclasses to preload into a processor.
+
+        This is the `count` most inherited eclasses along with everything
+        they inherit, limited to eclasses available in `eclass_cache`.
+        """
+        available = eclass_cache.eclasses
+        todo = [x for x in self.top(count) if x in available]
+        eclasses = set(todo)
+        while todo:
+            for eclass in _eclass_inherits(eclass_cache, todo.pop()):
+                if eclass in available and eclass not in eclasses:
+                    eclasses.add(eclass)
+                    todo.append(eclass)
+        return sorted(eclasses)
+
+    def save(self):
+        f = None
+        try:
+            f = fileutils.AtomicWriteFile(self.path, binary=False, perms=0664)
+            f.write(PROFILE_HEADER + "\n")
+            for eclass, count in sorted(self.counts.iteritems()):
+                f.write("%i\t%s\n" % (count, eclass))
+            f.close()
+        except EnvironmentError as e:
+            logger.error("failed writing eclass profile %s: %s", self.path, e)
+        finally:
+            if f is not None:
+                f.discard()
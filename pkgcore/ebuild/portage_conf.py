@@ -253,7 +253,8 @@ def add_profile(config, base_path, user_profile_path=None, profile_override=None
         })
 
 
-def add_fetcher(config, conf_dict, distdir):
+def add_fetcher(config, conf_dict, distdir, chksum_cache=None,
+                paranoid_chksums=False):
     fetchcommand = conf_dict.pop("FETCHCOMMAND")
     resumecommand = conf_dict.pop("RESUMECOMMAND", fetchcommand)
 
@@ -269,6 +270,9 @@ def add_fetcher(config, conf_dict, distdir):
         "command": fetchcommand,
         "resume_command": resumecommand,
     })
+    if chksum_cache is not None:
+        fetcher_dict["chksum_cache"] = chksum_cache
+        fetcher_dict["paranoid_chksums"] = str(paranoid_chksums)
     config["fetcher"] = basics.AutoConfigSection(fetcher_dict)
 
 
@@ -643,7 +647,11 @@ def config_from_make_conf(location="/etc/", profile_override=None, **kwargs):
     # *everything* in the conf_dict must be str values also.
     distdir = normpath(os.environ.get(
         "DISTDIR", conf_dict.pop("DISTDIR", pjoin(main_repo, "distdir"))))
-    add_fetcher(new_config, conf_dict, distdir)
+    add_fetcher(
+        new_config, conf_dict, distdir,
+        chksum_cache=pjoin(
+            config_root, 'var', 'cache', 'edb', 'distfiles-chksums.sqlite'),
+        paranoid_chksums=('paranoid-chksums' in features))
 
     # finally... domain.
     conf_dict.update({
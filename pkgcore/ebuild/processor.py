@@ -20,7 +20,8 @@ design) reduces regen time by over 40% compared to portage-2.1
 
 __all__ = (
     "request_ebuild_processor", "release_ebuild_processor", "EbuildProcessor",
-    "UnhandledCommand", "expected_ebuild_env")
+    "UnhandledCommand", "expected_ebuild_env", "warm_ebuild_processors",
+    "recycle_ebuild_processor", "pool")
 
 try:
     import threading
@@ -38,11 +39,18 @@ except ImportError:
 inactive_ebp_list = []
 active_ebp_list = []
 
+# wire format used for env and metadata transfers with the daemon; 'length'
+# sends values as byte length prefixed frames, 'line' is the legacy escaped
+# line based format.
+default_framing = 'length'
+
 import contextlib
 import errno
 from functools import partial
+from itertools import islice
 import os
 import signal
+import time
 
 from pkgcore import const, os_data
 from pkgcore.ebuild import const as e_const
@@ -104,6 +112,141 @@ def shutdown_all_processors():
 pkgcore.spawn.atexit_register(shutdown_all_processors)
 
 
+class ProcessorPool(object):
+
+    """
+    Policy and counters for the pool of idle ebuild processors.
+
+    :ivar min_size: number of idle processors to keep spawned per
+        (userpriv, sandbox) class; see :obj:`warm_ebuild_processors`
+    :ivar max_size: maximum number of idle processors kept; None for no limit
+    :ivar max_uses: recycle a processor after it has handled this many
+        ebuilds; None to never recycle on usage
+    :ivar max_rss: recycle a processor once its bash RSS exceeds this many
+        kilobytes; None to never recycle on memory usage
+    :ivar preload: None, or the (eclass_cache, eclasses) last preloaded by
+        :obj:`warm_ebuild_processors`; processors spawned to replace
+        recycled ones get the same preload
+    """
+
+    stat_names = ("hits", "misses", "spawns", "spawn_time", "recycled", "evicted")
+
+    def __init__(self):
+        self.min_size = 0
+        self.max_size = None
+        self.max_uses = None
+        self.max_rss = None
+        self.preload = None
+        self.reset_stats()
+
+    def configure(self, min_size=None, max_size=None, max_uses=None,
+                  max_rss=None):
+        """update the pool policy; options left as None are unchanged"""
+        if min_size is not None:
+            self.min_size = min_size
+        if max_size is not None:
+            self.max_size = max_size
+        if max_uses is not None:
+            self.max_uses = max_uses
+        if max_rss is not None:
+            self.max_rss = max_rss
+
+    def reset_stats(self):
+        self.hits = self.misses = self.spawns = 0
+        self.recycled = self.evicted = 0
+        self.spawn_time = 0.0
+
+    def stats(self):
+        """:return: dict of the pool's counters"""
+        return {x: getattr(self, x) for x in self.stat_names}
+
+    def merge_stats(self, stats):
+        """add the counters from another pool's :obj:`stats` to ours"""
+        for x in self.stat_names:
+            setattr(self, x, getattr(self, x) + stats.get(x, 0))
+
+    def report(self, observer):
+        """write the pool counters out to an observer"""
+        observer.debug(
+            "ebuild processor pool: %i hits, %i misses, %i spawned in %.2fs, "
+            "%i recycled, %i evicted", self.hits, self.misses, self.spawns,
+            self.spawn_time, self.recycled, self.evicted)
+
+    def needs_recycling(self, ebp):
+        """is the processor due for replacement per the pool's policy?"""
+        if ebp.onetime():
+            return False
+        if self.max_uses is not None and ebp.uses >= self.max_uses:
+            return True
+        if self.max_rss is not None:
+            rss = ebp.rss()
+            if rss is not None and rss > self.max_rss:
+                return True
+        return False
+
+pool = ProcessorPool()
+
+
+def _spawn_processor(userpriv, sandbox, fakeroot, save_file):
+    start = time.time()
+    ebp = EbuildProcessor(userpriv, sandbox, fakeroot, save_file)
+    pool.spawns += 1
+    pool.spawn_time += time.time() - start
+    return ebp
+
+
+def _spawn_replacement(userpriv, sandbox):
+    ebp = _spawn_processor(userpriv, sandbox, False, None)
+    if pool.preload is not None:
+        eclass_cache, eclasses = pool.preload
+        ebp.preload_eclasses(eclass_cache, limited_to=eclasses)
+    return ebp
+
+
+def _idle_count(userpriv, sandbox):
+    return sum(1 for x in inactive_ebp_list
+               if x.userprived() == userpriv and x.sandboxed() == sandbox)
+
+
+@_single_thread_allowed
+def warm_ebuild_processors(userpriv=False, sandbox=None, count=None,
+                           eclass_cache=None, eclasses=None):
+    """
+    pre-spawn idle processors, avoiding the spawn latency on request.
+
+    :param userpriv: class of processor to spawn, see
+        :obj:`request_ebuild_processor`
+    :param sandbox: class of processor to spawn, see
+        :obj:`request_ebuild_processor`
+    :param count: number of idle processors wanted; defaults to
+        :obj:`ProcessorPool.min_size`
+    :param eclass_cache: if given, :obj:`pkgcore.ebuild.eclass_cache` instance
+        to preload eclasses from into each idle processor; also recorded as
+        :obj:`ProcessorPool.preload`
+    :param eclasses: eclasses to preload; defaults to all of them
+    :return: number of processors spawned
+    """
+    if sandbox is None:
+        sandbox = pkgcore.spawn.is_sandbox_capable()
+    if count is None:
+        count = pool.min_size
+    if pool.max_size is not None:
+        count = min(count, pool.max_size)
+
+    spawned = 0
+    while _idle_count(userpriv, sandbox) < count:
+        inactive_ebp_list.append(
+            _spawn_processor(userpriv, sandbox, False, None))
+        spawned += 1
+
+    if eclass_cache is not None:
+        pool.preload = (eclass_cache, eclasses)
+        for ebp in inactive_ebp_list:
+            if ebp.userprived() == userpriv and ebp.sandboxed() == sandbox:
+                ebp.preload_eclasses(eclass_cache, limited_to=eclasses)
+    return spawned
+
+
 @_single_thread_allowed
 def request_ebuild_processor(userpriv=False, sandbox=None, fakeroot=False,
                              save_file=None):
@@ -133,9 +276,11 @@ def request_ebuild_processor(userpriv=False, sandbox=None, fakeroot=False,
                     continue
                 inactive_ebp_list.remove(x)
                 active_ebp_list.append(x)
+                pool.hits += 1
                 return x
+        pool.misses += 1
 
-    e = EbuildProcessor(userpriv, sandbox, fakeroot, save_file)
+    e = _spawn_processor(userpriv, sandbox, fakeroot, save_file)
     active_ebp_list.append(e)
     return e
 
@@ -164,14 +309,56 @@ def release_ebuild_processor(ebp):
     assert ebp not in inactive_ebp_list
     # if it's a fakeroot'd process, we throw it away.
     # it's not useful outside of a chain of calls
-    if ebp.onetime() or ebp.locked:
+    if ebp.onetime() or ebp.locked or not ebp.is_alive:
         # ok, so the thing is not reusable either way.
         ebp.shutdown_processor()
+    elif pool.needs_recycling(ebp):
+        ebp.shutdown_processor()
+        pool.recycled += 1
+        # keep the pool at its minimum for this class of processor.
+        userpriv, sandbox = ebp.userprived(), ebp.sandboxed()
+        if _idle_count(userpriv, sandbox) < pool.min_size:
+            inactive_ebp_list.append(_spawn_replacement(userpriv, sandbox))
+    elif pool.max_size is not None and len(inactive_ebp_list) >= pool.max_size:
+        ebp.shutdown_processor()
+        pool.evicted += 1
     else:
         inactive_ebp_list.append(ebp)
     return True
 
 
+@_single_thread_allowed
+def recycle_ebuild_processor(ebp, force=False):
+    """
+    replace a long held processor if it's due for recycling.
+
+    For consumers holding a processor across many ebuilds (regen fex),
+    this should be invoked between ebuilds so the pool's recycling policy
+    can be applied without waiting for the processor's release.
+
+    :param ebp: active :obj:`EbuildProcessor` instance
+    :param force: replace `ebp` regardless of the pool's policy, fex if
+        it can't be trusted anymore; it's shut down rather than reused
+    :return: either `ebp`, or the active processor replacing it
+    """
+    if not force and not pool.needs_recycling(ebp):
+        return ebp
+    try:
+        active_ebp_list.remove(ebp)
+    except ValueError:
+        if not force:
+            return ebp
+    eclass_caching = ebp._eclass_caching
+    ebp.shutdown_processor()
+    if not force:
+        pool.recycled += 1
+    e = _spawn_replacement(ebp.userprived(), ebp.sandboxed())
+    if eclass_caching:
+        e.allow_eclass_caching()
+    active_ebp_list.append(e)
+    return e
+
+
 @contextlib.contextmanager
 def reuse_or_request(ebp=None, **request_kwds):
     """Do a processor operation, locking as necessary.
@@ -247,7 +434,7 @@ class EbuildProcessor(object):
 
     __metaclass__ = WeakRefFinalizer
 
-    def __init__(self, userpriv, sandbox, fakeroot, save_file):
+    def __init__(self, userpriv, sandbox, fakeroot, save_file, framing=None):
         """
         :param sandbox: enables a sandboxed processor
         :param userpriv: enables a userpriv'd processor
@@ -255,6 +442,8 @@ class EbuildProcessor(object):
             this is a mutually exclusive option to sandbox, and
             requires userpriv to be enabled. Violating this will
             result in nastiness.
+        :param framing: wire format to use, either 'length' or 'line';
+            defaults to :obj:`default_framing`
         """
 
         self.lock()
@@ -265,6 +454,9 @@ class EbuildProcessor(object):
         self._eclass_caching = False
         self._outstanding_expects = []
         self._metadata_paths = None
+        self._framed = False
+        # number of ebuilds handled, used for recycling.
+        self.uses = 0
 
         if fakeroot and (sandbox or not userpriv):
             traceback.print_stack()
@@ -359,6 +551,14 @@ class EbuildProcessor(object):
             self.write("sandbox_log?")
             self.__sandbox_log = self.read().split()[0]
         self.dont_export_vars = self.read().split()
+        if framing is None:
+            framing = default_framing
+        if framing != 'line':
+            self.write("set_framing %s" % framing)
+            if not self.expect("framing_ack %s" % framing):
+                raise InitializationError(
+                    "ebd doesn't support %r framing" % (framing,))
+            self._framed = True
         # locking isn't used much, but w/ threading this will matter
         self.unlock()
 
@@ -380,6 +580,7 @@ class EbuildProcessor(object):
         :return: True for success, False for everything else
         """
 
+        self.uses += 1
         self.write("process_ebuild %s" % phase)
         if not self.send_env(env, tmpdir=tmpdir):
             return False
@@ -430,6 +631,22 @@ class EbuildProcessor(object):
                 raise RuntimeError(ie)
             raise
 
+    def write_frame(self, data, flush=True):
+        """send a length prefixed frame to the bash side.
+
+        Unlike :obj:`write`, the data is transferred as is; no escaping or
+        newline termination is required.
+        """
+        if isinstance(data, unicode):
+            data = data.encode('utf8')
+        self.write("%i\n%s" % (len(data), data), flush=flush,
+                   append_newline=False)
+
+    @property
+    def framed(self):
+        """is length prefixed framing in use?"""
+        return self._framed
+
     def _consume_async_expects(self):
         if any(x[0] for x in self._outstanding_expects):
             self.ebd_write.flush()
@@ -516,7 +733,7 @@ class EbuildProcessor(object):
     def clear_preloaded_eclasses(self):
         if self.is_alive:
             self.write("clear_preloaded_eclasses")
-            if not self.expect("clear_preload_eclasses succeeded", flush=True):
+            if not self.expect("clear_preloaded_eclasses succeeded", flush=True):
                 self.shutdown_processor()
                 return False
         self._preloaded_eclasses.clear()
@@ -610,6 +827,22 @@ class EbuildProcessor(object):
             # thrown only if failure occurred instantiation.
             return False
 
+    def rss(self):
+        """
+        return the resident memory usage of the daemon in kilobytes, or
+        None if it can't be determined.
+        """
+        if not self.is_alive:
+            return None
+        try:
+            with open("/proc/%i/status" % self.pid) as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except (EnvironmentError, ValueError, IndexError):
+            pass
+        return None
+
     def shutdown_processor(self, ignore_keyboard_interrupt=False):
         """
         tell the daemon to shut itself down, and mark this instance as dead
@@ -653,6 +886,36 @@ class EbuildProcessor(object):
                 data.append("%s=$'%s'" % (key, val.replace("'", "\\'")))
         return 'export %s' % (' '.join(data),)
 
+    def _generate_env_frames(self, env_dict):
+        """generate key/value frames for an env; the daemon handles quoting.
+
+        :return: (count of variables, frame data) tuple
+        """
+        data = []
+        for key, val in env_dict.iteritems():
+            if key in self.dont_export_vars:
+                continue
+            if not key[0].isalpha():
+                raise KeyError("%s: bash doesn't allow digits as the first char" % (key,))
+            if not isinstance(val, basestring):
+                raise ValueError("_generate_env_frames was fed a bad value; key=%s, val=%s"
+                                 % (key, val))
+            if isinstance(val, unicode):
+                val = val.encode('utf8')
+            data.append("%i\n%s%i\n%s" % (len(key), key, len(val), val))
+        return len(data), ''.join(data)
+
+    def _generate_env(self, env_dict):
+        """generate an env transfer in the negotiated framing.
+
+        :return: (size argument, data) tuple; the size argument is the
+            number of frames if framed, else the byte count of the data
+        """
+        if self._framed:
+            return self._generate_env_frames(env_dict)
+        data = self._generate_env_str(env_dict)
+        return len(data), data
+
     def send_env(self, env_dict, async=False, tmpdir=None):
         """
         transfer the ebuild's desired env (env_dict) to the running daemon
@@ -660,8 +923,14 @@ class EbuildProcessor(object):
         :type env_dict: mapping with string keys and values.
         :param env_dict: the bash env.
         """
-        data = self._generate_env_str(env_dict)
         old_umask = os.umask(0002)
+        if self._framed and not tmpdir:
+            count, data = self._generate_env_frames(env_dict)
+            self.write("start_receiving_env framed %i\n%s" %
+                       (count, data), append_newline=False)
+            os.umask(old_umask)
+            return self.expect("env_received", async=async, flush=True)
+        data = self._generate_env_str(env_dict)
         if tmpdir:
             path = pjoin(tmpdir, 'ebd-env-transfer')
             fileutils.write_file(path, 'wb', data)
@@ -709,9 +978,12 @@ class EbuildProcessor(object):
                                extra_commands={}):
         self._ensure_metadata_paths(const.HOST_NONROOT_PATHS)
 
+        self.uses += 1
         e = expected_ebuild_env(package_inst, depends=True)
-        data = self._generate_env_str(e)
-        self.write("%s %i\n%s" % (command, len(data), data), append_newline=False)
+        size, data = self._generate_env(e)
+        if self._framed:
+            command += '_framed'
+        self.write("%s %i\n%s" % (command, size, data), append_newline=False)
 
         updates = None
         if self._eclass_caching:
@@ -778,10 +1050,89 @@ class EbuildProcessor(object):
             metadata_keys[line[0]] = line[1]
 
         self._run_depend_like_phase('gen_metadata', package_inst, eclass_cache,
-                                    {"key": receive_key})
+                                    {"key": receive_key,
+                                     "key_frame": partial(
+                                         receive_key_frame, metadata_keys)})
 
         return metadata_keys
 
+    def get_keys_batch(self, packages, eclass_cache, batch_size=32):
+        """
+        request metadata be regenerated for multiple ebuilds
+
+        Ebuilds are sent to the daemon in batches of `batch_size`, which are
+        sourced back to back without waiting on a python round trip per
+        ebuild; results are streamed back as they're generated.
+
+        :param packages: iterable of :obj:`pkgcore.ebuild.ebuild_src.package`
+            instances to regenerate
+        :param eclass_cache: :obj:`pkgcore.ebuild.eclass_cache` instance to use
+            for eclass access
+        :return: iterable of (package, dict) pairs; dict is None if sourcing
+            that ebuild failed
+        """
+        packages = iter(packages)
+        while True:
+            batch = list(islice(packages, batch_size))
+            if not batch:
+                break
+            for result in self._run_depend_batch(batch, eclass_cache):
+                yield result
+
+    def _run_depend_batch(self, batch, eclass_cache):
+        self._ensure_metadata_paths(const.HOST_NONROOT_PATHS)
+        self.uses += len(batch)
+
+        data = []
+        for pkg in batch:
+            size, env = self._generate_env(expected_ebuild_env(pkg, depends=True))
+            data.append("%i\n%s" % (size, env))
+        command = "gen_metadata_batch"
+        if self._framed:
+            command += "_framed"
+        self.write("%s %i\n%s" % (command, len(batch), ''.join(data)),
+                   append_newline=False)
+        del data
+
+        results = []
+        metadata_keys = {}
+
+        def receive_key(self, line):
+            line = line.split("=", 1)
+            if len(line) != 2:
+                raise InternalError(line, "malformed key line in batch result")
+            metadata_keys[line[0]] = line[1]
+
+        def receive_result(self, line):
+            idx, status = line.split()
+            if int(idx) != len(results):
+                raise InternalError(line, "batch results out of order")
+            if status == "succeeded":
+                results.append((batch[len(results)], metadata_keys.copy()))
+            else:
+                results.append((batch[len(results)], None))
+            metadata_keys.clear()
+
+        updates = None
+        if self._eclass_caching:
+            updates = set()
+        commands = {
+            "key": receive_key,
+            "key_frame": partial(receive_key_frame, metadata_keys),
+            "batch_result": receive_result,
+            "request_inherit": partial(
+                inherit_handler, eclass_cache, updates=updates),
+        }
+        if not self.generic_handler(additional_commands=commands) or \
+                len(results) != len(batch):
+            raise InternalError(
+                None, "batch metadata generation returned %i results, "
+                "expected %i" % (len(results), len(batch)))
+
+        if updates:
+            self.preload_eclasses(eclass_cache, limited_to=updates, async=True)
+        return results
+
     # this basically handles all hijacks from the daemon, whether
     # confcache or portageq.
     def generic_handler(self, additional_commands=None):
@@ -849,6 +1200,21 @@ class EbuildProcessor(object):
             self.unlock()
             return v
 
+def receive_key_frame(metadata_keys, ebp, line):
+    """
+    Callback receiving a framed metadata key; the line is the key name
+    and byte length of the value, which follows raw.
+
+    Not for normal consumption.
+    """
+    try:
+        key, size = line.split()
+        size = int(size)
+    except (AttributeError, ValueError):
+        raise InternalError(line, "malformed key_frame line")
+    metadata_keys[key] = ebp.ebd_read.read(size)
+
+
 def inherit_handler(ecache, ebp, line, updates=None):
     """
     Callback for implementing inherit digging into eclass_cache.
@@ -871,10 +1237,14 @@ def inherit_handler(ecache, ebp, line, updates=None):
         ebp.write("path")
         ebp.write(eclass.path)
     else:
-        # XXX $10 this doesn't work.
         value = eclass.text_fileobj().read()
-        ebp.write("transfer")
-        ebp.write(value)
+        if ebp.framed:
+            ebp.write("transfer_frame")
+            ebp.write_frame(value)
+        else:
+            # XXX $10 this doesn't work.
+            ebp.write("transfer")
+            ebp.write(value)
 
     if updates is not None:
         updates.add(line)
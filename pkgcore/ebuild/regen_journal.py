@@ -0,0 +1,179 @@
+# License: GPL2/BSD
+
+"""
+persistent journal of ebuild/eclass state from the last regen
+
+Used by incremental regeneration to skip cache validation for packages
+whose ebuild and inherited eclasses are unchanged since the last run.
+"""
+
+__all__ = ("RegenJournal", "default_journal_path", "cache_sidecar_path")
+
+from collections import defaultdict
+import os
+
+from snakeoil import compatibility
+from snakeoil.demandload import demandload
+
+demandload(
+    "errno",
+    "snakeoil:fileutils",
+    "pkgcore.log:logger",
+)
+
+JOURNAL_HEADER = "pkgcore regen journal v1"
+
+
+def cache_sidecar_path(repo, suffix):
+    """Return a path for regen state stored next to a repo's cache, or None.
+
+    Such state is stored alongside the first writable cache that has an
+    on disk location, since that's where regen results end up.
+    """
+    for cache in getattr(repo, 'cache', ()):
+        location = getattr(cache, 'location', None)
+        if location is not None and not cache.readonly:
+            return location.rstrip(os.path.sep) + suffix
+    return None
+
+
+def default_journal_path(repo):
+    """Return the default journal location for a repo, or None."""
+    return cache_sidecar_path(repo, '.regen-journal')
+
+
+class RegenJournal(object):
+
+    """
+    Record of ebuild mtimes and eclass checksums from the last regen.
+
+    :ivar entries: mapping of cpv string to (ebuild mtime, inherited eclasses)
+    :ivar eclasses: mapping of eclass name to md5 from the last regen
+    """
+
+    def __init__(self, repo, path):
+        """
+        :param repo: :obj:`pkgcore.ebuild.repository._UnconfiguredTree` instance
+        :param path: on disk location of the journal
+        """
+        self.repo = repo
+        self.path = path
+        self.entries, self.eclasses = self._read(path)
+        self._pending = {}
+        self._eclass_chfs = None
+
+    @staticmethod
+    def _read(path):
+        entries, eclasses = {}, {}
+        try:
+            with open(path, 'r') as f:
+                if f.readline().rstrip('\n') != JOURNAL_HEADER:
+                    logger.warning(
+                        "ignoring regen journal %s: unknown format", path)
+                    return {}, {}
+                for line in f:
+                    line = line.rstrip('\n').split('\t')
+                    if line[0] == 'eclass':
+                        eclasses[line[1]] = line[2]
+                    elif line[0] == 'ebuild':
+                        entries[line[1]] = (
+                            long(line[2]), tuple(line[3].split()))
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                logger.warning("failed reading regen journal %s: %s", path, e)
+            return {}, {}
+        except compatibility.IGNORED_EXCEPTIONS:
+            raise
+        except Exception as e:
+            logger.warning("corrupt regen journal %s: %s; ignoring it", path, e)
+            return {}, {}
+        return entries, eclasses
+
+    def _get_eclass_chfs(self):
+        return dict((eclass, '%x' % data.md5) for eclass, data in
+                    self.repo.eclass_cache.eclasses.iteritems())
+
+    def consumers(self):
+        """Return the reverse map of eclass to the cpvs inheriting it."""
+        d = defaultdict(set)
+        for cpv, (mtime, inherited) in self.entries.iteritems():
+            for eclass in inherited:
+                d[eclass].add(cpv)
+        return d
+
+    def changed_eclasses(self):
+        current = self._eclass_chfs
+        if current is None:
+            current = self._eclass_chfs = self._get_eclass_chfs()
+        old = self.eclasses
+        changed = set(x for x, chf in current.iteritems() if old.get(x) != chf)
+        changed.update(x for x in old if x not in current)
+        return changed
+
+    def iter_stale(self, force=False):
+        """Yield the repo's packages requiring regeneration.
+
+        A package is stale if it's unknown to the journal, its ebuild mtime
+        changed, or any eclass it inherited changed.
+
+        :param force: if True, every package is considered stale
+        """
+        consumers = self.consumers()
+        dirty = set()
+        for eclass in self.changed_eclasses():
+            dirty.update(consumers.get(eclass, ()))
+        entries = self.entries
+        pending = self._pending
+        for pkg in self.repo:
+            try:
+                mtime = long(os.stat(pkg.path).st_mtime)
+            except EnvironmentError:
+                # let the regen itself report on it.
+                yield pkg
+                continue
+            cpv = pkg.cpvstr
+            pending[cpv] = mtime
+            entry = entries.get(cpv)
+            if force or entry is None or entry[0] != mtime or cpv in dirty:
+                entries.pop(cpv, None)
+                yield pkg
+
+    def make_entry(self, pkg, data):
+        """Generate the journal entry for a freshly regenerated package.
+
+        :param data: metadata returned from the regen of `pkg`
+        :return: (cpv string, entry) tuple for :obj:`set_entry`
+        """
+        inherited = tuple(sorted(data.get('_eclasses_', ())))
+        return pkg.cpvstr, (self._pending.get(pkg.cpvstr), inherited)
+
+    def set_entry(self, cpv, entry):
+        if entry[0] is not None:
+            self.entries[cpv] = entry
+
+    def record(self, pkg, data):
+        self.set_entry(*self.make_entry(pkg, data))
+
+    def save(self):
+        """Write the journal out, dropping packages no longer in the repo."""
+        pending = self._pending
+        self.entries = dict((cpv, entry) for cpv, entry in
+                            self.entries.iteritems() if cpv in pending)
+        eclass_chfs = self._eclass_chfs
+        if eclass_chfs is None:
+            eclass_chfs = self._get_eclass_chfs()
+        f = None
+        try:
+            f = fileutils.AtomicWriteFile(self.path, binary=False, perms=0664)
+            f.write(JOURNAL_HEADER + "\n")
+            for eclass, chf in sorted(eclass_chfs.iteritems()):
+                f.write("eclass\t%s\t%s\n" % (eclass, chf))
+            for cpv, (mtime, inherited) in sorted(self.entries.iteritems()):
+                f.write("ebuild\t%s\t%i\t%s\n" %
+                        (cpv, mtime, ' '.join(inherited)))
+            f.close()
+        except EnvironmentError as e:
+            logger.error("failed writing regen journal %s: %s", self.path, e)
+        finally:
+            if f is not None:
+                f.discard()
@@ -8,11 +8,11 @@ ebuild repository, specific to gentoo ebuild trees (whether cvs or rsync)
 __all__ = ("tree", "slavedtree",)
 
 from functools import partial
-from itertools import imap, ifilterfalse
+from itertools import imap, ifilterfalse, islice
 import os
 import stat
 
-from snakeoil import klass
+from snakeoil import compatibility, klass
 from snakeoil.bash import iter_read_bash, read_dict
 from snakeoil.compatibility import intern, raise_from
 from snakeoil.containers import InvertedContains
@@ -22,6 +22,7 @@ from snakeoil.obj import make_kls
 from snakeoil.osutils import listdir_files, listdir_dirs, pjoin
 from snakeoil.weakrefs import WeakValCache
 
+from pkgcore import operations as _operations_mod
 from pkgcore.config import ConfigHint, configurable
 from pkgcore.ebuild import ebuild_src
 from pkgcore.ebuild import eclass_cache as eclass_cache_module
@@ -32,32 +33,49 @@ demandload(
     'errno',
     'operator:attrgetter',
     'random:shuffle',
-    'snakeoil.chksum:get_chksums',
     'snakeoil.data_source:local_source',
     'pkgcore.ebuild:ebd,digest,repo_objs,atom,profiles,processor',
     'pkgcore.ebuild:errors@ebuild_errors',
+    'pkgcore.ebuild:tree_index',
     'pkgcore.fs.livefs:iter_scan',
     'pkgcore.log:logger',
     'pkgcore.package:errors@pkg_errors',
+    'pkgcore:spawn',
     'pkgcore.util.packages:groupby_pkg',
+    'pkgcore.util.thread_pool:map_async',
 )
 
 
 class repo_operations(_repo_ops.operations):
 
-    def _cmd_implementation_digests(self, domain, matches, observer, **options):
+    @_operations_mod.is_standalone
+    def _cmd_api_flush_cache(self, observer=None):
+        _repo_ops.operations._cmd_api_flush_cache(self, observer=observer)
+        index = self.repo._tree_index
+        if index is not None:
+            index.save()
+
+    def _cmd_implementation_digests(self, domain, matches, observer, jobs=1,
+                                    **options):
         manifest_config = self.repo.config.manifests
         if manifest_config.disabled:
             observer.info("repo %s has manifests diabled" % (self.repo,))
             return
         required = manifest_config.hashes
-        ret = False
+        # package dirs in order, with the distfiles each needs; the files
+        # are hashed in one go so ones shared between packages are only
+        # hashed once.  Dirs whose files failed to fetch or hash are
+        # skipped, the rest still get their manifests.
+        pkgdirs = []
+        distfiles = {}
+        failed = []
         for key_query in sorted(set(match.unversioned_atom for match in matches)):
             observer.info("generating digests for %s for repo %s", key_query, self.repo)
             packages = self.repo.match(key_query, sorter=sorted)
-            if packages:
-                observer.info("generating digests for %s for repo %s", key_query, self.repo)
+            if not packages:
+                continue
             pkgdir_fetchables = {}
+            pkgdir_fetchers = {}
             try:
                 for pkg in packages:
                     # XXX: needs modification to grab all sources, and also to not
@@ -72,27 +90,72 @@ class repo_operations(_repo_ops.operations):
                             "pkg %s doesn't support fetching, can't generate manifest/digest info\n",
                             pkg)
                     if not pkg_ops.mirror(observer):
+                        # a partial manifest would drop the pkg's distfiles;
+                        # skip its dir, carrying on with the rest.
                         observer.error("failed fetching for pkg %s", pkg)
-                        return False
+                        failed.append(key_query)
+                        break
 
-                    fetchables = pkg_ops._mirror_op.verified_files
-                    for path, fetchable in fetchables.iteritems():
-                        d = dict(zip(required, get_chksums(path, *required)))
-                        fetchable.chksums = d
+                    mirror_op = pkg_ops._mirror_op
+                    for path in mirror_op.verified_files:
+                        pkgdir_fetchers.setdefault(path, mirror_op.fetcher)
                     # should report on conflicts here...
-                    pkgdir_fetchables.update(fetchables.iteritems())
-
-                pkgdir_fetchables = sorted(pkgdir_fetchables.itervalues())
-                digest.serialize_manifest(
-                    os.path.dirname(pkg.ebuild.get_path()),
-                    pkgdir_fetchables, chfs=required, thin=manifest_config.thin)
-                ret = True
+                    pkgdir_fetchables.update(mirror_op.verified_files.iteritems())
+                else:
+                    for path, fetcher in pkgdir_fetchers.iteritems():
+                        distfiles.setdefault(path, fetcher)
+                    pkgdirs.append((key_query,
+                                    os.path.dirname(pkg.ebuild.get_path()),
+                                    pkgdir_fetchables))
             finally:
                 for pkg in packages:
                     # done since we do hackish shit above
                     # should be uneeded once this is cleaned up
                     pkg.release_cached_data(all=True)
-        return ret
+
+        chksums, hash_failures = _hash_distfiles(distfiles, required, jobs)
+        for path, e in sorted(hash_failures.iteritems()):
+            observer.error("failed hashing %s: %s", path, e)
+        for key_query, pkgdir, pkgdir_fetchables in pkgdirs:
+            if hash_failures.viewkeys() & pkgdir_fetchables.viewkeys():
+                failed.append(key_query)
+                continue
+            for path, fetchable in pkgdir_fetchables.iteritems():
+                fetchable.chksums = chksums[path]
+            digest.serialize_manifest(
+                pkgdir, sorted(pkgdir_fetchables.itervalues()),
+                chfs=required, thin=manifest_config.thin)
+        if failed:
+            observer.error(
+                "failed generating digests for: %s",
+                ', '.join(str(x) for x in failed))
+            return False
+        return bool(pkgdirs)
+
+
+def _hash_distfiles(distfiles, chfs, jobs=1):
+    """Compute the chksums of distfiles, up to jobs files at once.
+
+    :param distfiles: mapping of path to the fetcher that fetched it
+    :return: (chksums, failures) pair; dicts of path to a dict of chksums,
+        and of path to the exception hashing it raised
+    """
+    results = {}
+    failures = {}
+
+    def hash_files(queue):
+        for path in queue:
+            try:
+                results[path] = dict(zip(
+                    chfs, distfiles[path].get_chksums(path, *chfs)))
+            except Exception as e:
+                failures[path] = e
+
+    if jobs > 1 and len(distfiles) > 1:
+        map_async(sorted(distfiles), hash_files, threads=jobs)
+    else:
+        hash_files(sorted(distfiles))
+    return results, failures
 
 
 def _sort_eclasses(config, raw_repo, eclasses):
@@ -331,6 +394,34 @@ class _UnconfiguredTree(prototype.tree):
             cats = tuple(imap(intern, cats))
         return cats
 
+    @klass.jit_attr
+    def _tree_index(self):
+        path = tree_index.default_index_path(self)
+        if path is None:
+            return None
+        index = tree_index.TreeIndex(self.base, path)
+        if index.writable():
+            # regens save it via flush_cache; anything else listing the tree
+            # (pquery, pmerge, ...) saves what it listed on exit.
+            spawn.atexit_register(index.save)
+        return index
+
+    def _list_dir(self, relpath, lister):
+        """list a directory of the tree via lister, consulting the tree index"""
+        index = self._tree_index
+        if index is None:
+            return lister(pjoin(self.base, relpath))
+        return index.listing(relpath, lister)
+
+    def _list_categories(self, path):
+        return tuple(ifilterfalse(
+            self.false_categories.__contains__,
+            (x for x in listdir_dirs(path) if x[0:1] != ".")))
+
+    def _list_packages(self, path):
+        return tuple(ifilterfalse(
+            self.false_packages.__contains__, listdir_dirs(path)))
+
     def _get_categories(self, *optional_category):
         # why the auto return? current porttrees don't allow/support
         # categories deeper then one dir.
@@ -341,17 +432,14 @@ class _UnconfiguredTree(prototype.tree):
         if cats is not None:
             return cats
         try:
-            return tuple(imap(intern, ifilterfalse(
-                self.false_categories.__contains__,
-                (x for x in listdir_dirs(self.base) if x[0:1] != "."))))
+            return tuple(imap(intern, self._list_dir('', self._list_categories)))
         except EnvironmentError as e:
             raise_from(KeyError("failed fetching categories: %s" % str(e)))
 
     def _get_packages(self, category):
-        cpath = pjoin(self.base, category.lstrip(os.path.sep))
         try:
-            return tuple(ifilterfalse(
-                self.false_packages.__contains__, listdir_dirs(cpath)))
+            return self._list_dir(
+                category.lstrip(os.path.sep), self._list_packages)
         except EnvironmentError as e:
             if e.errno == errno.ENOENT:
                 if self.hardcoded_categories and category in self.hardcoded_categories or \
@@ -362,15 +450,18 @@ class _UnconfiguredTree(prototype.tree):
                 "failed fetching packages for category %s: %s" %
                 (pjoin(self.base, category.lstrip(os.path.sep)), str(e))))
 
-    def _get_versions(self, catpkg):
-        cppath = pjoin(self.base, catpkg[0], catpkg[1])
-        pkg = catpkg[-1] + "-"
+    def _list_versions(self, package, path):
+        pkg = package + "-"
         lp = len(pkg)
         extension = self.extension
         ext_len = -len(extension)
+        return tuple(x[lp:ext_len] for x in listdir_files(path)
+                     if x[ext_len:] == extension and x[:lp] == pkg)
+
+    def _get_versions(self, catpkg):
         try:
-            ret = tuple(x[lp:ext_len] for x in listdir_files(cppath)
-                        if x[ext_len:] == extension and x[:lp] == pkg)
+            ret = self._list_dir(pjoin(catpkg[0], catpkg[1]),
+                                 partial(self._list_versions, catpkg[1]))
             if any(('scm' in x or '-try' in x) for x in ret):
                 if not self.ignore_paludis_versioning:
                     for x in ret:
@@ -474,6 +565,12 @@ class _UnconfiguredTree(prototype.tree):
         return [neg, pos]
 
     def _regen_operation_helper(self, **kwds):
+        batch_size = int(kwds.get('batch_size', 1))
+        if batch_size > 1:
+            return _BatchedRegenOpHelper(
+                self, force=bool(kwds.get('force', False)),
+                eclass_caching=bool(kwds.get('eclass_caching', True)),
+                batch_size=batch_size)
         return _RegenOpHelper(
             self, force=bool(kwds.get('force', False)),
             eclass_caching=bool(kwds.get('eclass_caching', True)))
@@ -489,6 +586,7 @@ class _RegenOpHelper(object):
             self.ebp.allow_eclass_caching()
 
     def __call__(self, pkg):
+        self.ebp = processor.recycle_ebuild_processor(self.ebp)
         return pkg._fetch_metadata(ebp=self.ebp, force_regen=self.force)
 
     def finish(self):
@@ -498,6 +596,44 @@ class _RegenOpHelper(object):
         self.ebp = None
 
 
+class _BatchedRegenOpHelper(_RegenOpHelper):
+
+    """Regen helper sending stale ebuilds to the processor in batches."""
+
+    def __init__(self, repo, batch_size=32, **kwds):
+        _RegenOpHelper.__init__(self, repo, **kwds)
+        self.batch_size = batch_size
+        self.factory = repo.package_class
+
+    def regen_batch(self, pkgs):
+        pkgs = iter(pkgs)
+        while True:
+            batch = list(islice(pkgs, self.batch_size))
+            if not batch:
+                break
+            self.ebp = processor.recycle_ebuild_processor(self.ebp)
+            done = set()
+            try:
+                for pkg, data in self.factory._get_metadata_batch(
+                        batch, ebp=self.ebp, force_regen=self.force,
+                        batch_size=self.batch_size):
+                    done.add(pkg)
+                    yield pkg, data
+            except compatibility.IGNORED_EXCEPTIONS:
+                raise
+            except Exception as e:
+                # the processor can't be trusted to be in sync anymore;
+                # swap it out and fail the remainder of the batch.
+                self._replace_processor()
+                for pkg in batch:
+                    if pkg not in done:
+                        yield pkg, e
+
+    def _replace_processor(self):
+        # the old processor is shut down rather than released as idle.
+        self.ebp = processor.recycle_ebuild_processor(self.ebp, force=True)
+
+
 class _SlavedTree(_UnconfiguredTree):
 
     """
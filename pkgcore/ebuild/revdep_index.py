@@ -0,0 +1,334 @@
+# License: GPL2/BSD
+
+"""
+persistent reverse dependency index of an ebuild repo
+
+Finding what depends on a package normally means parsing the dependencies of
+every package in the repo.  This records the package keys each cpv's
+DEPEND/RDEPEND/PDEPEND reference, pulled from the repo's metadata cache, so
+only packages that can possibly depend on a target need to be examined.
+
+Each record is stamped with the stat data of its ebuild and cache entry, thus
+bringing the index up to date costs a couple of stats per cpv; only entries
+whose stamp changed are read from the cache.
+"""
+
+__all__ = ("RevdepIndex", "default_index_path", "get_index")
+
+from collections import defaultdict
+from hashlib import md5
+import os
+
+from snakeoil.chksum import LazilyHashedPath
+from snakeoil.demandload import demandload
+from snakeoil.osutils import pjoin
+
+demandload(
+    "errno",
+    "snakeoil:fileutils",
+    "pkgcore.cache:errors@cache_errors",
+    "pkgcore.ebuild:atom,repository",
+    "pkgcore.ebuild.regen_journal:cache_sidecar_path",
+    "pkgcore.log:logger",
+    "pkgcore.util.repo_utils:get_raw_repos",
+)
+
+INDEX_HEADER = "pkgcore revdep index v2"
+
+dep_keys = ("DEPEND", "RDEPEND", "PDEPEND")
+_dep_operators = frozenset(("||", "^^", "??", "(", ")"))
+
+
+def _stat_token(path):
+    try:
+        st = os.stat(path)
+    except EnvironmentError as e:
+        if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+            raise
+        return '-'
+    return '%r,%i,%i' % (st.st_mtime, st.st_size, st.st_ino)
+
+
+def _entry_dir(cache):
+    """Return the directory a cache stores an entry per file in, or None."""
+    cache = getattr(cache, 'backend', cache)
+    location = getattr(cache, 'location', None)
+    if location is not None and os.path.isdir(location):
+        return location
+    return None
+
+
+def default_index_path(repo):
+    """Return the default index location for a repo, or None."""
+    return cache_sidecar_path(repo, '.revdep-index')
+
+
+def get_index(repo):
+    """Return an up to date index for a repo, or None if it can't have one.
+
+    Configured and multiplexed repos are driven down to their raw repos;
+    all of those must be ebuild repos with a writable cache.
+    """
+    indexes = []
+    for raw_repo in get_raw_repos(repo):
+        if not isinstance(raw_repo, repository._UnconfiguredTree):
+            return None
+        path = default_index_path(raw_repo)
+        if path is None:
+            return None
+        indexes.append(RevdepIndex(raw_repo, path))
+    if len(indexes) != 1:
+        return None
+    index = indexes[0]
+    index.update()
+    index.save()
+    return index
+
+
+class RevdepIndex(object):
+
+    """
+    Package keys referenced by the dependencies of each cpv of a repo.
+
+    :ivar entries: mapping of cpv string to (token, keys) pairs; the token
+        identifies the cache entry the keys were pulled from
+    :ivar unindexed: cpvs of the repo lacking a valid cache entry as of the
+        last :obj:`update`
+    :ivar stamps: mapping of cpv string to the stat data of its ebuild and
+        cache entries as of the last :obj:`update`
+    :ivar state: digest of the eclasses and of the caches not stored an
+        entry per file, as of the last :obj:`update`
+    """
+
+    def __init__(self, repo, path):
+        """
+        :param repo: :obj:`pkgcore.ebuild.repository._UnconfiguredTree` instance
+        :param path: on disk location of the index
+        """
+        self.repo = repo
+        self.path = path
+        self.state, self.stamps, self.entries, self.unindexed = \
+            self._read(path)
+        self.dirty = False
+        self._key_cache = {}
+        self._cps = {}
+        self._reverse = None
+
+    @staticmethod
+    def _read(path):
+        empty = (None, {}, {}, set())
+        stamps, entries, unindexed = {}, {}, set()
+        try:
+            with open(path, 'r') as f:
+                if f.readline().rstrip('\n') != INDEX_HEADER:
+                    logger.warning(
+                        "ignoring revdep index %s: unknown format", path)
+                    return empty
+                tag, state = f.readline().rstrip('\n').split('\t')
+                if tag != 'state':
+                    raise ValueError("missing state")
+                for line in f:
+                    cpv, stamp, token, keys = line.rstrip('\n').split('\t')
+                    stamps[cpv] = stamp
+                    if token == '-':
+                        unindexed.add(cpv)
+                    else:
+                        entries[cpv] = (token, frozenset(keys.split()))
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                logger.warning("failed reading revdep index %s: %s", path, e)
+            return empty
+        except ValueError:
+            logger.warning("ignoring corrupt revdep index %s", path)
+            return empty
+        return state, stamps, entries, unindexed
+
+    def _make_state(self, caches):
+        l = []
+        for cache in caches:
+            if _entry_dir(cache) is not None:
+                l.append('entries')
+                continue
+            location = getattr(
+                getattr(cache, 'backend', cache), 'location', None)
+            if location is None:
+                # nothing to go on; never trust what was recorded.
+                return None
+            # sqlite writes may only have reached its write ahead log.
+            l.extend(_stat_token(location + x) for x in ('', '-wal'))
+        for name, eclass in sorted(self.repo.eclass_cache.eclasses.iteritems()):
+            l.append('%s=%s:%s' % (name, eclass.path, eclass.mtime))
+        return md5(' '.join(l)).hexdigest()
+
+    def _make_stamp(self, entry_dirs, cpv, ebuild):
+        l = [_stat_token(ebuild)]
+        l.extend(_stat_token(pjoin(x, cpv)) for x in entry_dirs if x)
+        return ':'.join(l)
+
+    @staticmethod
+    def _make_token(cache, entry):
+        l = [str(entry.get(cache._chf_key))]
+        for eclass, chfs in entry.get('_eclasses_', ()):
+            l.append('%s=%s' % (eclass, ','.join(str(val) for chf, val in chfs)))
+        return md5(' '.join(l)).hexdigest()
+
+    def _extract_keys(self, entry):
+        keys = set()
+        key_cache = self._key_cache
+        for dep in dep_keys:
+            for token in entry.get(dep, '').split():
+                if token in _dep_operators or token[-1] == '?':
+                    continue
+                key = key_cache.get(token)
+                if key is None:
+                    try:
+                        key = atom.atom(token).key
+                    except atom.MalformedAtom:
+                        key = ''
+                    key_cache[token] = key
+                if key:
+                    keys.add(key)
+        return frozenset(keys)
+
+    def _iter_cache(self, cache):
+        try:
+            for item in cache.iteritems():
+                yield item
+            return
+        except cache_errors.CacheError as e:
+            logger.warning("revdep index: falling back to per entry "
+                           "lookups for %s: %s", cache, e)
+        for cpv in cache.iterkeys():
+            try:
+                yield cpv, cache[cpv]
+            except (KeyError, cache_errors.CacheError):
+                continue
+
+    def _ebuild_path(self, cat, pkg, ver):
+        repo = self.repo
+        return pjoin(repo.location, cat, pkg,
+                     '%s-%s%s' % (pkg, ver, repo.extension))
+
+    def update(self):
+        """Bring the index in line with the repo's metadata cache.
+
+        Only cpvs whose ebuild or cache entry changed since the last update
+        are read from the cache, and of those only ones whose cache entry
+        changed are reparsed; if the eclasses or a cache not storing an
+        entry per file changed, every cpv is.  Entries of caches using mtime
+        checksums are checked against the ebuilds, since that's cheap; other
+        caches are trusted.
+        """
+        repo = self.repo
+        caches = [x for x in repo.cache if x is not None]
+        pkgs = {}
+        for (cat, pkg), vers in repo.versions.iteritems():
+            for ver in vers:
+                pkgs['%s/%s-%s' % (cat, pkg, ver)] = (cat, pkg, ver)
+
+        state = self._make_state(caches)
+        entry_dirs = [_entry_dir(x) for x in caches]
+        stamps = {}
+        stale = set()
+        for cpv, cpv_parts in pkgs.iteritems():
+            stamp = stamps[cpv] = self._make_stamp(
+                entry_dirs, cpv, self._ebuild_path(*cpv_parts))
+            if state is None or state != self.state or \
+                    stamp != self.stamps.get(cpv):
+                stale.add(cpv)
+
+        entries = self.entries
+        valid = dict((cpv, entries[cpv]) for cpv in pkgs
+                     if cpv not in stale and cpv in entries)
+        if stale:
+            self._update_stale(caches, pkgs, stale, valid)
+        if stamps != self.stamps or state != self.state or \
+                len(valid) != len(entries):
+            self.dirty = True
+        self.state = state
+        self.stamps = stamps
+        self.entries = valid
+        self.unindexed = set(pkgs).difference(valid)
+        self._cps = pkgs
+        self._reverse = None
+
+    def _update_stale(self, caches, pkgs, stale, valid):
+        entries = self.entries
+        for cache in caches:
+            validate = cache.chf_type == 'mtime'
+            if len(stale) * 2 > len(pkgs):
+                # a walk of the cache beats looking each up.
+                items = self._iter_cache(cache)
+            else:
+                items = self._lookup(cache, stale)
+            for cpv, entry in items:
+                if cpv not in stale or cpv in valid:
+                    continue
+                if validate:
+                    path = self._ebuild_path(*pkgs[cpv])
+                    try:
+                        # validation replaces the eclass data; use a copy.
+                        if not cache.validate_entry(
+                                dict(entry.iteritems()),
+                                LazilyHashedPath(path), self.repo.eclass_cache):
+                            continue
+                    except EnvironmentError:
+                        continue
+                token = self._make_token(cache, entry)
+                old = entries.get(cpv)
+                if old is not None and old[0] == token:
+                    valid[cpv] = old
+                else:
+                    valid[cpv] = (token, self._extract_keys(entry))
+                    self.dirty = True
+
+    @staticmethod
+    def _lookup(cache, cpvs):
+        for cpv in sorted(cpvs):
+            try:
+                yield cpv, cache[cpv]
+            except (KeyError, cache_errors.CacheError):
+                continue
+
+    def dependents(self, key):
+        """Return the (category, package) pairs that may depend on a key.
+
+        Packages lacking a valid cache entry are always included, since
+        their dependencies are unknown.
+        """
+        cps = self._cps
+        reverse = self._reverse
+        if reverse is None:
+            reverse = defaultdict(set)
+            for cpv, (token, keys) in self.entries.iteritems():
+                cp = cps[cpv][:2]
+                for x in keys:
+                    reverse[x].add(cp)
+            self._reverse = reverse
+        result = set(reverse.get(key, ()))
+        result.update(cps[cpv][:2] for cpv in self.unindexed)
+        return result
+
+    def save(self):
+        """Write the index out if it was updated."""
+        if not self.dirty:
+            return
+        f = None
+        try:
+            f = fileutils.AtomicWriteFile(self.path, binary=False, perms=0664)
+            f.write("%s\nstate\t%s\n" % (INDEX_HEADER, self.state))
+            entries = self.entries
+            for cpv, stamp in sorted(self.stamps.iteritems()):
+                token, keys = entries.get(cpv, ('-', ()))
+                f.write("%s\t%s\t%s\t%s\n" % (
+                    cpv, stamp, token, ' '.join(sorted(keys))))
+            f.close()
+            self.dirty = False
+        except EnvironmentError as e:
+            # unprivileged users querying a system repo can't write it.
+            if e.errno not in (errno.EACCES, errno.EPERM, errno.EROFS):
+                logger.warning(
+                    "failed writing revdep index %s: %s", self.path, e)
+        finally:
+            if f is not None:
+                f.discard()
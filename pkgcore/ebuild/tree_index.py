@@ -0,0 +1,156 @@
+# License: GPL2/BSD
+
+"""
+persistent index of an ebuild tree's category/package/version layout
+
+Walking a tree means listing thousands of directories; this records each
+listing along with the directory's mtime, inode, link count and size, thus a
+listing is only redone for directories that changed, i.e. those touched by
+the last sync.
+"""
+
+__all__ = ("TreeIndex", "default_index_path")
+
+import os
+import time
+
+from snakeoil.demandload import demandload
+from snakeoil.osutils import pjoin
+
+demandload(
+    "errno",
+    "snakeoil:fileutils",
+    "pkgcore.ebuild.regen_journal:cache_sidecar_path",
+    "pkgcore.log:logger",
+)
+
+INDEX_HEADER = "pkgcore tree index v2"
+
+# directories modified this recently may change again without their mtime
+# changing; don't trust listings of them.
+RACY_WINDOW = 2
+
+
+def _stat_token(st):
+    # the mtime alone misses changes made within the same tick; a
+    # subdirectory removal changes the link count, an entry removal the size
+    # on most filesystems, and replacing the directory its inode.
+    return (st.st_mtime, st.st_ino, st.st_nlink, st.st_size)
+
+
+def default_index_path(repo):
+    """Return the default index location for a repo, or None."""
+    return cache_sidecar_path(repo, '.tree-index')
+
+
+class TreeIndex(object):
+
+    """
+    Directory listings of a tree, each validated by the directory's stat.
+
+    The whole index is pulled in with one read; listings are then checked
+    as they're requested, costing a stat rather than a listdir.
+
+    :ivar entries: mapping of directory path relative to the tree to
+        (token, names) pairs, token being the directory's
+        (mtime, inode, link count, size)
+    :ivar dirty: whether entries differ from what's on disk
+    """
+
+    def __init__(self, base, path):
+        """
+        :param base: on disk location of the tree
+        :param path: on disk location of the index
+        """
+        self.base = base
+        self.path = path
+        self.entries = self._read(path)
+        self.dirty = False
+
+    @staticmethod
+    def _read(path):
+        entries = {}
+        try:
+            with open(path, 'r') as f:
+                if f.readline().rstrip('\n') != INDEX_HEADER:
+                    logger.warning(
+                        "ignoring tree index %s: unknown format", path)
+                    return {}
+                for line in f:
+                    relpath, mtime, ino, nlink, size, names = \
+                        line.rstrip('\n').split('\t')
+                    token = (float(mtime), int(ino), int(nlink), int(size))
+                    entries[relpath] = (token, tuple(names.split()))
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                logger.warning("failed reading tree index %s: %s", path, e)
+            return {}
+        except ValueError:
+            logger.warning("ignoring corrupt tree index %s", path)
+            return {}
+        return entries
+
+    def listing(self, relpath, lister):
+        """Return the names within a directory of the tree.
+
+        :param relpath: directory path relative to the tree; '' for the
+            tree itself
+        :param lister: callable taking the directory's full path, returning
+            the names to record; only invoked if the recorded listing is
+            missing or stale
+        :raise EnvironmentError: if the directory can't be accessed
+        """
+        path = pjoin(self.base, relpath) if relpath else self.base
+        try:
+            token = _stat_token(os.stat(path))
+        except EnvironmentError:
+            self._forget(relpath)
+            raise
+        entry = self.entries.get(relpath)
+        if entry is not None and entry[0] == token:
+            return entry[1]
+
+        names = tuple(lister(path))
+        if entry is not None:
+            # drop whatever was recorded beneath removed directories.
+            for name in set(entry[1]).difference(names):
+                name = pjoin(relpath, name) if relpath else name
+                if name in self.entries:
+                    self._forget(name)
+        if time.time() - token[0] > RACY_WINDOW:
+            self.entries[relpath] = (token, names)
+        else:
+            self.entries.pop(relpath, None)
+        self.dirty = True
+        return names
+
+    def _forget(self, relpath):
+        prefix = relpath + '/'
+        for key in [x for x in self.entries
+                    if x == relpath or x.startswith(prefix)]:
+            del self.entries[key]
+            self.dirty = True
+
+    def writable(self):
+        """Whether the index can be saved."""
+        # saves replace the file, so only its directory needs to be writable.
+        return os.access(os.path.dirname(self.path), os.W_OK)
+
+    def save(self):
+        """Write the index out if it was updated."""
+        if not self.dirty:
+            return
+        f = None
+        try:
+            f = fileutils.AtomicWriteFile(self.path, binary=False, perms=0664)
+            f.write(INDEX_HEADER + '\n')
+            for relpath, (token, names) in sorted(self.entries.iteritems()):
+                f.write("%s\t%r\t%i\t%i\t%i\t%s\n" % (
+                    (relpath,) + token + (' '.join(names),)))
+            f.close()
+            self.dirty = False
+        except EnvironmentError as e:
+            logger.warning("failed writing tree index %s: %s", self.path, e)
+        finally:
+            if f is not None:
+                f.discard()
@@ -29,6 +29,8 @@ demandload(
     'fnmatch',
     'snakeoil:compatibility',
     'pkgcore:os_data',
+    'pkgcore.log:logger',
+    'pkgcore.vdb:owners',
 )
 
 colon_parsed = frozenset([
@@ -455,15 +457,35 @@ class ProtectOwned(FileCollision):
         super(ProtectOwned, self).__init__(*args)
         self.vdb = vdb
 
-    def collision(self, colliding):
-        real_pkgs = (pkg for repo in self.vdb for pkg in repo if pkg.package_is_real)
+    def _indexed_collisions(self, colliding):
+        index = owners.get_index(self.vdb)
+        if index is None:
+            return None
+        by_location = dict((x.location, x) for x in colliding)
+        try:
+            owned = index.owners(by_location)
+        except owners.OwnersIndexError as e:
+            logger.warning("protect-owned: %s", e)
+            return None
         collisions = {}
+        for path, cpvs in owned.iteritems():
+            for cpv in cpvs:
+                collisions.setdefault(cpv, set()).add(by_location[path])
+        return collisions
 
-        # TODO: worth parallelizing this vdb scanning?
-        for pkg in real_pkgs:
-            pkg_file_collisions = pkg.contents.intersection(colliding)
-            if pkg_file_collisions:
-                collisions[pkg.cpvstr] = pkg_file_collisions
+    def collision(self, colliding):
+        # the owners index avoids parsing the CONTENTS of every installed pkg.
+        collisions = self._indexed_collisions(colliding)
+        if collisions is None:
+            real_pkgs = (pkg for repo in self.vdb for pkg in repo
+                         if pkg.package_is_real)
+            collisions = {}
+
+            # TODO: worth parallelizing this vdb scanning?
+            for pkg in real_pkgs:
+                pkg_file_collisions = pkg.contents.intersection(colliding)
+                if pkg_file_collisions:
+                    collisions[pkg.cpvstr] = pkg_file_collisions
 
         if collisions:
             pkg_collisions = [
@@ -675,3 +697,6 @@ def generate_triggers(domain):
 
     yield UninstallIgnore(d["UNINSTALL_IGNORE"])
     yield InfoRegen()
+
+    if domain.merge_durability != "none":
+        yield triggers.SyncMerged(domain.merge_durability)
@@ -7,17 +7,32 @@ prototype fetcher class, all fetchers should derive from this
 
 __all__ = ("fetcher",)
 
+import errno
+import fcntl
 import os
 
 from snakeoil import compatibility
-from snakeoil.chksum import get_handlers, get_chksums
+from snakeoil.chksum import get_handlers
 from snakeoil.compatibility import cmp
+from snakeoil.demandload import demandload
+from snakeoil.osutils import ensure_dirs, pjoin
 
 from pkgcore.fetch import errors
+from pkgcore.util.chksum import get_chksums
+
+demandload('pkgcore.fetch:chksum_cache@chksum_cache_mod')
 
 
 class fetcher(object):
 
+    # :obj:`pkgcore.fetch.chksum_cache.ChksumCache` consulted for chksums
+    chksum_cache = None
+
+    def _setup_chksum_cache(self, location, paranoid=False):
+        if location:
+            self.chksum_cache = chksum_cache_mod.ChksumCache(
+                location, paranoid=paranoid)
+
     def _verify(self, file_location, target, all_chksums=True, handlers=None):
         """
         Internal function for derivatives.
@@ -77,17 +92,78 @@ class fetcher(object):
                         x, target.chksums[x], val))
         else:
             desired_vals = [target.chksums[x] for x in chfs]
-            calced = get_chksums(file_location, *chfs)
+            calced = self.get_chksums(file_location, *chfs)
             for desired, got, chf in zip(desired_vals, calced, chfs):
                 if desired != got:
                     raise errors.FetchFailed(file_location,
                         "Validation handler %s: expected %s, got %s" % (
                         chf, desired, got))
 
+    def get_chksums(self, location, *chksums):
+        """Compute the given chksum types of a file.
+
+        Stored values from the chksum cache are used if the file is
+        unchanged since they were computed.
+        """
+        if self.chksum_cache is not None:
+            return self.chksum_cache.get_chksums(location, *chksums)
+        return get_chksums(location, *chksums)
+
     def __call__(self, fetchable):
         if not fetchable.uri:
             return self.get_path(fetchable)
-        return self.fetch(fetchable)
+        fd = self._lock_fetch(fetchable)
+        try:
+            return self.fetch(fetchable)
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def _lock_fetch(self, fetchable):
+        """Wait for an exclusive lock on fetching a file.
+
+        Fetchers of the same file, be they threads or processes, would
+        otherwise write to it at once; whoever waits finds the file complete
+        once the lock is released.  No lock is taken if the lock file can't
+        be created, e.g. for readonly storage.
+
+        :return: descriptor holding the lock, or None
+        """
+        path = self.get_storage_path()
+        if path is None:
+            return None
+        lockdir = pjoin(path, '.locks')
+        if not ensure_dirs(lockdir, mode=0775, minimal=True):
+            return None
+        try:
+            fd = os.open(pjoin(lockdir, fetchable.filename),
+                         os.O_WRONLY | os.O_CREAT, 0664)
+        except EnvironmentError as e:
+            if e.errno in (errno.EACCES, errno.EPERM, errno.EROFS):
+                return None
+            raise
+        try:
+            # each call opens its own descriptor, thus threads of one
+            # process exclude each other too.
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except:
+            os.close(fd)
+            raise
+        return fd
+
+    def fetch_many(self, targets):
+        """
+        fetch a sequence of fetchables, yielding (fetchable, path) for each
+
+        path is None if fetching failed.  Derivatives capable of fetching
+        concurrently should override this.
+        """
+        for target in targets:
+            try:
+                fp = self(target)
+            except Exception:
+                fp = None
+            yield target, fp
 
     def get_path(self, fetchable):
         """
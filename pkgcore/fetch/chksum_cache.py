@@ -0,0 +1,176 @@
+# License: GPL2/BSD
+
+"""
+persistent cache of the chksums of fetched files
+
+Chksums are stored against the size, mtime, and inode of each file; as
+long as those are unchanged the stored values are used, so verifying an
+untouched DISTDIR costs a stat per file rather than a read of it.
+"""
+
+__all__ = ("ChksumCache", "ChksumCacheError")
+
+import os
+import sqlite3
+import threading
+
+from snakeoil.compatibility import raise_from
+from snakeoil.demandload import demandload
+from snakeoil.osutils import ensure_dirs
+
+from pkgcore.fetch import errors
+from pkgcore.util.chksum import get_chksums
+
+demandload('pkgcore.log:logger')
+
+
+class ChksumCacheError(errors.base):
+    """The chksum cache couldn't be accessed or updated."""
+
+
+def _identity(st):
+    return (st.st_size, repr(st.st_mtime), st.st_ino)
+
+
+def _serialize(chksums):
+    return " ".join("%s:%x" % (k, v) for k, v in sorted(chksums.iteritems()))
+
+
+def _deserialize(data):
+    d = {}
+    for item in data.split():
+        k, v = item.split(":", 1)
+        d[k] = long(v, 16)
+    return d
+
+
+class ChksumCache(object):
+
+    """
+    sqlite backed cache of file chksums, validated via stat
+
+    Failures accessing the database are logged and the cache disabled;
+    chksums are then always computed.
+    """
+
+    def __init__(self, location, paranoid=False):
+        """
+        :param location: path of the database file
+        :param paranoid: if True, stored chksums are never trusted; files
+            are always rehashed, though results are still stored
+        """
+        self.location = location
+        self.paranoid = paranoid
+        self._lock = threading.RLock()
+        self._conn = self._conn_pid = None
+        self.disabled = False
+
+    def writable(self):
+        # the nearest existing path decides; missing directories are created.
+        path = os.path.abspath(self.location)
+        while not os.path.exists(path):
+            path = os.path.dirname(path)
+        return os.access(path, os.W_OK)
+
+    def _get_connection(self):
+        pid = os.getpid()
+        if self._conn is not None and self._conn_pid == pid:
+            return self._conn
+        writable = self.writable()
+        if not writable and not os.path.exists(self.location):
+            return None
+        try:
+            if writable and not ensure_dirs(os.path.dirname(self.location),
+                                            mode=0755, minimal=True):
+                raise ChksumCacheError(
+                    "failed creating the directory for %r" % (self.location,))
+            conn = sqlite3.connect(self.location, timeout=60,
+                                   check_same_thread=False)
+            conn.text_factory = str
+            if writable:
+                # entries are validated on use; a lost update only costs
+                # rehashing a file.
+                conn.executescript(
+                    "PRAGMA synchronous=OFF;"
+                    "CREATE TABLE IF NOT EXISTS files "
+                    "(path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                    "mtime TEXT NOT NULL, inode INTEGER NOT NULL, "
+                    "chksums TEXT NOT NULL);")
+                conn.commit()
+        except sqlite3.Error as e:
+            raise_from(ChksumCacheError("%s: %s" % (self.location, e)))
+        self._conn, self._conn_pid = conn, pid
+        return conn
+
+    def _disable(self, e):
+        logger.warning("disabling chksum cache: %s", e)
+        self.disabled = True
+
+    def _lookup(self, path, identity):
+        try:
+            conn = self._get_connection()
+            if conn is None:
+                return {}
+            row = conn.execute(
+                "SELECT size, mtime, inode, chksums FROM files WHERE path=?",
+                (path,)).fetchone()
+        except (sqlite3.Error, ChksumCacheError) as e:
+            self._disable(e)
+            return {}
+        if row is None or tuple(row[:3]) != identity:
+            return {}
+        try:
+            return _deserialize(row[3])
+        except ValueError:
+            return {}
+
+    def _store(self, path, identity, chksums):
+        if not self.writable():
+            return
+        try:
+            conn = self._get_connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO files "
+                    "(path, size, mtime, inode, chksums) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (path,) + identity + (_serialize(chksums),))
+        except (sqlite3.Error, ChksumCacheError) as e:
+            self._disable(e)
+
+    def get_chksums(self, location, *chksums):
+        """Return the given chksum types of a file, computing only those
+        not stored for its current state.
+
+        :return: list of the chksum values, in the order requested
+        :raise EnvironmentError: if the file can't be read
+        """
+        path = os.path.abspath(location)
+        identity = _identity(os.stat(path))
+        with self._lock:
+            known = {}
+            if not self.disabled and not self.paranoid:
+                known = self._lookup(path, identity)
+        missing = [x for x in chksums if x not in known]
+        if not missing:
+            return [known[x] for x in chksums]
+        known.update(zip(missing, get_chksums(path, *missing)))
+        # don't store values for a file that changed while being read.
+        if _identity(os.stat(path)) == identity:
+            with self._lock:
+                if not self.disabled:
+                    self._store(path, identity, known)
+        return [known[x] for x in chksums]
+
+    def update(self, location, chksums):
+        """Store chksums computed elsewhere for a file's current state."""
+        path = os.path.abspath(location)
+        identity = _identity(os.stat(path))
+        with self._lock:
+            if self.disabled:
+                return
+            known = {}
+            if not self.paranoid:
+                known = self._lookup(path, identity)
+            known.update(chksums)
+            self._store(path, identity, known)
@@ -31,12 +31,14 @@ class fetcher(base.fetcher):
 
     pkgcore_config_type = ConfigHint(
         {'userpriv': 'bool', 'required_chksums': 'list',
-         'distdir': 'str', 'command': 'str', 'resume_command': 'str'},
+         'distdir': 'str', 'command': 'str', 'resume_command': 'str',
+         'chksum_cache': 'str', 'paranoid_chksums': 'bool'},
          allow_unknowns=True)
 
     def __init__(self, distdir, command, resume_command=None,
                  required_chksums=None, userpriv=True, attempts=10,
-                 readonly=False, **extra_env):
+                 readonly=False, chksum_cache=None, paranoid_chksums=False,
+                 **extra_env):
         """
         :param distdir: directory to download files to
         :type distdir: string
@@ -50,9 +52,14 @@ class fetcher(base.fetcher):
         :param userpriv: depriv for fetching?
         :param attempts: max number of attempts before failing the fetch
         :param readonly: controls whether fetching is allowed
+        :param chksum_cache: if set, path of the database chksums of
+            fetched files are stored in
+        :param paranoid_chksums: if True, files are always rehashed rather
+            than trusting stored chksums
         """
         base.fetcher.__init__(self)
         self.distdir = distdir
+        self._setup_chksum_cache(chksum_cache, paranoid_chksums)
         if required_chksums is not None:
             required_chksums = [x.lower() for x in required_chksums]
         else:
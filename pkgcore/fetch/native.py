@@ -0,0 +1,439 @@
+# License: GPL2/BSD
+
+"""
+fetcher downloading files itself via http, https, and ftp
+
+Unlike :obj:`pkgcore.fetch.custom.fetcher` no process is spawned per
+attempt; http connections are kept alive and reused per host, partial
+files are resumed, and files are checksummed as they're written.
+"""
+
+__all__ = ("fetcher",)
+
+from collections import defaultdict
+import errno
+import httplib
+import os
+import Queue
+import socket
+import threading
+import urlparse
+
+from snakeoil.chksum import get_handlers
+from snakeoil.compatibility import raise_from
+from snakeoil.demandload import demandload
+from snakeoil.osutils import ensure_dirs, pjoin
+
+from pkgcore.config import ConfigHint
+from pkgcore.fetch import base, errors, fetchable
+from pkgcore.os_data import portage_uid, portage_gid
+from pkgcore.spawn import is_userpriv_capable
+from pkgcore.util.chksum import MultiHash
+
+demandload(
+    'ftplib',
+    'pkgcore.log:logger',
+)
+
+_redirects = frozenset([301, 302, 303, 307, 308])
+
+
+class _ConnectionPool(object):
+
+    """idle keep-alive http connections, per host"""
+
+    def __init__(self, timeout, max_idle=4):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def get(self, scheme, netloc):
+        """Return (connection, reused)."""
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+        if scheme == "https":
+            kls = httplib.HTTPSConnection
+        else:
+            kls = httplib.HTTPConnection
+        return kls(netloc, timeout=self.timeout), False
+
+    def put(self, scheme, netloc, conn):
+        with self._lock:
+            idle = self._idle[(scheme, netloc)]
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.itervalues():
+                for conn in idle:
+                    conn.close()
+            self._idle.clear()
+
+
+class _TransferFailed(Exception):
+
+    def __init__(self, uri, reason, retry_from_scratch=False):
+        Exception.__init__(self, "%s: %s" % (uri, reason))
+        self.retry_from_scratch = retry_from_scratch
+
+
+class fetcher(base.fetcher):
+
+    pkgcore_config_type = ConfigHint(
+        {'userpriv': 'bool', 'required_chksums': 'list', 'distdir': 'str',
+         'attempts': 'int', 'timeout': 'int', 'jobs': 'int',
+         'chksum_cache': 'str', 'paranoid_chksums': 'bool'},
+        allow_unknowns=True)
+
+    user_agent = "pkgcore"
+    blocksize = 65536
+
+    def __init__(self, distdir, required_chksums=None, userpriv=True,
+                 attempts=10, readonly=False, timeout=60, jobs=4,
+                 chksum_cache=None, paranoid_chksums=False, **extra):
+        """
+        :param distdir: directory to download files to
+        :type distdir: string
+        :param required_chksums: if None, all chksums must be verified,
+            else only chksums listed
+        :type required_chksums: None or sequence
+        :param userpriv: if running as root, hand fetched files to the
+            portage user and group
+        :param attempts: max number of attempts before failing the fetch
+        :param readonly: controls whether fetching is allowed
+        :param timeout: seconds to wait on an unresponsive server
+        :param jobs: max number of files fetched at once by
+            :obj:`fetch_many`
+        :param chksum_cache: if set, path of the database chksums of
+            fetched files are stored in
+        :param paranoid_chksums: if True, files are always rehashed rather
+            than trusting stored chksums
+        """
+        base.fetcher.__init__(self)
+        self.distdir = distdir
+        self._setup_chksum_cache(chksum_cache, paranoid_chksums)
+        if required_chksums is not None:
+            required_chksums = [x.lower() for x in required_chksums]
+        else:
+            required_chksums = []
+        if len(required_chksums) == 1 and required_chksums[0] == "all":
+            self.required_chksums = None
+        else:
+            self.required_chksums = required_chksums
+        self.userpriv = userpriv
+        self.attempts = attempts
+        self.readonly = readonly
+        self.timeout = timeout
+        self.jobs = max(jobs, 1)
+        self._pool = _ConnectionPool(timeout)
+        self._lock = threading.Lock()
+        # failures per host; hosts that failed are tried last.
+        self._host_failures = defaultdict(int)
+
+    def _ensure_distdir(self):
+        kw = {"mode": 0775, "minimal": True}
+        if self.readonly:
+            kw["mode"] = 0555
+        if self.userpriv:
+            kw["gid"] = portage_gid
+        if not ensure_dirs(self.distdir, **kw):
+            raise errors.distdirPerms(
+                self.distdir, "if userpriv, uid must be %i, gid must be %i. "
+                "if not readonly, directory must be 0775, else 0555" % (
+                    portage_uid, portage_gid))
+
+    def _order_uris(self, uris):
+        with self._lock:
+            failures = dict(self._host_failures)
+        # stable; equally reliable hosts keep their given order.
+        return sorted(uris, key=lambda uri: failures.get(
+            urlparse.urlsplit(uri)[1], 0))
+
+    def _record_failure(self, uri):
+        with self._lock:
+            self._host_failures[urlparse.urlsplit(uri)[1]] += 1
+
+    def fetch(self, target):
+        """
+        fetch a file
+
+        :type target: :obj:`pkgcore.fetch.fetchable` instance
+        :return: on disk location of the fetched file
+        :raise errors.FetchFailed: if no uri yielded a valid file
+        """
+        if not isinstance(target, fetchable):
+            raise TypeError(
+                "target must be fetchable instance/derivative: %s" % target)
+
+        self._ensure_distdir()
+        fp = pjoin(self.distdir, target.filename)
+        try:
+            self._verify(fp, target)
+            return fp
+        except errors.MissingDistfile:
+            pass
+        except errors.FetchFailed as e:
+            if not e.resumable:
+                self._unlink(fp)
+
+        last_exc = errors.FetchFailed(fp, "no uris to fetch from")
+        attempts = self.attempts
+        for uri in self._order_uris(list(target.uri)):
+            scheme = urlparse.urlsplit(uri)[0]
+            if scheme not in ("http", "https", "ftp"):
+                logger.debug("skipping unsupported uri %s", uri)
+                continue
+            while attempts > 0:
+                attempts -= 1
+                try:
+                    hashers = self._download(uri, fp, target)
+                    self._verify_download(fp, target, hashers)
+                    self._set_perms(fp)
+                    if self.chksum_cache is not None:
+                        self.chksum_cache.update(fp, hashers.values())
+                    return fp
+                except _TransferFailed as e:
+                    last_exc = errors.FetchFailed(fp, str(e), resumable=True)
+                    if e.retry_from_scratch:
+                        self._unlink(fp)
+                        continue
+                except errors.FetchFailed as e:
+                    last_exc = e
+                    if e.resumable:
+                        # the transfer stopped short; resume from this uri.
+                        continue
+                    self._unlink(fp)
+                except EnvironmentError as e:
+                    if e.errno in (errno.EACCES, errno.EROFS, errno.ENOSPC):
+                        raise_from(errors.UnmodifiableFile(fp, e))
+                    last_exc = errors.FetchFailed(
+                        fp, "%s: %s" % (uri, e), resumable=True)
+                except (httplib.HTTPException, socket.error) as e:
+                    last_exc = errors.FetchFailed(
+                        fp, "%s: %s" % (uri, e), resumable=True)
+                self._record_failure(uri)
+                break
+            if attempts <= 0:
+                break
+        raise last_exc
+
+    def fetch_many(self, targets):
+        """Fetch a sequence of fetchables concurrently.
+
+        Up to :obj:`jobs` files are downloaded at once.  If the generator is
+        closed early, the downloads in progress are completed first.
+        """
+        targets = list(targets)
+        if self.jobs == 1 or len(targets) < 2:
+            for result in base.fetcher.fetch_many(self, targets):
+                yield result
+            return
+
+        work = Queue.Queue()
+        for target in targets:
+            work.put(target)
+        results = Queue.Queue()
+        stop = threading.Event()
+
+        def worker():
+            while not stop.is_set():
+                try:
+                    target = work.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    fp = self(target)
+                except Exception as e:
+                    logger.warning("failed fetching %s: %s",
+                                   target.filename, e)
+                    fp = None
+                results.put((target, fp))
+
+        threads = [threading.Thread(target=worker)
+                   for x in xrange(min(self.jobs, len(targets)))]
+        try:
+            for thread in threads:
+                thread.start()
+            for x in xrange(len(targets)):
+                # a timeout keeps the wait interruptible.
+                while True:
+                    try:
+                        result = results.get(timeout=1)
+                        break
+                    except Queue.Empty:
+                        if not any(t.is_alive() for t in threads) and \
+                                results.empty():
+                            return
+                yield result
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    @staticmethod
+    def _unlink(fp):
+        try:
+            os.unlink(fp)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise_from(errors.UnmodifiableFile(fp, e))
+
+    def _set_perms(self, fp):
+        if self.userpriv and is_userpriv_capable():
+            os.chown(fp, portage_uid, portage_gid)
+        os.chmod(fp, 0664)
+
+    def _download(self, uri, fp, target):
+        """Download uri to fp, resuming if fp exists.
+
+        :return: :obj:`pkgcore.util.chksum.MultiHash` holding the size and
+            chksums of fp
+        """
+        hashers = MultiHash(target.chksums)
+        offset = 0
+        if os.path.exists(fp):
+            # seed the chksums with what's already there.
+            with open(fp, "rb") as f:
+                hashers.update_from_file(f)
+            offset = hashers.size
+        if urlparse.urlsplit(uri)[0] == "ftp":
+            self._download_ftp(uri, fp, offset, hashers)
+        else:
+            self._download_http(uri, fp, offset, hashers)
+        return hashers
+
+    def _request(self, uri, offset):
+        for redirect in xrange(5):
+            scheme, netloc, path, query, fragment = urlparse.urlsplit(uri)
+            if query:
+                path += "?" + query
+            headers = {"User-Agent": self.user_agent}
+            if offset:
+                headers["Range"] = "bytes=%i-" % (offset,)
+            while True:
+                conn, reused = self._pool.get(scheme, netloc)
+                try:
+                    conn.request("GET", path or "/", headers=headers)
+                    resp = conn.getresponse()
+                    break
+                except (httplib.HTTPException, socket.error):
+                    conn.close()
+                    # the server likely dropped the idle connection.
+                    if not reused:
+                        raise
+            if resp.status not in _redirects:
+                return scheme, netloc, conn, resp
+            location = resp.getheader("location")
+            self._release(scheme, netloc, conn, resp)
+            if not location:
+                raise _TransferFailed(uri, "redirect lacks a location")
+            uri = urlparse.urljoin(uri, location)
+        raise _TransferFailed(uri, "too many redirects")
+
+    def _release(self, scheme, netloc, conn, resp):
+        # drain the body so the connection can be reused.
+        try:
+            while resp.read(self.blocksize):
+                pass
+        except (httplib.HTTPException, socket.error):
+            conn.close()
+            return
+        if resp.will_close:
+            conn.close()
+        else:
+            self._pool.put(scheme, netloc, conn)
+
+    def _download_http(self, uri, fp, offset, hashers):
+        scheme, netloc, conn, resp = self._request(uri, offset)
+        if resp.status == 416 and offset:
+            # nothing left beyond what we have; let validation decide.
+            self._release(scheme, netloc, conn, resp)
+            return
+        elif resp.status == 200:
+            if offset:
+                # no range support; start over.
+                hashers.reset()
+            mode = "wb"
+        elif resp.status == 206 and offset:
+            start = resp.getheader("content-range", "").split()
+            start = start[1].split("-")[0] if len(start) > 1 else None
+            if start != str(offset):
+                self._release(scheme, netloc, conn, resp)
+                raise _TransferFailed(
+                    uri, "mismatched content-range", retry_from_scratch=True)
+            mode = "ab"
+        else:
+            self._release(scheme, netloc, conn, resp)
+            raise _TransferFailed(uri, "http status %i %s" % (
+                resp.status, resp.reason))
+        try:
+            with open(fp, mode) as f:
+                while True:
+                    data = resp.read(self.blocksize)
+                    if not data:
+                        break
+                    f.write(data)
+                    hashers.update(data)
+        except:
+            conn.close()
+            raise
+        self._release(scheme, netloc, conn, resp)
+
+    def _download_ftp(self, uri, fp, offset, hashers):
+        netloc, path = urlparse.urlsplit(uri)[1:3]
+        user, passwd = "anonymous", "anonymous@"
+        if "@" in netloc:
+            auth, netloc = netloc.rsplit("@", 1)
+            user, _, passwd = auth.partition(":")
+        host, _, port = netloc.partition(":")
+        ftp = ftplib.FTP(timeout=self.timeout)
+        try:
+            ftp.connect(host, int(port or 21))
+            ftp.login(user, passwd)
+            with open(fp, "ab" if offset else "wb") as f:
+                def write(data):
+                    f.write(data)
+                    hashers.update(data)
+                ftp.retrbinary("RETR %s" % (path,), write,
+                               blocksize=self.blocksize, rest=offset or None)
+        except ftplib.all_errors as e:
+            raise _TransferFailed(uri, e)
+        finally:
+            ftp.close()
+
+    def _verify_download(self, fp, target, hashers):
+        """Validate a download from the chksums computed while writing it."""
+        chksums = target.chksums
+        if "size" in chksums and hashers.size != chksums["size"]:
+            resumable = hashers.size < chksums["size"]
+            raise errors.FetchFailed(
+                fp, "File is too %s." % ("small" if resumable else "big"),
+                resumable=resumable)
+        for chf, val in hashers.values().iteritems():
+            if chf != "size" and val != chksums[chf]:
+                raise errors.FetchFailed(
+                    fp, "Validation handler %s: expected %s, got %s" % (
+                    chf, chksums[chf], val))
+        if hashers.unsupported:
+            # chksums hashlib lacks; these need a read of the file.
+            try:
+                handlers = get_handlers(hashers.unsupported)
+            except KeyError:
+                raise errors.FetchFailed(
+                    fp, "Couldn't find a required checksum handler")
+            self._verify(fp, target, all_chksums=False, handlers=handlers)
+
+    def get_path(self, fetchable):
+        fp = pjoin(self.distdir, fetchable.filename)
+        if self._verify(fp, fetchable) is None:
+            return fp
+        return None
+
+    def get_storage_path(self):
+        return self.distdir
@@ -11,6 +11,7 @@ from operator import attrgetter
 
 from snakeoil.demandload import demandload
 from snakeoil.klass import generic_equality, alias_method
+from snakeoil.mappings import DictMixin
 from snakeoil.osutils import normpath, pjoin
 
 from pkgcore.fs import fs
@@ -206,6 +207,10 @@ class contentsSet(object):
     def __iter__(self):
         return self._dict.itervalues()
 
+    def iterpaths(self):
+        """Yield the location of every entry."""
+        return iter(self._dict)
+
     def __len__(self):
         return len(self._dict)
 
@@ -331,16 +336,20 @@ class contentsSet(object):
         :param start_point: fs filepath all yielded nodes must be within.
         """
 
+        cn_path = self._child_nodes_root(start_point).rstrip(path.sep) + path.sep
+        for x in self:
+            # what about sym targets?
+            if x.location.startswith(cn_path):
+                yield x
+
+    @staticmethod
+    def _child_nodes_root(start_point):
         if isinstance(start_point, fs.fsBase):
             if start_point.is_sym:
                 start_point = start_point.target
             else:
                 start_point = start_point.location
-        for x in self:
-            cn_path = normpath(start_point).rstrip(path.sep) + path.sep
-            # what about sym targets?
-            if x.location.startswith(cn_path):
-                yield x
+        return normpath(start_point)
 
     def child_nodes(self, start_point):
         """Return a clone of this instance, w/ just the child nodes returned
@@ -408,3 +417,203 @@ class OrderedContentsSet(contentsSet):
         if add_missing_directories:
             self.add_missing_directories()
         self.mutable = mutable
+
+
+_missing = object()
+
+
+class _PathTrie(DictMixin):
+
+    """
+    location to fs object mapping, stored as a trie of path components
+
+    Each node is a two item list- the value stored for that path (or a
+    sentinel if nothing is), and a dict of child component to node, or None
+    for leaves.  Entries beneath a path are found by walking just that
+    subtree, and paths lacking an entry of their own but containing others
+    are the interior nodes without a value.
+    """
+
+    def __init__(self):
+        self._root = [_missing, None]
+        self._len = 0
+        # (dirname, node) of the last insertion; sets are mostly filled a
+        # directory at a time.
+        self._last_parent = (None, None)
+
+    @staticmethod
+    def _split(key):
+        parts = key.split(path.sep)
+        # the leading empty component of absolute paths keeps them apart
+        # from relative ones.
+        return parts[:1] + [x for x in parts[1:] if x]
+
+    def _find(self, key, create=False):
+        node = self._root
+        for part in self._split(key):
+            children = node[1]
+            if children is None:
+                if not create:
+                    return None
+                children = node[1] = {}
+            child = children.get(part)
+            if child is None:
+                if not create:
+                    return None
+                child = children[part] = [_missing, None]
+            node = child
+        return node
+
+    def __getitem__(self, key):
+        node = self._find(key)
+        if node is None or node[0] is _missing:
+            raise KeyError(key)
+        return node[0]
+
+    def __setitem__(self, key, obj):
+        head, sep, tail = key.rpartition(path.sep)
+        if not (head and tail):
+            node = self._find(key, create=True)
+        else:
+            last_head, parent = self._last_parent
+            if head != last_head:
+                parent = self._find(head, create=True)
+                self._last_parent = (head, parent)
+            children = parent[1]
+            if children is None:
+                children = parent[1] = {}
+            node = children.get(tail)
+            if node is None:
+                node = children[tail] = [_missing, None]
+        if node[0] is _missing:
+            self._len += 1
+        node[0] = obj
+
+    def __delitem__(self, key):
+        node = self._root
+        chain = []
+        for part in self._split(key):
+            child = node[1].get(part) if node[1] else None
+            if child is None:
+                raise KeyError(key)
+            chain.append((node, part))
+            node = child
+        if node[0] is _missing:
+            raise KeyError(key)
+        node[0] = _missing
+        self._len -= 1
+        self._last_parent = (None, None)
+        # prune the branch back to the nearest node still in use.
+        while chain and node[0] is _missing and not node[1]:
+            node, part = chain.pop()
+            del node[1][part]
+            if not node[1]:
+                node[1] = None
+
+    def pop(self, key, *default):
+        try:
+            obj = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return obj
+
+    def __contains__(self, key):
+        node = self._find(key)
+        return node is not None and node[0] is not _missing
+
+    def __len__(self):
+        return self._len
+
+    def _iter_nodes(self, node):
+        # yields (path components, node) pairs, depth first.
+        stack = [((), node)]
+        pop, push = stack.pop, stack.append
+        while stack:
+            parts, node = pop()
+            yield parts, node
+            if node[1]:
+                for part, child in node[1].iteritems():
+                    push((parts + (part,), child))
+
+    @staticmethod
+    def _join(parts):
+        return path.sep.join(parts) or path.sep
+
+    def iteritems(self):
+        join = self._join
+        for parts, node in self._iter_nodes(self._root):
+            if node[0] is not _missing:
+                yield join(parts), node[0]
+
+    def iterkeys(self):
+        return (k for k, v in self.iteritems())
+
+    __iter__ = iterkeys
+
+    def itervalues(self):
+        return (v for k, v in self.iteritems())
+
+    def itervalues_beneath(self, key):
+        """Yield the objects stored beneath the given path, not including
+        any stored for the path itself."""
+        node = self._find(key)
+        if node is None or not node[1]:
+            return
+        nodes = self._iter_nodes(node)
+        # skip the start point.
+        nodes.next()
+        for parts, node in nodes:
+            if node[0] is not _missing:
+                yield node[0]
+
+    def iter_missing(self):
+        """Yield the paths that contain entries, yet lack one themselves.
+
+        Neither the root nor the base of relative paths is included.
+        """
+        join = self._join
+        for parts, node in self._iter_nodes(self._root):
+            if node[0] is _missing and parts not in ((), ('',)):
+                yield join(parts)
+
+    def clear(self):
+        self._root = [_missing, None]
+        self._len = 0
+        self._last_parent = (None, None)
+
+    def __eq__(self, other):
+        if isinstance(other, _PathTrie):
+            other = dict(other.iteritems())
+        return dict(self.iteritems()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class TrieContentsSet(contentsSet):
+
+    """
+    contentsSet storing its entries in a trie of path components
+
+    Finding the entries beneath a path only visits that subtree, and
+    directories missing from the set are found without deriving every
+    entry's parents; suited to large csets queried repeatedly, as the merge
+    engine does.
+    """
+
+    __dict_kls__ = _PathTrie
+
+    def iter_child_nodes(self, start_point):
+        return self._dict.itervalues_beneath(
+            self._child_nodes_root(start_point))
+
+    def add_missing_directories(self, mode=0775, uid=0, gid=0, mtime=None):
+        if mtime is None:
+            mtime = time.time()
+        self.update([fs.fsDir(location=x, mode=mode, uid=uid, gid=gid,
+                              mtime=mtime)
+                     for x in self._dict.iter_missing()])
+
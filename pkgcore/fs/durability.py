@@ -0,0 +1,117 @@
+# License: GPL2/BSD
+
+"""
+flushing merged files to disk
+
+Supports the merge durability modes:
+
+- none: leave it to the kernel; fastest, but a crash shortly after a merge
+  can lose files the vdb claims are installed
+- per-package: a single syncfs per filesystem touched, once a pkg is merged
+- per-file: an fdatasync per file, plus an fsync per directory touched
+"""
+
+__all__ = ("modes", "syncfs", "sync_filesystems", "sync_paths")
+
+import ctypes
+import errno
+import os
+import stat
+
+modes = ("none", "per-package", "per-file")
+
+_libc = None
+
+
+def _get_libc_func(name):
+    global _libc
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(None, use_errno=True)
+        except OSError:
+            _libc = False
+    return getattr(_libc, name, None) if _libc else None
+
+
+def syncfs(path):
+    """Flush the filesystem holding path to disk.
+
+    Where syncfs is unavailable, all filesystems are flushed.
+
+    :raise EnvironmentError: if path can't be opened or flushing fails
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        func = _get_libc_func("syncfs")
+        if func is None:
+            func = _get_libc_func("sync")
+            if func is not None:
+                func()
+            return
+        if func(fd) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+    finally:
+        os.close(fd)
+
+
+def _fsync(path, datasync=False):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if datasync:
+            getattr(os, "fdatasync", os.fsync)(fd)
+        else:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def sync_filesystems(paths):
+    """Flush each filesystem holding one of paths to disk, once apiece.
+
+    Missing paths are ignored.
+    """
+    devices = {}
+    for path in paths:
+        try:
+            devices.setdefault(os.stat(path).st_dev, path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+    for path in devices.itervalues():
+        syncfs(path)
+
+
+def sync_paths(paths, mode):
+    """Flush merged or unmerged paths to disk as the given mode dictates.
+
+    :param paths: locations of the fs entries added or removed
+    :param mode: one of :obj:`modes`
+    :raise ValueError: for unknown modes
+    :raise EnvironmentError: if flushing fails
+    """
+    if mode not in modes:
+        raise ValueError("unknown durability mode %r" % (mode,))
+    if mode == "none":
+        return
+    dirs = set()
+    for path in paths:
+        if mode == "per-file":
+            try:
+                st = os.lstat(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            else:
+                if stat.S_ISREG(st.st_mode):
+                    _fsync(path, datasync=True)
+        dirs.add(os.path.dirname(path))
+    if mode == "per-package":
+        sync_filesystems(dirs)
+        return
+    for path in sorted(dirs):
+        try:
+            _fsync(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
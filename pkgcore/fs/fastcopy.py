@@ -0,0 +1,162 @@
+# License: GPL2/BSD
+
+"""
+copying file contents with the kernel doing the work where possible
+
+Methods are tried in order- a reflink clone, copy_file_range, then
+sendfile- falling back to copying through python.  Methods a pair of
+filesystems turn out not to support are remembered per (source device,
+target device), so each later copy starts with the first usable one.
+"""
+
+__all__ = ("copy_file", "methods")
+
+import ctypes
+import errno
+import fcntl
+import os
+import threading
+
+# linux ioctl cloning the extents of one file into another.
+FICLONE = 0x40049409
+
+# errnos meaning a method isn't usable between two filesystems, as
+# opposed to an actual failure.
+_unsupported_errnos = frozenset(
+    getattr(errno, x) for x in (
+        "EXDEV", "EOPNOTSUPP", "ENOTSUP", "ENOTTY", "EINVAL", "ENOSYS",
+        "EBADF", "EPERM", "ETXTBSY", "EMLINK", "EACCES")
+    if hasattr(errno, x))
+
+# (source device, target device) -> names of the methods that failed.
+_unusable = {}
+_lock = threading.Lock()
+
+_libc = None
+
+
+def _get_libc_func(name, argtypes):
+    global _libc
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(None, use_errno=True)
+        except OSError:
+            _libc = False
+    func = getattr(_libc, name, None) if _libc else None
+    if func is None:
+        raise OSError(errno.ENOSYS, "%s is unavailable" % (name,))
+    func.argtypes = argtypes
+    func.restype = ctypes.c_ssize_t
+    return func
+
+
+def _call_loop(call, size):
+    remaining = size
+    while remaining > 0:
+        count = call(min(remaining, 1 << 30))
+        if count < 0:
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            raise OSError(err, os.strerror(err))
+        elif count == 0:
+            # some filesystems quietly stop early; treat the method as
+            # unusable, so copy_file starts over with the next one.
+            raise OSError(errno.EINVAL,
+                          "short copy, %i bytes remaining" % (remaining,))
+        remaining -= count
+
+
+def _reflink(src_fd, dst_fd, size):
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def _copy_file_range(src_fd, dst_fd, size):
+    func = _get_libc_func("copy_file_range", [
+        ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+        ctypes.c_size_t, ctypes.c_uint])
+    _call_loop(lambda count: func(src_fd, None, dst_fd, None, count, 0), size)
+
+
+def _sendfile(src_fd, dst_fd, size):
+    func = _get_libc_func("sendfile", [
+        ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t])
+    _call_loop(lambda count: func(dst_fd, src_fd, None, count), size)
+
+
+def _read_write(src_fd, dst_fd, size):
+    while True:
+        data = os.read(src_fd, 1 << 20)
+        if not data:
+            break
+        while data:
+            data = data[os.write(dst_fd, data):]
+
+
+# tried in order; the last always works.
+methods = (
+    ("reflink", _reflink),
+    ("copy_file_range", _copy_file_range),
+    ("sendfile", _sendfile),
+    ("read_write", _read_write),
+)
+
+
+def _mark_unusable(key, name):
+    with _lock:
+        _unusable.setdefault(key, set()).add(name)
+
+
+def copy_file(source, target, link=False):
+    """Copy the contents of source to a new file at target.
+
+    Anything already at target is replaced.  The target is created with mode
+    0600; callers are expected to enforce the final permissions.
+
+    :param link: if True, hardlink source to target if both are on the
+        same device.  Only suited to sources discarded afterwards, since
+        changes to either path then affect both.
+    :return: the name of the method used
+    :raise EnvironmentError: if copying fails
+    """
+    src_fd = os.open(source, os.O_RDONLY)
+    try:
+        st = os.fstat(src_fd)
+        key = (st.st_dev, os.stat(os.path.dirname(target) or '.').st_dev)
+        unusable = _unusable.get(key, ())
+        # a leftover from an interrupted merge may be a hardlink to some
+        # other file; replace it rather than linking onto or truncating it.
+        try:
+            os.unlink(target)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        if link and "link" not in unusable:
+            try:
+                os.link(source, target)
+                return "link"
+            except EnvironmentError as e:
+                if e.errno not in _unsupported_errnos:
+                    raise
+                _mark_unusable(key, "link")
+        dst_fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        try:
+            for name, func in methods:
+                if name in unusable:
+                    continue
+                try:
+                    func(src_fd, dst_fd, st.st_size)
+                    return name
+                except EnvironmentError as e:
+                    if e.errno not in _unsupported_errnos or \
+                            name == "read_write":
+                        raise
+                    _mark_unusable(key, name)
+                    # start the next method over from scratch.
+                    os.ftruncate(dst_fd, 0)
+                    os.lseek(dst_fd, 0, os.SEEK_SET)
+                    os.lseek(src_fd, 0, os.SEEK_SET)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
@@ -11,15 +11,21 @@ Shouldn't be accessed directly for the most part, use
 import errno
 from functools import partial
 import os
+import sys
+import threading
 
+from snakeoil.demandload import demandload
 from snakeoil.osutils import ensure_dirs, pjoin, unlink_if_exists
 
 from pkgcore.const import COPY_BINARY
-from pkgcore.fs import contents, fs
+from pkgcore.fs import contents, fastcopy, fs
 from pkgcore.fs.livefs import gen_obj
 from pkgcore.plugin import get_plugin
 from pkgcore.spawn import spawn
 
+demandload(
+    'pkgcore.util.thread_pool:map_async',
+)
 
 __all__ = [
     "merge_contents", "unmerge_contents", "default_ensure_perms",
@@ -115,11 +121,19 @@ class CannotOverwrite(FailedCopy):
             self.obj, self.existing)
 
 
-def default_copyfile(obj, mkdirs=False):
+def default_copyfile(obj, mkdirs=False, disposable=False):
     """
     copy a :class:`pkgcore.fs.fs.fsBase` to its stated location.
 
+    Regular files backed by a path are copied via :mod:`pkgcore.fs.fastcopy`.
+
     :param obj: :class:`pkgcore.fs.fs.fsBase` instance, exempting :class:`fsDir`
+    :param disposable: if True, the source of obj is discarded afterwards;
+        it may be hardlinked into place rather than copied.  Only sources
+        already owned by obj's uid and gid are linked; others, e.g. images
+        written by an unprivileged build user, are copied to a fresh inode,
+        since a file the build still has open would otherwise become the
+        merged file, ownership changes and all.
     :return: true if success, else an exception is thrown
     :raise EnvironmentError: permission errors
 
@@ -154,7 +168,12 @@ def default_copyfile(obj, mkdirs=False):
         fp = existent_fp = obj.location + "#new"
 
     if fs.isreg(obj):
-        obj.data.transfer_to_path(fp)
+        source = getattr(obj.data, 'path', None)
+        if source is not None:
+            fastcopy.copy_file(
+                source, fp, link=disposable and _owned_as(source, obj))
+        else:
+            obj.data.transfer_to_path(fp)
     elif fs.issym(obj):
         os.symlink(obj.target, fp)
     elif fs.isfifo(obj):
@@ -173,6 +192,10 @@ def default_copyfile(obj, mkdirs=False):
         os.rename(existent_fp, obj.location)
     return True
 
+def _owned_as(path, obj):
+    st = os.stat(path)
+    return (st.st_uid, st.st_gid) == (obj.uid, obj.gid)
+
 def do_link(src, trg):
     try:
         os.link(src.location, trg.location)
@@ -207,7 +230,60 @@ def do_link(src, trg):
     return True
 
 
-def merge_contents(cset, offset=None, callback=None):
+# below this many work items, threads cost more than they save.
+parallel_threshold = 64
+
+
+def _locked(func):
+    lock = threading.Lock()
+    def f(*args):
+        with lock:
+            return func(*args)
+    return f
+
+
+def _run_parallel(work, functor, parallelism):
+    """Call functor on each item of work from a pool of threads.
+
+    Once a call fails the remaining items are skipped, and the first
+    exception is reraised once the in-flight calls complete.  Small amounts
+    of work are done serially.
+    """
+    if parallelism <= 1 or len(work) < parallel_threshold:
+        for item in work:
+            functor(item)
+        return
+    failures = []
+    def run(queue):
+        for item in queue:
+            if failures:
+                continue
+            try:
+                functor(item)
+            except:
+                failures.append(sys.exc_info())
+    map_async(work, run, threads=parallelism)
+    if failures:
+        exc_info = failures[0]
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+
+def _check_sym_overwrite(obj, exc):
+    # a symlink can't replace a dir, but if the dir is where the symlink
+    # would lead anyways, it's left be.
+    if not fs.issym(obj):
+        raise exc
+    # by this time, all directories should've been merged.
+    # thus we can check the target
+    try:
+        if not fs.isdir(gen_obj(pjoin(obj.location, obj.target))):
+            raise exc
+    except OSError:
+        raise exc
+
+
+def merge_contents(cset, offset=None, callback=None, disposable=False,
+                   parallelism=1):
 
     """
     merge a :class:`pkgcore.fs.contents.contentsSet` instance to the livefs
@@ -217,6 +293,12 @@ def merge_contents(cset, offset=None, callback=None):
         Think of it as target dir.
     :param callback: callable to report each entry being merged; given a single arg,
         the fs object being merged.
+    :param disposable: if True, the files of cset are discarded after merging;
+        passed through to the copyfile op, see :obj:`default_copyfile` for
+        when that links files into place.
+    :param parallelism: number of threads merging non-directories; dirs are
+        always created first, in order.  Callback invocations are serialized,
+        and the first failure aborts the merge as in the serial case.
     :raise EnvironmentError: Thrown for permission failures.
     """
 
@@ -269,6 +351,13 @@ def merge_contents(cset, offset=None, callback=None):
             ensure_perms(x)
     del d
 
+    if parallelism > 1:
+        _run_parallel(
+            _hardlink_units(iterate(cset.iterdirs(invert=True))),
+            partial(_merge_unit, copyfile, _locked(callback), disposable),
+            parallelism)
+        return True
+
     # might look odd, but what this does is minimize the try/except cost
     # to one time, assuming everything behaves, rather then per item.
     i = iterate(cset.iterdirs(invert=True))
@@ -291,24 +380,59 @@ def merge_contents(cset, offset=None, callback=None):
                         continue
                     candidates.append(x)
 
-                copyfile(x, mkdirs=True)
+                if disposable:
+                    copyfile(x, mkdirs=True, disposable=True)
+                else:
+                    copyfile(x, mkdirs=True)
 
             break
         except CannotOverwrite as cf:
-            if not fs.issym(x):
-                raise
-
-            # by this time, all directories should've been merged.
-            # thus we can check the target
-            try:
-                if not fs.isdir(gen_obj(pjoin(x.location, x.target))):
-                    raise
-            except OSError:
-                raise cf
+            _check_sym_overwrite(x, cf)
     return True
 
 
-def unmerge_contents(cset, offset=None, callback=None):
+def _hardlink_units(objs):
+    """Group fs objs into lists, regular files sharing an inode together.
+
+    Each list is merged in order, so later files can be hardlinked to the
+    first.
+    """
+    units = []
+    inodes = {}
+    for x in objs:
+        if x.is_reg and None not in (x.dev, x.inode):
+            key = (x.dev, x.inode)
+            unit = inodes.get(key)
+            if unit is not None:
+                unit.append(x)
+                continue
+            unit = inodes[key] = []
+        else:
+            unit = []
+        unit.append(x)
+        units.append(unit)
+    return units
+
+
+def _merge_unit(copyfile, callback, disposable, unit):
+    candidates = []
+    for x in unit:
+        callback(x)
+        if x.is_reg:
+            if any(target._can_be_hardlinked(x) and do_link(target, x)
+                    for target in candidates):
+                continue
+            candidates.append(x)
+        try:
+            if disposable:
+                copyfile(x, mkdirs=True, disposable=True)
+            else:
+                copyfile(x, mkdirs=True)
+        except CannotOverwrite as cf:
+            _check_sym_overwrite(x, cf)
+
+
+def unmerge_contents(cset, offset=None, callback=None, parallelism=1):
 
     """
     unmerge a :obj:`pkgcore.fs.contents.contentsSet` instance to the livefs
@@ -317,6 +441,9 @@ def unmerge_contents(cset, offset=None, callback=None):
     :param offset: if not None, offset to prefix all locations with.
         Think of it as target dir.
     :param callback: callable to report each entry being unmerged
+    :param parallelism: number of threads unlinking files and removing dirs;
+        dirs are removed a level at a time, deepest first.  Callback
+        invocations are serialized.
     :return: True, or an exception is thrown on failure
         (OSError, although see default_copyfile for specifics).
     :raise EnvironmentError: see :func:`default_copyfile` and :func:`default_mkdir`
@@ -329,24 +456,45 @@ def unmerge_contents(cset, offset=None, callback=None):
     if offset is not None:
         iterate = partial(contents.offset_rewriter, offset.rstrip(os.path.sep))
 
+    if parallelism > 1:
+        callback = _locked(callback)
+        _run_parallel(
+            list(iterate(cset.iterdirs(invert=True))),
+            partial(_unlink_obj, callback), parallelism)
+        levels = {}
+        for x in iterate(cset.iterdirs()):
+            levels.setdefault(x.location.count(os.path.sep), []).append(x)
+        for depth in sorted(levels, reverse=True):
+            _run_parallel(levels[depth], partial(_rmdir_obj, callback),
+                          parallelism)
+        return True
+
     for x in iterate(cset.iterdirs(invert=True)):
-        callback(x)
-        unlink_if_exists(x.location)
+        _unlink_obj(callback, x)
 
     # this is a fair sight faster then using sorted/reversed
     l = list(iterate(cset.iterdirs()))
     l.sort(reverse=True)
     for x in l:
-        try:
-            os.rmdir(x.location)
-        except OSError as e:
-            if not e.errno in (errno.ENOTEMPTY, errno.ENOENT, errno.ENOTDIR,
-                               errno.EBUSY, errno.EEXIST):
-                raise
-        else:
-            callback(x)
+        _rmdir_obj(callback, x)
     return True
 
+
+def _unlink_obj(callback, obj):
+    callback(obj)
+    unlink_if_exists(obj.location)
+
+
+def _rmdir_obj(callback, obj):
+    try:
+        os.rmdir(obj.location)
+    except OSError as e:
+        if not e.errno in (errno.ENOTEMPTY, errno.ENOENT, errno.ENOTDIR,
+                           errno.EBUSY, errno.EEXIST):
+            raise
+    else:
+        callback(obj)
+
 # Plugin system priorities
 for func in [default_copyfile, default_ensure_perms, default_mkdir,
              merge_contents, unmerge_contents]:
@@ -48,6 +48,10 @@ def map_new_cset_livefs(engine, csets, cset_name='new_cset'):
     ondisk = contents.contentsSet(livefs.intersect(initial.iterdirs(),
         realpath=False))
     livefs.recursively_fill_syms(ondisk)
+    if any(ondisk.iterlinks()):
+        # directories are redirected by symlinks on the livefs; remapping
+        # them repeatedly pulls out subtrees, which a trie does cheaply.
+        initial = contents.TrieContentsSet(initial)
     ret = initial.map_directory_structure(ondisk, add_conflicting_sym=True)
     return ret
 
@@ -87,6 +91,9 @@ class MergeEngine(object):
 
     allow_reuse = True
 
+    # threads the merge and unmerge triggers use for a pkg's files; 1 does
+    # so serially.  Domain operations set it from the domain's MERGE_JOBS.
+    merge_jobs = 1
 
     def __init__(self, mode, tempdir, hooks, csets, preserves, observer,
                  offset=None, disable_plugins=False, parallelism=None):
@@ -15,6 +15,7 @@ __all__ = (
     "CommonDirectoryModes",
     "PruneFiles",
     "SavePkg",
+    "SyncMerged",
     "detect_world_writable",
     "fix_gid_perms",
     "fix_set_bits",
@@ -40,7 +41,7 @@ demandload(
     'time',
     'snakeoil.bash:iter_read_bash',
     'pkgcore:os_data,spawn',
-    'pkgcore.fs:fs,contents',
+    'pkgcore.fs:contents,durability,fs',
     'pkgcore.fs.livefs:gen_obj',
     'pkgcore.operations.observer:threadsafe_repo_observer',
     'pkgcore.package.mutated:MutatedPkg',
@@ -441,7 +442,15 @@ class merge(base):
 
     def trigger(self, engine, merging_cset):
         op = get_plugin('fs_ops.merge_contents')
-        return op(merging_cset, callback=engine.observer.installing_fs_obj)
+        kwds = {}
+        # the image of a freshly built pkg is thrown away after merging,
+        # so its files can be linked into place.
+        if getattr(engine.new, '_is_from_source', False):
+            kwds['disposable'] = True
+        if engine.merge_jobs > 1:
+            kwds['parallelism'] = engine.merge_jobs
+        return op(merging_cset, callback=engine.observer.installing_fs_obj,
+                  **kwds)
 
 
 class unmerge(base):
@@ -454,7 +463,43 @@ class unmerge(base):
 
     def trigger(self, engine, unmerging_cset):
         op = get_plugin('fs_ops.unmerge_contents')
-        return op(unmerging_cset, callback=engine.observer.removing_fs_obj)
+        kwds = {}
+        if engine.merge_jobs > 1:
+            kwds['parallelism'] = engine.merge_jobs
+        return op(unmerging_cset, callback=engine.observer.removing_fs_obj,
+                  **kwds)
+
+
+class SyncMerged(base):
+
+    """flush what the merge and unmerge triggers changed to disk
+
+    :ivar mode: a :obj:`pkgcore.fs.durability.modes` entry
+    """
+
+    required_csets = {
+        const.INSTALL_MODE: ('install',),
+        const.UNINSTALL_MODE: ('uninstall',),
+        const.REPLACE_MODE: ('install', 'uninstall'),
+    }
+    # after the merge and unmerge triggers.
+    priority = 60
+    _hooks = ('merge', 'unmerge')
+
+    pkgcore_config_type = base.pkgcore_config_type.clone(
+        types={'mode':'str'})
+
+    def __init__(self, mode='per-package'):
+        if mode not in durability.modes:
+            raise ValueError("unknown durability mode %r" % (mode,))
+        self.mode = mode
+
+    def trigger(self, engine, *csets):
+        if engine.mode == const.REPLACE_MODE:
+            csets = csets[:1] if engine.phase == 'merge' else csets[1:]
+        for cset in csets:
+            durability.sync_paths(
+                (x.location for x in cset), self.mode)
 
 
 class BaseSystemUnmergeProtection(base):
@@ -16,6 +16,7 @@ demandload(
     "shutil",
     "tempfile",
     'snakeoil:osutils',
+    "pkgcore.fs:durability",
     "pkgcore.log:logger",
     "pkgcore.merge:errors@merge_errors",
     "pkgcore.merge.engine:MergeEngine",
@@ -80,7 +81,7 @@ class base(object):
             trigger.register(engine)
 
     def customize_engine(self, engine):
-        pass
+        engine.merge_jobs = self.domain.merge_jobs
 
     def start(self):
         """start the transaction"""
@@ -104,7 +105,14 @@ class base(object):
 
     def finalize_repo(self):
         """finalize the repository operations"""
-        return self.repo_op.finish()
+        ret = self.repo_op.finish()
+        if self.domain.merge_durability != "none":
+            # merged files were flushed by the SyncMerged trigger; flush
+            # the vdb entry recording them.
+            durability.sync_filesystems(
+                x.location for x in self.domain.vdb
+                if getattr(x, 'location', None) is not None)
+        return ret
 
     def clean_tempdir(self):
         if self.tempspace:
@@ -0,0 +1,199 @@
+# License: GPL2/BSD
+
+"""
+background fetching of the distfiles of a resolver plan
+
+Fetching is done in a forked child using a bounded number of threads, in
+plan order; the child's output goes to a log file and the completion of
+each pkg is reported back over a pipe.  Consumers block only for the pkgs
+whose files aren't ready yet.
+"""
+
+__all__ = ("FetchPipeline",)
+
+import errno
+import os
+import select
+import signal
+import sys
+import threading
+
+from snakeoil.demandload import demandload
+from snakeoil.osutils import ensure_dirs
+
+from pkgcore.operations import observer as observer_mod
+
+demandload(
+    'traceback',
+    'pkgcore.ebuild:processor',
+    'pkgcore.log:logger',
+    'pkgcore.util.thread_pool:map_async',
+)
+
+
+class FetchPipeline(object):
+
+    """
+    fetch the files of a sequence of pkgs in a child process
+
+    Pkgs are referred to by their index in the sequence given; a None entry
+    has nothing to fetch and is always ready.
+    """
+
+    def __init__(self, domain, pkgs, log_path, jobs=2):
+        """
+        :param domain: domain used to get the fetch operations of each pkg
+        :param pkgs: sequence of pkgs to fetch, in plan order
+        :param log_path: file the output of fetching is written to
+        :param jobs: maximum number of pkgs fetched at once
+        """
+        self.domain = domain
+        self.pkgs = pkgs
+        self.log_path = log_path
+        self.jobs = max(jobs, 1)
+        self.results = {}
+        self._pid = self._fd = None
+        self._buf = ''
+        self._done = False
+
+    def start(self):
+        """Start fetching in the background."""
+        if self._pid is not None:
+            return
+        ensure_dirs(os.path.dirname(self.log_path), mode=0755, minimal=True)
+        logfile = open(self.log_path, "w")
+        rfd, wfd = os.pipe()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            logfile.close()
+            os.close(wfd)
+            self._pid, self._fd = pid, rfd
+            return
+        status = 1
+        try:
+            try:
+                os.close(rfd)
+                null = os.open(os.devnull, os.O_RDONLY)
+                os.dup2(null, 0)
+                os.dup2(logfile.fileno(), 1)
+                os.dup2(logfile.fileno(), 2)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                processor.forget_all_processors()
+                self._run_child(logfile, wfd)
+                status = 0
+            except:
+                traceback.print_exc(file=logfile)
+            logfile.flush()
+        finally:
+            os._exit(status)
+
+    def _run_child(self, logfile, wfd):
+        lock = threading.Lock()
+        obs = observer_mod.build_observer(
+            observer_mod.file_handle_output(logfile), True)
+
+        def fetch(queue):
+            for i in queue:
+                pkg = self.pkgs[i]
+                try:
+                    pkg_ops = self.domain.pkg_operations(pkg, observer=obs)
+                    ok = pkg_ops.run_if_supported("fetch", or_return=True)
+                except Exception:
+                    with lock:
+                        logfile.write("fetching %s failed:\n" % (pkg.cpvstr,))
+                        traceback.print_exc(file=logfile)
+                    ok = False
+                with lock:
+                    logfile.flush()
+                    os.write(wfd, "%i %i\n" % (i, ok is True))
+
+        try:
+            map_async(
+                [i for i, pkg in enumerate(self.pkgs) if pkg is not None],
+                fetch, threads=self.jobs)
+        finally:
+            processor.shutdown_all_processors()
+
+    def _read(self, block):
+        if self._done or self._fd is None:
+            return
+        if not block:
+            try:
+                readable = select.select([self._fd], [], [], 0)[0]
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    return
+                raise
+            if not readable:
+                return
+        try:
+            data = os.read(self._fd, 4096)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                return
+            raise
+        if not data:
+            self._finish()
+            return
+        lines = (self._buf + data).split("\n")
+        self._buf = lines.pop()
+        for line in lines:
+            i, ok = line.split()
+            self.results[int(i)] = bool(int(ok))
+
+    def _finish(self):
+        self._done = True
+        os.close(self._fd)
+        self._fd = None
+        pid, self._pid = self._pid, None
+        try:
+            os.waitpid(pid, 0)
+        except OSError as e:
+            if e.errno != errno.ECHILD:
+                raise
+
+    def ready(self, i):
+        """Is the given pkg done being fetched, successfully or not?"""
+        if self.pkgs[i] is None or i in self.results:
+            return True
+        self._read(False)
+        return i in self.results or self._done
+
+    def wait(self, i):
+        """Block till the given pkg is done, returning if fetching succeeded.
+
+        Note that a failed fetch may simply be retried in the foreground,
+        which reports the reason.
+        """
+        if self.pkgs[i] is None:
+            return True
+        while i not in self.results and not self._done:
+            self._read(True)
+        return self.results.get(i, False)
+
+    def __iter__(self):
+        """Yield (index, fetched successfully) as pkgs finish fetching."""
+        seen = set()
+        while True:
+            for i in sorted(set(self.results).difference(seen)):
+                seen.add(i)
+                yield i, self.results[i]
+            if self._done:
+                break
+            self._read(True)
+        for i, pkg in enumerate(self.pkgs):
+            if pkg is not None and i not in seen:
+                yield i, False
+
+    def stop(self):
+        """Kill off any fetching still in progress."""
+        if self._pid is None:
+            return
+        try:
+            os.kill(self._pid, signal.SIGTERM)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+        self._finish()
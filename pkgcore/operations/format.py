@@ -33,9 +33,23 @@ class fetch_base(object):
         self.fetcher = fetcher
 
     def fetch_all(self, observer):
+        pending = {}
         for fetchable in self.fetchables:
-            if not self.fetch_one(fetchable, observer):
-                return False
+            if fetchable.filename not in self._basenames:
+                pending.setdefault(fetchable.filename, fetchable)
+        if not pending:
+            return True
+        fetches = self.fetcher.fetch_many(
+            x for x in self.fetchables if pending.get(x.filename) is x)
+        try:
+            for fetchable, fp in fetches:
+                if fp is None:
+                    self.failed_fetch(fetchable, observer)
+                    return False
+                self.verified_files[fp] = fetchable
+                self._basenames.add(fetchable.filename)
+        finally:
+            fetches.close()
         return True
 
     def fetch_one(self, fetchable, observer):
@@ -79,7 +79,7 @@ class formatter_output(null_output):
 class file_handle_output(null_output):
 
     def __init__(self, out):
-        self.out = out
+        self._out = out
 
     def info(self, msg, *args, **kwds):
         self._out.write("info: %s\n" % _convert(msg, args, kwds))
@@ -4,32 +4,176 @@
 from snakeoil import compatibility
 from snakeoil.demandload import demandload
 
+from pkgcore.operations import observer as observer_mod
+
 demandload(
+    'os',
+    'Queue',
+    'multiprocessing',
+    'traceback',
+    'pkgcore.ebuild:eclass_profile,processor,regen_journal',
+    'pkgcore.ebuild.restricts:CategoryDep',
     'pkgcore.util.thread_pool:map_async',
 )
 
 
-def regen_iter(iterable, regen_func, observer, is_thread=False):
+def regen_iter(iterable, regen_func, observer, is_thread=False, record=None):
+    regen_batch = getattr(regen_func, 'regen_batch', None)
+    if regen_batch is not None:
+        return _regen_batch_iter(iterable, regen_batch, observer, record)
     for x in iterable:
         try:
-            regen_func(x)
+            data = regen_func(x)
         except compatibility.IGNORED_EXCEPTIONS as e:
             if isinstance(e, KeyboardInterrupt):
                 return
             raise
         except Exception as e:
             observer.error("caught exception %s while processing %s", e, x)
+            continue
+        if record is not None:
+            record(x, data)
+
+
+def _regen_batch_iter(iterable, regen_batch, observer, record=None):
+    # helpers supporting batching yield the exception encountered in place
+    # of the metadata for packages that failed.
+    try:
+        for x, data in regen_batch(iterable):
+            if isinstance(data, Exception):
+                observer.error("caught exception %s while processing %s", data, x)
+            elif record is not None:
+                record(x, data)
+    except KeyboardInterrupt:
+        return
+
+
+def _get_repo_helper(repo, options):
+    if not hasattr(repo, '_regen_operation_helper'):
+        return lambda pkg: getattr(pkg, 'keywords')
+    return repo._regen_operation_helper(**options)
+
+
+def _finish_helper(helper):
+    f = getattr(helper, 'finish', None)
+    if f is not None:
+        f()
+
+
+def _get_journal(repo, observer, journal_path=None):
+    if getattr(repo, 'eclass_cache', None) is None:
+        observer.warn("repository %s doesn't support incremental regen; "
+                      "doing a full regen", repo)
+        return None
+    if journal_path is None:
+        journal_path = regen_journal.default_journal_path(repo)
+        if journal_path is None:
+            observer.warn("repository %s has no writable cache location to "
+                          "store a regen journal in; doing a full regen", repo)
+            return None
+    return regen_journal.RegenJournal(repo, journal_path)
+
+
+def _get_profile(repo, observer, profile_path=None):
+    if getattr(repo, 'eclass_cache', None) is None:
+        observer.warn("repository %s doesn't support eclass preloading", repo)
+        return None
+    if profile_path is None:
+        profile_path = eclass_profile.default_profile_path(repo)
+        if profile_path is None:
+            observer.warn("repository %s has no writable cache location to "
+                          "store an eclass profile in; not preloading", repo)
+            return None
+    profile = eclass_profile.EclassProfile(profile_path)
+    if not profile.counts:
+        # bootstrap from whatever is already in the metadata caches.
+        profile.scan(repo)
+    return profile
+
+
+def _make_recorder(journal=None, inherits=None):
+    recorders = []
+    if journal is not None:
+        recorders.append(journal.record)
+    if inherits is not None:
+        def record_inherits(pkg, data):
+            inherits[pkg.cpvstr] = tuple(data.get('_eclasses_', ()))
+        recorders.append(record_inherits)
+    if len(recorders) < 2:
+        return recorders[0] if recorders else None
+
+    def record(pkg, data):
+        for f in recorders:
+            f(pkg, data)
+    return record
+
+
+def regen_repository(repo, observer, threads=1, pkg_attr='keywords',
+                     use_processes=False, incremental=False,
+                     journal_path=None, preload_eclasses=0,
+                     order_by_inherit=False, profile_path=None, **options):
+
+    journal = None
+    pkgs = repo
+    if incremental:
+        journal = _get_journal(repo, observer, journal_path)
+        if journal is not None:
+            pkgs = list(journal.iter_stale(force=options.get('force', False)))
+            observer.debug("incremental regen: %i stale packages", len(pkgs))
+
+    profile = preload = inherits = None
+    if preload_eclasses:
+        profile = _get_profile(repo, observer, profile_path)
+        if profile is not None:
+            preload = profile.preload_set(preload_eclasses, repo.eclass_cache)
+            observer.debug("preloading %i eclasses", len(preload))
+            if journal is None:
+                # the journal tracks inherits itself.
+                inherits = {}
+
+    if order_by_inherit:
+        pkgs = eclass_profile.order_by_inherits(repo, pkgs)
+
+    if use_processes and threads < 2:
+        observer.warn("process based regen needs more than one worker; "
+                      "regenerating with %i thread", threads)
+        use_processes = False
+    if use_processes:
+        regen_repository_processes(
+            repo, observer, processes=threads, pkgs=pkgs, journal=journal,
+            preload=preload, inherits=inherits, **options)
+    else:
+        if hasattr(repo, '_regen_operation_helper'):
+            # spawn the processors each helper will claim up front.
+            count = threads
+            # repos support len(), but only by walking every version.
+            if isinstance(pkgs, (list, tuple)):
+                count = min(count, len(pkgs))
+            processor.warm_ebuild_processors(
+                count=max(count, processor.pool.min_size),
+                eclass_cache=repo.eclass_cache if preload else None,
+                eclasses=preload)
+        _regen_repository_threads(
+            repo, pkgs, observer, threads, _make_recorder(journal, inherits),
+            options)
+    processor.pool.report(observer)
 
+    if journal is not None:
+        journal.save()
+    if profile is not None:
+        if journal is not None:
+            inherits = dict(
+                (cpv, entry[1]) for cpv, entry in journal.entries.iteritems())
+        profile.update(inherits.itervalues())
+        profile.save()
 
-def regen_repository(repo, observer, threads=1, pkg_attr='keywords', **options):
 
+def _regen_repository_threads(repo, pkgs, observer, threads, record, options):
     helpers = []
 
-    def _get_repo_helper():
-        if not hasattr(repo, '_regen_operation_helper'):
-            return lambda pkg: getattr(pkg, 'keywords')
+    def _get_tracked_helper():
         # for an actual helper, track it and invoke .finish if it exists.
-        helper = repo._regen_operation_helper(**options)
+        helper = _get_repo_helper(repo, options)
         helpers.append(helper)
         return helper
 
@@ -38,13 +182,173 @@ def regen_repository(repo, observer, threads=1, pkg_attr='keywords', **options):
             global count
             for x in iterable:
                 yield x
-        regen_iter(passthru(repo), _get_repo_helper(), observer)
+        regen_iter(passthru(pkgs), _get_tracked_helper(), observer,
+                   record=record)
     else:
         def get_args():
-            return (_get_repo_helper(), observer, True)
-        map_async(repo, regen_iter, per_thread_args=get_args)
+            return (_get_tracked_helper(), observer, True, record)
+        map_async(pkgs, regen_iter, per_thread_args=get_args)
 
     for helper in helpers:
-        f = getattr(helper, 'finish', None)
-        if f is not None:
-            f()
+        _finish_helper(helper)
+
+
+class _queued_output(observer_mod.null_output):
+
+    """Observer forwarding messages from a regen worker to its parent.
+
+    Messages are interpolated in the worker; only plain strings cross
+    the process boundary.
+    """
+
+    def __init__(self, queue):
+        self._queue = queue
+
+    def _send(self, level, msg, args, kwds):
+        self._queue.put((level, observer_mod._convert(msg, args, kwds)))
+
+    def error(self, msg, *args, **kwds):
+        self._send('error', msg, args, kwds)
+
+    def warn(self, msg, *args, **kwds):
+        self._send('warn', msg, args, kwds)
+
+    def info(self, msg, *args, **kwds):
+        self._send('info', msg, args, kwds)
+
+    def debug(self, msg, *args, **kwds):
+        self._send('debug', msg, args, kwds)
+
+
+def _regen_process_worker(repo, shards, tasks, results, journal, preload,
+                          track_inherits, options):
+    # processors inherited across the fork belong to the parent; keep
+    # references to them (so they aren't finalized, killing the parent's
+    # daemons) and let this process spawn its own.
+    inherited = (processor.active_ebp_list[:], processor.inactive_ebp_list[:])
+    processor.forget_all_processors()
+    processor.pool.reset_stats()
+    out = _queued_output(results)
+    try:
+        if preload:
+            processor.warm_ebuild_processors(
+                count=1, eclass_cache=repo.eclass_cache, eclasses=preload)
+        helper = _get_repo_helper(repo, options)
+        record = None
+        if journal is not None or track_inherits:
+            # journal entries and inherits are recorded by the parent.
+            def record(pkg, data):
+                if journal is not None:
+                    results.put(('journal',) + journal.make_entry(pkg, data))
+                if track_inherits:
+                    results.put(('inherits', pkg.cpvstr,
+                                 tuple(data.get('_eclasses_', ()))))
+        try:
+            for category in iter(tasks.get, None):
+                if shards is None:
+                    pkgs = list(repo.itermatch(CategoryDep(category)))
+                else:
+                    pkgs = shards[category]
+                regen_iter(pkgs, helper, out, record=record)
+                results.put(('progress', category, len(pkgs)))
+        finally:
+            _finish_helper(helper)
+            repo.operations.run_if_supported("flush_cache")
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        out.error("regen worker %i died: %s\n%s",
+                  os.getpid(), e, traceback.format_exc())
+    finally:
+        processor.shutdown_all_processors()
+        results.put(('pool', processor.pool.stats()))
+        results.put(('finished', os.getpid()))
+        del inherited
+
+
+def regen_repository_processes(repo, observer, processes=None, pkgs=None,
+                               journal=None, preload=None, inherits=None,
+                               **options):
+    """Regenerate a repository's cache using a pool of worker processes.
+
+    Work is sharded by category; each worker owns its own
+    :obj:`pkgcore.ebuild.processor.EbuildProcessor` and cache writer, and
+    reports progress and errors back to `observer`.
+
+    :param processes: number of worker processes, defaults to the number
+        of available processors.
+    :param pkgs: if given, the packages to regenerate; defaults to the
+        whole repository.
+    :param journal: if given, :obj:`pkgcore.ebuild.regen_journal.RegenJournal`
+        instance to record regenerated packages in.
+    :param preload: if given, eclasses to preload into each worker's processor.
+    :param inherits: if given, mapping to record the eclasses inherited by
+        each package in.
+    """
+    shards = None
+    if pkgs is None or pkgs is repo:
+        categories = sorted(repo.categories)
+    else:
+        shards = {}
+        for pkg in pkgs:
+            shards.setdefault(pkg.category, []).append(pkg)
+        categories = sorted(shards)
+    if not categories:
+        return
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(min(processes, len(categories)), 1)
+
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    for category in categories:
+        tasks.put(category)
+    for x in xrange(processes):
+        tasks.put(None)
+
+    workers = {}
+    for x in xrange(processes):
+        p = multiprocessing.Process(
+            target=_regen_process_worker,
+            args=(repo, shards, tasks, results, journal, preload,
+                  inherits is not None, options))
+        p.daemon = True
+        p.start()
+        workers[p.pid] = p
+
+    done = 0
+    try:
+        while workers:
+            try:
+                msg = results.get(timeout=1)
+            except Queue.Empty:
+                # catch workers that died without reporting back.
+                for pid, p in workers.items():
+                    if not p.is_alive():
+                        observer.error(
+                            "regen worker %i exited unexpectedly with code %s",
+                            pid, p.exitcode)
+                        del workers[pid]
+                continue
+            level = msg[0]
+            if level == 'finished':
+                p = workers.pop(msg[1], None)
+                if p is not None:
+                    p.join()
+            elif level == 'pool':
+                processor.pool.merge_stats(msg[1])
+            elif level == 'journal':
+                journal.set_entry(msg[1], msg[2])
+            elif level == 'inherits':
+                inherits[msg[1]] = msg[2]
+            elif level == 'progress':
+                done += 1
+                observer.debug(
+                    "regenerated %i packages in %s (%i/%i categories)",
+                    msg[2], msg[1], done, len(categories))
+            else:
+                getattr(observer, level)("%s", msg[1])
+    finally:
+        for p in workers.itervalues():
+            p.terminate()
+            p.join()
@@ -226,16 +226,22 @@ class operations(sync_operations):
     def _cmd_api_regen_cache(self, observer=None, threads=1, **options):
         if getattr(self, '_regen_disable_threads', False):
             threads = 1
-        cache = getattr(self.repo, 'cache', None)
-        sync_rate = getattr(cache, 'sync_rate', None)
+        sync_rates = [(cache, cache.sync_rate) for cache in self._get_caches()
+                      if getattr(cache, 'sync_rate', None) is not None]
+        # batch writes, unless each worker process writes on its own; a
+        # transaction left open by one (sqlite allows a single writer)
+        # would block the others.
+        rate = 1000000
+        if options.get('use_processes') and threads > 1:
+            rate = 1
         try:
-            if sync_rate is not None:
-                cache.set_sync_rate(1000000)
+            for cache, sync_rate in sync_rates:
+                cache.set_sync_rate(rate)
             return regen.regen_repository(
                 self.repo,
                 self._get_observer(observer), threads=threads, **options)
         finally:
-            if sync_rate is not None:
+            for cache, sync_rate in sync_rates:
                 cache.set_sync_rate(sync_rate)
             self.repo.operations.run_if_supported("flush_cache")
 
@@ -0,0 +1,280 @@
+# License: GPL2/BSD
+
+"""
+concurrent execution of a resolver plan
+
+The ops of a plan are ordered such that dependencies come first; this
+derives which earlier ops each op actually depends on, and runs ops in
+forked children as soon as those have finished.
+"""
+
+__all__ = ("op_dependencies", "Scheduler", "FsLock")
+
+from collections import defaultdict
+import errno
+import fcntl
+import os
+import signal
+import sys
+import time
+
+from snakeoil.demandload import demandload
+from snakeoil.lists import iflatten_instance
+from snakeoil.osutils import ensure_dirs, pjoin
+
+from pkgcore.ebuild.atom import atom
+
+demandload(
+    'traceback',
+    'pkgcore.log:logger',
+)
+
+# attributes of a pkg that must be satisfied prior to building it.
+dependency_attrs = ("depends", "rdepends")
+
+
+def _iter_dependency_atoms(pkg):
+    for attr in dependency_attrs:
+        for a in iflatten_instance(getattr(pkg, attr, ()), atom):
+            if isinstance(a, atom) and not a.blocks:
+                yield a
+
+
+def op_dependencies(ops):
+    """Determine the earlier ops each op of a plan has to wait for.
+
+    An op depends on the earlier ops whose pkg matches any of its build or
+    runtime dependencies, including all alternatives of || groups.  Removals
+    are treated as barriers: they wait for everything prior, and everything
+    after waits for them.
+
+    :param ops: sequence of resolver ops, in plan order
+    :return: list holding a frozenset of op indexes for each op
+    """
+    by_key = defaultdict(list)
+    deps = []
+    barrier = None
+    since_barrier = []
+    for i, op in enumerate(ops):
+        if op.desc == "remove":
+            d = set(since_barrier)
+            if barrier is not None:
+                d.add(barrier)
+            barrier = i
+            since_barrier = []
+            by_key.clear()
+        else:
+            d = set()
+            if barrier is not None:
+                d.add(barrier)
+            for a in _iter_dependency_atoms(op.pkg):
+                for j in by_key.get(a.key, ()):
+                    if j not in d and a.match(ops[j].pkg):
+                        d.add(j)
+            by_key[op.pkg.key].append(i)
+            since_barrier.append(i)
+        deps.append(frozenset(d))
+    return deps
+
+
+class FsLock(object):
+
+    """
+    exclusive inter-process lock on a directory, via flock
+
+    A fresh descriptor is opened for each acquisition, thus forked children
+    never share their parent's lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self):
+        ensure_dirs(self.path, mode=0755, minimal=True)
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        if fd is not None:
+            os.close(fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.release()
+
+
+class Scheduler(object):
+
+    """
+    run the ops of a plan in forked children, honoring their dependencies
+
+    Each child's stdout and stderr are redirected to a per op log file.
+
+    :ivar succeeded: indexes of the ops that completed
+    :ivar failed: indexes of the ops that failed, or were skipped since one
+        of their dependencies failed
+    """
+
+    # seconds between checks for finished jobs.
+    poll_interval = 0.2
+
+    def __init__(self, ops, job, log_dir, jobs=1, load_average=None,
+                 keep_going=False, ready=None):
+        """
+        :param ops: sequence of resolver ops, in plan order
+        :param job: callable run in the child as job(op, logfile); a
+            return value of False, or an exception, marks the op as failed
+        :param log_dir: directory to write the per op logs to
+        :param jobs: maximum number of ops to run at once
+        :param load_average: if set, no op is started while another is
+            running and the one minute load average is at or above this
+        :param keep_going: if False, no further ops are started once one fails
+        :param ready: if given, called with the index of an op whose
+            dependencies are done; the op isn't started till it returns True
+        """
+        self.ops = ops
+        self.job = job
+        self.log_dir = log_dir
+        self.jobs = max(jobs, 1)
+        self.load_average = load_average
+        self.keep_going = keep_going
+        self.ready = ready
+        self.deps = op_dependencies(ops)
+        self.succeeded = set()
+        self.failed = set()
+
+    def log_path(self, op):
+        pkg = op.pkg
+        return pjoin(self.log_dir, pkg.category,
+                     "%s-%s.log" % (pkg.package, pkg.fullver))
+
+    def _overloaded(self):
+        if self.load_average is None:
+            return False
+        try:
+            return os.getloadavg()[0] >= self.load_average
+        except OSError:
+            return False
+
+    def _spawn(self, op):
+        path = self.log_path(op)
+        ensure_dirs(os.path.dirname(path), mode=0755, minimal=True)
+        logfile = open(path, "w")
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            logfile.close()
+            return pid
+        # child; never return into the caller's stack.
+        status = 1
+        try:
+            try:
+                null = os.open(os.devnull, os.O_RDONLY)
+                os.dup2(null, 0)
+                os.dup2(logfile.fileno(), 1)
+                os.dup2(logfile.fileno(), 2)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                if self.job(op, logfile) is not False:
+                    status = 0
+            except:
+                traceback.print_exc(file=logfile)
+            logfile.flush()
+        finally:
+            os._exit(status)
+
+    def run(self, started=None, finished=None):
+        """Run every op, returning True if all succeeded.
+
+        :param started: if given, called as started(op, log path) as each op
+            is started
+        :param finished: if given, called as finished(op, log path, result)
+            as each op completes; result is True, False on failure, or None
+            if it was skipped due to a failed dependency
+        """
+        pending = range(len(self.ops))
+        running = {}
+        try:
+            while pending or running:
+                waiting = False
+                if not self.failed or self.keep_going:
+                    for i in pending[:]:
+                        if len(running) >= self.jobs:
+                            break
+                        deps = self.deps[i]
+                        if not deps.isdisjoint(self.failed):
+                            pending.remove(i)
+                            self.failed.add(i)
+                            if finished is not None:
+                                finished(self.ops[i], None, None)
+                            continue
+                        if not deps.issubset(self.succeeded):
+                            continue
+                        if self.ready is not None and not self.ready(i):
+                            waiting = True
+                            continue
+                        if running and self._overloaded():
+                            break
+                        op = self.ops[i]
+                        running[self._spawn(op)] = i
+                        pending.remove(i)
+                        if started is not None:
+                            started(op, self.log_path(op))
+                if not running:
+                    if not waiting:
+                        break
+                    time.sleep(self.poll_interval)
+                    continue
+                pid, status = self._reap(running)
+                if pid is None:
+                    continue
+                i = running.pop(pid)
+                result = os.WIFEXITED(status) and not os.WEXITSTATUS(status)
+                (self.succeeded if result else self.failed).add(i)
+                if finished is not None:
+                    op = self.ops[i]
+                    finished(op, self.log_path(op), result)
+        finally:
+            self._kill(running)
+        return not self.failed and not pending
+
+    def _reap(self, running):
+        # only our own children are waited on; the parent may have others,
+        # ebuild processors for example.
+        for pid in running:
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if done:
+                return pid, status
+        time.sleep(self.poll_interval)
+        return None, None
+
+    @staticmethod
+    def _kill(running):
+        for pid in running:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+        for pid in running:
+            try:
+                os.waitpid(pid, 0)
+            except OSError as e:
+                if e.errno != errno.ECHILD:
+                    logger.warning("failed reaping job %i: %s", pid, e)
+        running.clear()
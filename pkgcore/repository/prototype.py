@@ -147,15 +147,22 @@ class tree(object):
         :keyword frozen: controls whether the repository is mutable or immutable
         """
 
-        self.categories = CategoryIterValLazyDict(
-            self._get_categories, self._get_categories)
-        self.packages = PackageMapping(self.categories, self._get_packages)
-        self.versions = VersionMapping(self.packages, self._get_versions)
+        self.reload()
 
         if self.frozen_settable:
             self.frozen = frozen
         self.lock = None
 
+    def reload(self):
+        """Force the categories, packages, and versions to be relisted.
+
+        Needed when another process may have added or removed packages.
+        """
+        self.categories = CategoryIterValLazyDict(
+            self._get_categories, self._get_categories)
+        self.packages = PackageMapping(self.categories, self._get_packages)
+        self.versions = VersionMapping(self.packages, self._get_versions)
+
     def _get_categories(self, *args):
         """this must return a list, or sequence"""
         raise NotImplementedError(self, "_get_categories")
@@ -8,6 +8,7 @@ __all__ = ("argparser", "main")
 
 import time
 
+from pkgcore.cache import convert_entry, errors
 from pkgcore.util import commandline
 
 argparser = commandline.mk_argparser(
@@ -41,21 +42,29 @@ def main(options, out, err):
         out.write("grabbing target's existing keys")
     valid = set()
     start = time.time()
-    if options.verbose:
-        for k, v in source.iteritems():
-            out.write("updating %s" % (k,))
-            target[k] = v
-            valid.add(k)
-    else:
-        for k, v in source.iteritems():
-            target[k] = v
-            valid.add(k)
-
-    for x in target.iterkeys():
+    try:
+        if options.verbose:
+            for k, v in source.iteritems():
+                out.write("updating %s" % (k,))
+                target[k] = convert_entry(source, target, k, v)
+                valid.add(k)
+        else:
+            for k, v in source.iteritems():
+                target[k] = convert_entry(source, target, k, v)
+                valid.add(k)
+    except errors.CacheError as e:
+        out.error("failed cloning cache: %s" % (e,))
+        if not target.autocommits:
+            target.commit()
+        return 1
+
+    for x in list(target.iterkeys()):
         if x not in valid:
             if options.verbose:
                 out.write("deleting %s" % (x,))
             del target[x]
+    if not target.autocommits:
+        target.commit()
 
     if options.verbose:
         out.write("took %i seconds" % int(time.time() - start))
@@ -20,6 +20,7 @@ demandload(
     'time',
     'snakeoil.osutils:pjoin,listdir_dirs',
     'snakeoil.process:get_proc_count',
+    'pkgcore.cache:packed',
     'pkgcore.ebuild:processor,triggers',
     'pkgcore.fs:contents,livefs',
     'pkgcore.merge:triggers@merge_triggers',
@@ -197,9 +198,59 @@ regen.add_argument(
     default=commandline.DelayedValue(_get_default_jobs, 100),
     help="number of threads to use for regeneration.  Defaults to using all "
     "available processors")
+regen.add_argument(
+    "--use-processes", action='store_true', default=False,
+    help="run the regeneration workers as separate processes rather than "
+    "threads, sharding the work by category.  Each worker gets its own "
+    "ebuild processor and cache writer, avoiding contention on the python "
+    "side when regenerating large repositories.  Needs --threads greater "
+    "than 1")
+regen.add_argument(
+    "--batch-size", type=int, default=1,
+    help="number of ebuilds to send to an ebuild processor at once for "
+    "metadata generation.  Batching avoids a python round trip per ebuild; "
+    "defaults to 1 (no batching)")
+regen.add_argument(
+    "--preload-eclasses", type=int, default=0, metavar="COUNT",
+    help="preload the COUNT most inherited eclasses (and the eclasses they "
+    "inherit) into each ebuild processor before regenerating.  Inherit "
+    "frequencies are tracked in a profile stored alongside the repository's "
+    "cache, bootstrapped from the cache's existing metadata")
+regen.add_argument(
+    "--order-by-inherit", action='store_true', default=False,
+    help="regenerate ebuilds grouped by the set of eclasses they inherit, "
+    "maximizing reuse of eclasses cached in the ebuild processors")
+regen.add_argument(
+    "--recycle-after", type=int, default=None, metavar="COUNT",
+    help="replace each ebuild processor after it has sourced COUNT ebuilds, "
+    "bounding bash memory growth over long regenerations")
+regen.add_argument(
+    "--recycle-rss", type=int, default=None, metavar="MB",
+    help="replace an ebuild processor once its resident memory exceeds MB "
+    "megabytes")
+regen.add_argument(
+    "--pool-min", type=int, default=None, metavar="COUNT",
+    help="number of idle ebuild processors to keep spawned; defaults to 0")
+regen.add_argument(
+    "--pool-max", type=int, default=None, metavar="COUNT",
+    help="maximum number of idle ebuild processors to keep around; "
+    "defaults to no limit")
 regen.add_argument(
     "--force", action='store_true', default=False,
     help="force regeneration to occur regardless of staleness checks")
+regen.add_argument(
+    "--incremental", action='store_true', default=False,
+    help="only regenerate packages whose ebuild or inherited eclasses changed "
+    "since the last incremental regen, as recorded in a journal stored "
+    "alongside the repository's cache")
+regen.add_argument(
+    "--journal", default=None,
+    help="location of the incremental regen journal; defaults to a file "
+    "next to the repository's writable cache")
+regen.add_argument(
+    "--pack", action='store_true', default=False,
+    help="after regenerating, rewrite the repository's packed caches "
+    "(pkgcore.cache.packed.database) from its writable cache")
 regen.add_argument(
     "--rsync", action='store_true', default=False,
     help="perform actions necessary for rsync repos (update metadata/timestamp.chk)")
@@ -209,6 +260,27 @@ regen.add_argument(
 regen.add_argument(
     "repo", action=commandline.StoreRepoObject,
     help="repository to regenerate caches for")
+
+
+def _pack_caches(repo, out, err):
+    caches = getattr(repo, 'cache', ())
+    targets = [x for x in caches if isinstance(x, packed.database)]
+    if not targets:
+        err.write("repository %s has no packed cache configured" % (repo,))
+        return 1
+    sources = [x for x in caches
+               if not x.readonly and not isinstance(x, packed.database)]
+    if not sources:
+        err.write("repository %s has no writable cache to pack" % (repo,))
+        return 1
+    for target in targets:
+        start_time = time.time()
+        target.pack(sources[0])
+        out.write("packed %s in %.2f seconds" %
+                  (target.location, time.time() - start_time))
+    return 0
+
+
 @regen.bind_main_func
 def regen_main(options, out, err):
     """Regenerate a repository cache."""
@@ -218,9 +290,20 @@ def regen_main(options, out, err):
         out.write("repository %s doesn't support cache regeneration" % (repo,))
         return 0
 
+    max_rss = options.recycle_rss
+    if max_rss is not None:
+        max_rss *= 1024
+    processor.pool.configure(
+        min_size=options.pool_min, max_size=options.pool_max,
+        max_uses=options.recycle_after, max_rss=max_rss)
+
     start_time = time.time()
     repo.operations.regen_cache(
-        threads=options.threads,
+        threads=options.threads, use_processes=options.use_processes,
+        incremental=options.incremental, journal_path=options.journal,
+        batch_size=options.batch_size,
+        preload_eclasses=options.preload_eclasses,
+        order_by_inherit=options.order_by_inherit,
         observer=observer.formatter_output(out), force=options.force,
         eclass_caching=(not options.disable_eclass_caching))
     end_time = time.time()
@@ -228,6 +311,10 @@ def regen_main(options, out, err):
         out.write(
             "finished %d nodes in %.2f seconds" %
             (len(repo), end_time - start_time))
+    if options.pack:
+        ret = _pack_caches(repo, out, err)
+        if ret:
+            return ret
     if options.rsync:
         timestamp = pjoin(repo.location, "metadata", "timestamp.chk")
         try:
@@ -340,6 +427,9 @@ digest = subparsers.add_parser(
 digest.add_argument(
     "--repo", "--repository", help="repository to update",
     action=commandline.StoreRepoObject)
+digest.add_argument(
+    "-j", "--jobs", type=int, default=1,
+    help="number of distfiles to hash at once")
 commandline.make_query(
     digest, nargs='+', dest='query',
     help="packages matching any of these restrictions will have their"
@@ -358,7 +448,8 @@ def digest_main(options, out, err):
     elif not repo.has_match(options.query):
         out.write("query %s doesn't match anything\n" % (options.query,))
         return 1
-    if not repo_ops.digests(domain, options.query, observer=obs):
+    if not repo_ops.digests(domain, options.query, observer=obs,
+                            jobs=options.jobs):
         out.write("some errors were encountered...")
         return 1
     return 0
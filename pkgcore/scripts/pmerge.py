@@ -26,7 +26,17 @@ from pkgcore.restrictions.boolean import OrRestriction
 from pkgcore.util import commandline, parserestrict, repo_utils
 
 from snakeoil.compatibility import IGNORED_EXCEPTIONS
+from snakeoil.demandload import demandload
 from snakeoil.lists import stable_unique
+from snakeoil.osutils import pjoin
+
+demandload(
+    'tempfile:gettempdir',
+    'snakeoil:formatters',
+    'snakeoil.process:get_proc_count',
+    'pkgcore.ebuild:processor',
+    'pkgcore.operations:fetch_ahead,scheduler',
+)
 
 
 class StoreTarget(argparse._AppendAction):
@@ -92,6 +102,20 @@ merge_mode.add_argument(
     '-1', '--oneshot', action='store_true',
     help="do not record changes in the world file; if a set is "
          "involved, defaults to forcing oneshot")
+merge_mode.add_argument(
+    '-j', '--jobs', type=int, default=1, metavar='JOBS',
+    help="build and merge up to JOBS packages at once; each package's "
+         "output is written to its own log file")
+merge_mode.add_argument(
+    '--load-average', type=float, metavar='LOAD',
+    help="with --jobs, don't start another package while the load average "
+         "is at or above LOAD")
+merge_mode.add_argument(
+    '--fetch-jobs', type=int, metavar='JOBS',
+    help="fetch the files of up to JOBS packages at once in the background, "
+         "ahead of building them; 0 fetches each package's files right "
+         "before building it. Defaults to 2, or with --fetchonly to the "
+         "--jobs value if given, else the number of CPUs")
 
 resolution_options = argparser.add_argument_group("Resolver options")
 resolution_options.add_argument(
@@ -414,6 +438,243 @@ def load_world(namespace, attr):
     setattr(namespace, attr, value)
 
 
+def build_op(options, out, domain, op, build_obs, cleanup):
+    """Fetch and build the pkg of an install or replace op.
+
+    Callables releasing what the op holds onto are appended to cleanup.
+
+    :return: the pkg to merge, None if only fetching, or False on failure
+    """
+    cleanup.append(op.pkg.release_cached_data)
+
+    if not options.fetchonly and options.debug:
+        out.write("Forcing a clean of workdir")
+
+    pkg_ops = domain.pkg_operations(op.pkg, observer=build_obs)
+    out.write("\n%i files required-" % len(op.pkg.fetchables))
+    try:
+        ret = pkg_ops.run_if_supported("fetch", or_return=True)
+    except IGNORED_EXCEPTIONS:
+        raise
+    except Exception as e:
+        ret = e
+    if ret is not True:
+        if ret is False:
+            ret = None
+        commandline.dump_error(out, ret, "\nfetching failed for %s" % (op.pkg.cpvstr,))
+        return False
+    if options.fetchonly:
+        return None
+
+    buildop = pkg_ops.run_if_supported("build", or_return=None)
+    pkg = op.pkg
+    if buildop is not None:
+        out.write("building %s" % (op.pkg.cpvstr,))
+        result = False
+        try:
+            result = buildop.finalize()
+        except format.errors as e:
+            out.error("caught exception building %s: % s" % (op.pkg.cpvstr, e))
+        else:
+            if result is False:
+                out.error("failed building %s" % (op.pkg.cpvstr,))
+        if result is False:
+            return False
+        pkg = result
+        cleanup.append(pkg.release_cached_data)
+        pkg_ops = domain.pkg_operations(pkg, observer=build_obs)
+        cleanup.append(buildop.cleanup)
+
+    cleanup.append(partial(pkg_ops.run_if_supported, "cleanup"))
+    # note the ops aren't reset after localizing, thus could be the wrong
+    # set of ops; don't use them further.
+    return pkg_ops.run_if_supported("localize", or_return=pkg)
+
+
+def merge_op(out, domain, op, pkg, repo_obs, cleanup):
+    """Merge the built pkg of an op, or unmerge for remove ops.
+
+    :return: True on success, False if the merge was blocked
+    """
+    if op.desc != "remove":
+        out.write()
+        if op.desc == "replace":
+            if op.old_pkg == pkg:
+                out.write(">>> Reinstalling %s" % (pkg.cpvstr))
+            else:
+                out.write(">>> Replacing %s with %s" % (
+                    op.old_pkg.cpvstr, pkg.cpvstr))
+            i = domain.replace_pkg(op.old_pkg, pkg, repo_obs)
+            cleanup.append(op.old_pkg.release_cached_data)
+        else:
+            out.write(">>> Installing %s" % (pkg.cpvstr,))
+            i = domain.install_pkg(pkg, repo_obs)
+    else:
+        out.write(">>> Removing %s" % op.pkg.cpvstr)
+        i = domain.uninstall_pkg(op.pkg, repo_obs)
+    try:
+        i.finish()
+    except merge_errors.BlockModification as e:
+        out.error("Failed to merge %s: %s" % (op.pkg, e))
+        return False
+    return True
+
+
+def update_world(options, out, op, atoms, world_set, source_repos):
+    """Record the outcome of a successful op in the world set."""
+    if world_set is None:
+        return
+    if op.desc == "remove":
+        out.write('>>> Removing %s from world file' % op.pkg.cpvstr)
+        removal_pkg = slotatom_if_slotted(source_repos.combined, op.pkg.versioned_atom)
+        update_worldset(world_set, removal_pkg, remove=True)
+    elif not options.oneshot and any(x.match(op.pkg) for x in atoms):
+        if not options.upgrade:
+            out.write('>>> Adding %s to world file' % op.pkg.cpvstr)
+            add_pkg = slotatom_if_slotted(source_repos.combined, op.pkg.versioned_atom)
+            update_worldset(world_set, add_pkg)
+
+
+def log_dir(domain):
+    """Directory the logs of background jobs are written to."""
+    return pjoin(domain._get_tempspace() or gettempdir(), '.pmerge-logs')
+
+
+def fetch_jobs(options):
+    """Number of packages to fetch the files of at once."""
+    if options.fetch_jobs is not None:
+        return options.fetch_jobs
+    elif options.fetchonly:
+        # nothing is built, so fetching is all there is to parallelize.
+        return options.jobs if options.jobs > 1 else get_proc_count()
+    return 2
+
+
+def start_fetching(options, domain, changes):
+    """Start fetching the files of a plan in the background.
+
+    :return: the started :obj:`pkgcore.operations.fetch_ahead.FetchPipeline`,
+        or None if fetching ahead is disabled or there's nothing to fetch
+    """
+    jobs = fetch_jobs(options)
+    if jobs < 1:
+        return None
+    pkgs = [op.pkg if op.desc != "remove" and op.pkg.fetchables else None
+            for op in changes]
+    if not any(pkgs):
+        return None
+    pipeline = fetch_ahead.FetchPipeline(
+        domain, pkgs, pjoin(log_dir(domain), 'fetch.log'),
+        jobs=jobs)
+    pipeline.start()
+    return pipeline
+
+
+def fetch_only(options, out, pipeline, changes):
+    """Wait for a pipeline to fetch everything, reporting as pkgs finish."""
+    out.write("Fetching the files of up to %i packages at once, logging to %s" % (
+        pipeline.jobs, pipeline.log_path))
+    failed = 0
+    for i, ok in pipeline:
+        if ok:
+            out.write(">>> Fetched %s" % (changes[i].pkg.cpvstr,))
+        else:
+            failed += 1
+            out.error("fetching failed for %s, see %s" % (
+                changes[i].pkg.cpvstr, pipeline.log_path))
+    if failed and not options.ignore_failures:
+        return 1
+    out.write("finished")
+    return 0
+
+
+def parallel_merge(options, out, domain, changes, atoms, world_set, source_repos,
+                   pipeline=None):
+    """Run the ops of a plan concurrently, per --jobs and --load-average.
+
+    Each op is fetched, built, and merged in a child process logging to its
+    own file; merges are serialized via a lock on the vdb, which is relisted
+    once the lock is held.
+    """
+    vdbs = sorted(
+        repo_utils.get_virtual_repos(domain.all_livefs_repos, False),
+        key=lambda x: x.location)
+    locks = [scheduler.FsLock(x.location) for x in vdbs]
+    logs = log_dir(domain)
+
+    def job(op, logfile):
+        # the parent's ebuild processors are its own.
+        processor.forget_all_processors()
+        job_out = formatters.PlainTextFormatter(logfile)
+        build_obs = observer.build_observer(
+            observer.formatter_output(job_out), not options.debug)
+        repo_obs = observer.repo_observer(
+            observer.formatter_output(job_out), not options.debug)
+        cleanup = []
+        try:
+            pkg = None
+            if op.desc != "remove":
+                pkg = build_op(options, job_out, domain, op, build_obs, cleanup)
+                if pkg is False:
+                    return False
+                elif pkg is None:
+                    return True
+            for lock in locks:
+                lock.acquire()
+            # the vdb was listed when forked; relist it to see what sibling
+            # jobs merged since, else collisions with them go unnoticed.
+            for repo in vdbs:
+                repo.reload()
+            try:
+                return merge_op(job_out, domain, op, pkg, repo_obs, cleanup)
+            finally:
+                for lock in reversed(locks):
+                    lock.release()
+        finally:
+            for func in cleanup:
+                func()
+            processor.shutdown_all_processors()
+
+    change_count = len(changes)
+    sched = scheduler.Scheduler(
+        changes, job, logs, jobs=options.jobs,
+        load_average=options.load_average,
+        keep_going=options.ignore_failures,
+        ready=None if pipeline is None else pipeline.ready)
+    state = {'started': 0}
+
+    def update_title():
+        out.title("%i/%i: %i running" % (
+            len(sched.succeeded) + len(sched.failed), change_count,
+            state['started'] - len(sched.succeeded) - len(sched.failed)))
+
+    def started(op, log_path):
+        state['started'] += 1
+        out.write("Started %s (%i of %i), log: %s" % (
+            op.pkg.cpvstr, state['started'], change_count, log_path))
+        update_title()
+
+    def finished(op, log_path, result):
+        if result is None:
+            out.error("Skipped %s: a dependency failed" % (op.pkg.cpvstr,))
+        elif result:
+            out.write(">>> Completed %s" % (op.pkg.cpvstr,))
+            if not options.fetchonly:
+                update_world(options, out, op, atoms, world_set, source_repos)
+        else:
+            out.error("Failed %s, see %s" % (op.pkg.cpvstr, log_path))
+        update_title()
+
+    out.write("Running up to %i jobs at once, logging to %s" % (
+        options.jobs, logs))
+    ok = sched.run(started=started, finished=finished)
+    out.write("%i of %i succeeded" % (len(sched.succeeded), change_count))
+    if not ok and not options.ignore_failures:
+        return 1
+    out.write("finished")
+    return 0
+
+
 @argparser.bind_main_func
 def main(options, out, err):
     config = options.config
@@ -676,6 +937,25 @@ def main(options, out, err):
     if (options.ask and not formatter.ask("Would you like to merge these packages?")):
         return
 
+    pipeline = start_fetching(options, domain, changes)
+    try:
+        if pipeline is not None and options.fetchonly:
+            return fetch_only(options, out, pipeline, changes)
+        elif options.jobs > 1:
+            return parallel_merge(
+                options, out, domain, changes, atoms, world_set, source_repos,
+                pipeline=pipeline)
+        return serial_merge(
+            options, out, domain, changes, atoms, world_set, source_repos,
+            build_obs, repo_obs, pipeline=pipeline)
+    finally:
+        if pipeline is not None:
+            pipeline.stop()
+
+
+def serial_merge(options, out, domain, changes, atoms, world_set, source_repos,
+                 build_obs, repo_obs, pipeline=None):
+    """Run the ops of a plan one at a time."""
     change_count = len(changes)
 
     # left in place for ease of debugging.
@@ -689,80 +969,20 @@ def main(options, out, err):
 
             out.write("\nProcessing %i of %i: %s" % (count + 1, change_count, op.pkg.cpvstr))
             out.title("%i/%i: %s" % (count + 1, change_count, op.pkg.cpvstr))
+            pkg = None
             if op.desc != "remove":
-                cleanup = [op.pkg.release_cached_data]
-
-                if not options.fetchonly and options.debug:
-                    out.write("Forcing a clean of workdir")
-
-                pkg_ops = domain.pkg_operations(op.pkg, observer=build_obs)
-                out.write("\n%i files required-" % len(op.pkg.fetchables))
-                try:
-                    ret = pkg_ops.run_if_supported("fetch", or_return=True)
-                except IGNORED_EXCEPTIONS:
-                    raise
-                except Exception as e:
-                    ret = e
-                if ret is not True:
-                    if ret is False:
-                        ret = None
-                    commandline.dump_error(out, ret, "\nfetching failed for %s" % (op.pkg.cpvstr,))
+                if pipeline is not None and not pipeline.ready(count):
+                    out.write("Waiting for the files of %s" % (op.pkg.cpvstr,))
+                    pipeline.wait(count)
+                pkg = build_op(options, out, domain, op, build_obs, cleanup)
+                if pkg is False:
                     if not options.ignore_failures:
                         return 1
                     continue
-                if options.fetchonly:
+                elif pkg is None:
                     continue
 
-                buildop = pkg_ops.run_if_supported("build", or_return=None)
-                pkg = op.pkg
-                if buildop is not None:
-                    out.write("building %s" % (op.pkg.cpvstr,))
-                    result = False
-                    try:
-                        result = buildop.finalize()
-                    except format.errors as e:
-                        out.error("caught exception building %s: % s" % (op.pkg.cpvstr, e))
-                    else:
-                        if result is False:
-                            out.error("failed building %s" % (op.pkg.cpvstr,))
-                    if result is False:
-                        if not options.ignore_failures:
-                            return 1
-                        continue
-                    pkg = result
-                    cleanup.append(pkg.release_cached_data)
-                    pkg_ops = domain.pkg_operations(pkg, observer=build_obs)
-                    cleanup.append(buildop.cleanup)
-
-                cleanup.append(partial(pkg_ops.run_if_supported, "cleanup"))
-                pkg = pkg_ops.run_if_supported("localize", or_return=pkg)
-                # wipe this to ensure we don't inadvertantly use it further down;
-                # we aren't resetting it after localizing, so could have the wrong
-                # set of ops.
-                del pkg_ops
-
-                out.write()
-                if op.desc == "replace":
-                    if op.old_pkg == pkg:
-                        out.write(">>> Reinstalling %s" % (pkg.cpvstr))
-                    else:
-                        out.write(">>> Replacing %s with %s" % (
-                            op.old_pkg.cpvstr, pkg.cpvstr))
-                    i = domain.replace_pkg(op.old_pkg, pkg, repo_obs)
-                    cleanup.append(op.old_pkg.release_cached_data)
-                else:
-                    out.write(">>> Installing %s" % (pkg.cpvstr,))
-                    i = domain.install_pkg(pkg, repo_obs)
-
-                # force this explicitly- can hold onto a helluva lot more
-                # then we would like.
-            else:
-                out.write(">>> Removing %s" % op.pkg.cpvstr)
-                i = domain.uninstall_pkg(op.pkg, repo_obs)
-            try:
-                ret = i.finish()
-            except merge_errors.BlockModification as e:
-                out.error("Failed to merge %s: %s" % (op.pkg, e))
+            if not merge_op(out, domain, op, pkg, repo_obs, cleanup):
                 if not options.ignore_failures:
                     return 1
                 continue
@@ -773,16 +993,7 @@ def main(options, out, err):
             # mainly to protect against any code following triggering reloads
             # basically, be protective
 
-            if world_set is not None:
-                if op.desc == "remove":
-                    out.write('>>> Removing %s from world file' % op.pkg.cpvstr)
-                    removal_pkg = slotatom_if_slotted(source_repos.combined, op.pkg.versioned_atom)
-                    update_worldset(world_set, removal_pkg, remove=True)
-                elif not options.oneshot and any(x.match(op.pkg) for x in atoms):
-                    if not options.upgrade:
-                        out.write('>>> Adding %s to world file' % op.pkg.cpvstr)
-                        add_pkg = slotatom_if_slotted(source_repos.combined, op.pkg.versioned_atom)
-                        update_worldset(world_set, add_pkg)
+            update_world(options, out, op, atoms, world_set, source_repos)
 
 
 #    again... left in place for ease of debugging.
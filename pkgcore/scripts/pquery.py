@@ -5,6 +5,7 @@
 """pkgcore query interface"""
 
 from functools import partial
+from itertools import chain
 
 from snakeoil.demandload import demandload
 from snakeoil.formatters import decorate_forced_wrapping
@@ -18,7 +19,11 @@ demandload(
     'errno',
     're',
     'snakeoil.lists:iter_stable_unique',
+    'pkgcore.ebuild:revdep_index',
+    'pkgcore.ebuild.cpv:versioned_CPV',
+    'pkgcore.ebuild.errors:InvalidCPV',
     'pkgcore.fs:fs@fs_module,contents@contents_module',
+    'pkgcore.vdb:owners',
 )
 
 
@@ -371,8 +376,10 @@ def print_package(options, out, err, pkg):
             out.write()
 
     if options.contents:
-        for location in sorted(obj.location for obj in get_pkg_attr(pkg, 'contents', ())):
-            out.write(location)
+        contents = get_pkg_attr(pkg, 'contents', None)
+        if contents is not None:
+            for location in sorted(contents.iterpaths()):
+                out.write(location)
 
 
 def print_packages_noversion(options, out, err, pkgs):
@@ -553,7 +560,8 @@ query.add_argument(
     subst=(('--restrict-revdep', '%(0)s'), ('--print-revdep', '%(0)s')),
     help='shorthand for --restrict-revdep atom --print-revdep atom. '
          '--print-revdep is slow, use just --restrict-revdep if you just '
-         'need a list.')
+         'need a list.  For ebuild repos with a writable cache, candidates '
+         'are pulled from an index of dependencies kept next to that cache.')
 
 query.add_argument(
     '--revdep-pkgs', nargs=1,
@@ -563,22 +571,28 @@ query.add_argument(
          '--print-revdep atom. --print-revdep is slow, use just '
          '--restrict-revdep if you just need a list.')
 
-@bind_add_query(
-    '--restrict-revdep', action='append',
-    default=[], dest='restrict_revdep',
-    help='Dependency on an atom.')
-def parse_revdep(value):
-    """Value should be an atom, packages with deps intersecting that match."""
+def _parse_revdep_atom(value):
     try:
-        targetatom = atom.atom(value)
+        return atom.atom(value)
     except atom.MalformedAtom as e:
         raise parserestrict.ParseError(str(e))
-    val_restrict = values.FlatteningRestriction(
-        atom.atom,
-        values.AnyMatch(values.FunctionRestriction(targetatom.intersects)))
-    return packages.OrRestriction(*list(
-        packages.PackageRestriction(dep, val_restrict)
-        for dep in ('depends', 'rdepends', 'post_rdepends')))
+
+@bind_add_query(
+    '--restrict-revdep', action='append', type=_parse_revdep_atom,
+    default=[], dest='restrict_revdep',
+    bind='final_converter',
+    help='Dependency on an atom.')
+def parse_revdep(sequence, namespace):
+    """Values should be atoms, packages with deps intersecting them match."""
+    l = []
+    for targetatom in sequence:
+        val_restrict = values.FlatteningRestriction(
+            atom.atom,
+            values.AnyMatch(values.FunctionRestriction(targetatom.intersects)))
+        l.append(packages.OrRestriction(*list(
+            packages.PackageRestriction(dep, val_restrict)
+            for dep in ('depends', 'rdepends', 'post_rdepends'))))
+    return l
 
 def _revdep_pkgs_match(pkgs, value):
     return any(value.match(pkg) for pkg in pkgs)
@@ -836,6 +850,63 @@ def mangle_values(vals, err):
     return vals, ()
 
 
+def _owns_candidates(repo, options):
+    """cat/pkg pairs owning the queried paths per the vdb owners index"""
+    index = owners.get_index(repo)
+    if index is None:
+        return None
+    cpv_sets = []
+    if options._owns:
+        paths = set()
+        for r in options._owns:
+            paths.update(x.location for x in r.restriction.vals)
+        cpv_sets.append(set(chain.from_iterable(
+            index.owners(paths).itervalues())))
+    if options._owns_re:
+        # AnyMatch -> GetAttrRestriction('location') -> StrRegex
+        matchers = [r.restriction.restriction.restriction.match
+                    for r in options._owns_re]
+        cpv_sets.append(index.owners_matching(
+            lambda path: any(m(path) for m in matchers)))
+    candidates = set()
+    for cpv in set.intersection(*cpv_sets):
+        try:
+            cpv = versioned_CPV(cpv)
+        except InvalidCPV:
+            continue
+        candidates.add((cpv.category, cpv.package))
+    return candidates
+
+
+def _query_candidates(repo, options, revdep_keys):
+    """Return the cat/pkg pairs of a repo that can possibly match the query.
+
+    The repo's indexes are used to narrow things down; None is returned if
+    none of them apply, in which case the whole repo must be searched.
+    """
+    candidates = None
+    if revdep_keys:
+        # every revdep restriction must be satisfied, thus only packages
+        # possibly depending on one of the targets need be looked at.
+        index = revdep_index.get_index(repo)
+        if index is not None:
+            candidates = set()
+            for key in revdep_keys:
+                candidates.update(index.dependents(key))
+    if options._owns or options._owns_re:
+        cps = _owns_candidates(repo, options)
+        if cps is not None:
+            candidates = cps if candidates is None else candidates & cps
+    return candidates
+
+
+def _itermatch_candidates(repo, restrict, candidates):
+    return chain.from_iterable(
+        repo.itermatch(packages.AndRestriction(
+            atom.atom('%s/%s' % cp), restrict), sorter=sorted)
+        for cp in sorted(candidates))
+
+
 @argparser.bind_main_func
 def main(options, out, err):
     """Run a query."""
@@ -853,9 +924,17 @@ def main(options, out, err):
 
     if options.query is None:
         return 0
+    revdep_keys = set(x.key for x in
+                      options._restrict_revdep + options._restrict_revdep_pkgs)
     for repo in options.repos:
         try:
-            for pkgs in pkgutils.groupby_pkg(repo.itermatch(options.query, sorter=sorted)):
+            candidates = _query_candidates(repo, options, revdep_keys)
+            if candidates is None:
+                matches = repo.itermatch(options.query, sorter=sorted)
+            else:
+                matches = _itermatch_candidates(
+                    repo, options.query, candidates)
+            for pkgs in pkgutils.groupby_pkg(matches):
                 pkgs = list(pkgs)
                 if options.noversion:
                     print_packages_noversion(options, out, err, pkgs)
@@ -129,6 +129,14 @@ class BaseTest(TestCase):
             sorted([('foon', (('mtime', 2L),)), ('spork', (('mtime', 1L),))]),
             sorted(self.cache['spork']['_eclasses_']))
 
+    def test_eclasses_interned(self):
+        self.cache = self.get_db()
+        eclasses = {'spork': _mk_chf_obj(mtime=1)}
+        self.cache['spork'] = {'_eclasses_': eclasses}
+        self.cache['foon'] = {'_eclasses_': eclasses}
+        self.assertIdentical(self.cache['spork']['_eclasses_'],
+                             self.cache['foon']['_eclasses_'])
+
     def test_readonly(self):
         self.cache = self.get_db()
         self.cache['spork'] = {'foo':'bar'}
@@ -0,0 +1,93 @@
+# License: GPL2/BSD
+
+from pkgcore.cache import errors, lru
+from pkgcore.test import TestCase
+from pkgcore.test.cache.test_base import DictCache, _mk_chf_obj
+
+
+class CountingCache(DictCache):
+
+    def __init__(self, *args, **kwargs):
+        DictCache.__init__(self, *args, **kwargs)
+        self.lookups = 0
+
+    def _getitem(self, cpv):
+        self.lookups += 1
+        return DictCache._getitem(self, cpv)
+
+
+class TestLRU(TestCase):
+
+    cache_keys = ("foo", "_eclasses_")
+
+    def get_db(self, readonly=False, **kwds):
+        self.backend = CountingCache(
+            auxdbkeys=self.cache_keys, readonly=readonly)
+        return lru.database(self.backend, **kwds)
+
+    def test_hits(self):
+        cache = self.get_db()
+        cache['spork'] = {'foo': 'bar'}
+        self.assertEqual(cache['spork'], {'foo': 'bar'})
+        self.assertEqual(cache['spork'], {'foo': 'bar'})
+        self.assertEqual(self.backend.lookups, 1)
+        self.assertEqual(cache.stats(),
+                         {'hits': 1, 'misses': 1, 'evictions': 0})
+        self.assertRaises(KeyError, cache.__getitem__, 'foon')
+
+        # modifying what's returned doesn't affect what's held.
+        cache['spork']['foo'] = 'dar'
+        self.assertEqual(cache['spork'], {'foo': 'bar'})
+
+    def test_write_through(self):
+        cache = self.get_db()
+        cache['spork'] = {'foo': 'bar'}
+        self.assertEqual(cache['spork'], {'foo': 'bar'})
+        cache['spork'] = {'foo': 'dar'}
+        self.assertEqual(self.backend['spork'], {'foo': 'dar'})
+        self.assertEqual(cache['spork'], {'foo': 'dar'})
+        del cache['spork']
+        self.assertFalse('spork' in cache)
+        self.assertRaises(KeyError, cache.__getitem__, 'spork')
+        self.assertEqual(list(cache.iterkeys()), [])
+
+    def test_max_entries(self):
+        cache = self.get_db(max_entries=2)
+        for x in ('a', 'b', 'c'):
+            cache[x] = {'foo': x}
+            cache[x]
+        self.assertEqual(cache.evictions, 1)
+        # 'a' was the least recently used.
+        cache['b']
+        cache['c']
+        self.assertEqual(self.backend.lookups, 3)
+        cache['a']
+        self.assertEqual(self.backend.lookups, 4)
+        self.assertEqual(cache.evictions, 2)
+
+    def test_max_size(self):
+        cache = self.get_db(max_entries=None, max_size=20)
+        cache['a'] = {'foo': 'x' * 10}
+        cache['b'] = {'foo': 'x' * 10}
+        cache['a']
+        cache['b']
+        self.assertEqual(cache.evictions, 1)
+        cache['b']
+        self.assertEqual(self.backend.lookups, 2)
+        # an entry larger than the cap is still held, until the next lookup.
+        cache['c'] = {'foo': 'x' * 100}
+        cache['c']
+        cache['c']
+        self.assertEqual(self.backend.lookups, 3)
+
+    def test_eclasses(self):
+        cache = self.get_db()
+        cache['spork'] = {'_eclasses_': {'spork': _mk_chf_obj(mtime=1)}}
+        self.assertEqual(cache['spork']['_eclasses_'],
+                         (('spork', (('mtime', 1L),)),))
+
+    def test_readonly(self):
+        cache = self.get_db(readonly=True)
+        self.assertTrue(cache.readonly)
+        self.assertRaises(errors.ReadOnly,
+                          cache.__setitem__, 'spork', {'foo': 42})
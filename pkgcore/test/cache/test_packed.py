@@ -0,0 +1,82 @@
+# License: GPL2/BSD
+
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.cache import errors, flat_hash, packed
+from pkgcore.test.cache import util, test_base
+
+
+class db(packed.database):
+
+    def __setitem__(self, cpv, data):
+        data['_chf_'] = test_base._chf_obj
+        return packed.database.__setitem__(self, cpv, data)
+
+    def __getitem__(self, cpv):
+        d = dict(packed.database.__getitem__(self, cpv).iteritems())
+        d.pop('_%s_' % self.chf_type, None)
+        return d
+
+
+class TestPacked(util.GenericCacheMixin, TempDirMixin):
+
+    def get_db(self, readonly=False):
+        return db(pjoin(self.dir, 'packed'),
+            auxdbkeys=self.cache_keys, readonly=readonly)
+
+    def test_commit(self):
+        key, raw_data = util.generic_data
+        cache = self.get_db()
+        cache[key] = dict(raw_data)
+        cache['cat/pkg-1'] = dict(raw_data, SLOT='1')
+        # pending updates are visible before they're written out.
+        self.assertEqual(cache['cat/pkg-1']['SLOT'], '1')
+        self.assertEqual(list(self.get_db(True).iterkeys()), [])
+        cache.commit()
+
+        cache = self.get_db(True)
+        self.assertEqual(list(cache.iterkeys()), ['cat/pkg-1', key])
+        self.assertTrue(key in cache)
+        self.assertFalse('cat/pkg-0' in cache)
+        self.assertRaises(KeyError, cache.__getitem__, 'cat/pkg-0')
+        self.assertEqual(cache[key]['KEYWORDS'], '~amd64 ~ppc ~x86')
+        self.assertEqual(sorted(x[0] for x in cache[key]['_eclasses_']),
+            ['eutils', 'multilib', 'portability', 'toolchain-funcs'])
+
+        # existing entries are carried over on rewrites.
+        cache = self.get_db()
+        del cache['cat/pkg-1']
+        self.assertFalse('cat/pkg-1' in cache)
+        cache['cat/pkg-2'] = dict(raw_data)
+        cache.commit()
+        self.assertEqual(list(self.get_db(True).iterkeys()),
+            ['cat/pkg-2', key])
+
+    def test_pack(self):
+        key, raw_data = util.generic_data
+        source = flat_hash.database(pjoin(self.dir, 'flat'))
+        for cpv in (key, 'cat/pkg-1'):
+            d = dict(raw_data)
+            d['_chf_'] = test_base._chf_obj
+            source[cpv] = d
+        target = packed.database(pjoin(self.dir, 'packed'))
+        self.assertTrue(target.readonly)
+        target.pack(source)
+        self.assertTrue(target.readonly)
+        self.assertEqual(list(target.iterkeys()), ['cat/pkg-1', key])
+        orig, new = [dict(x[key].iteritems()) for x in (source, target)]
+        for d in (orig, new):
+            d['_eclasses_'] = sorted(d['_eclasses_'])
+        self.assertEqual(orig, new)
+
+    def test_corruption(self):
+        path = pjoin(self.dir, 'packed')
+        with open(path, 'w') as f:
+            f.write('garbage\n')
+        self.assertRaises(errors.GeneralCacheCorruption,
+            packed.database(path).iterkeys)
+        with open(path, 'w') as f:
+            f.write(packed.PACKED_MAGIC + '1\ncat/pkg-1\t0\t100\nSLOT=0')
+        self.assertRaises(errors.GeneralCacheCorruption,
+            packed.database(path).__contains__, 'cat/pkg-1')
@@ -0,0 +1,156 @@
+# License: GPL2/BSD
+
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.cache import convert_entry, errors, flat_hash, sqlite
+from pkgcore.operations import repo as repo_ops
+from pkgcore.operations.observer import null_output
+from pkgcore.test.cache import util, test_base
+
+
+class db(sqlite.database):
+
+    def __setitem__(self, cpv, data):
+        data['_chf_'] = test_base._chf_obj
+        return sqlite.database.__setitem__(self, cpv, data)
+
+    def __getitem__(self, cpv):
+        d = dict(sqlite.database.__getitem__(self, cpv).iteritems())
+        d.pop('_%s_' % self.chf_type, None)
+        return d
+
+
+class TestSqlite(util.GenericCacheMixin, TempDirMixin):
+
+    def get_db(self, readonly=False, **kwds):
+        return db(pjoin(self.dir, 'cache.sqlite'),
+            auxdbkeys=self.cache_keys, readonly=readonly, **kwds)
+
+    def test_roundtrip(self):
+        cache = self.get_db()
+        key, raw_data = util.generic_data
+        cache[key] = dict(raw_data)
+        cache.commit()
+        cache = self.get_db(True)
+        self.assertTrue(key in cache)
+        self.assertFalse('sys-libs/nonexistent-1' in cache)
+        self.assertEqual(list(cache.iterkeys()), [key])
+        d = cache[key]
+        self.assertEqual(d['KEYWORDS'], '~amd64 ~ppc ~x86')
+        self.assertEqual(sorted(x[0] for x in d['_eclasses_']),
+            ['eutils', 'multilib', 'portability', 'toolchain-funcs'])
+        self.assertEqual([(k, v['SLOT']) for k, v in cache.iteritems()],
+            [(key, '0')])
+
+    def test_sync_rate(self):
+        cache = self.get_db(sync_rate=2)
+        key, raw_data = util.generic_data
+        cache[key] = dict(raw_data)
+        # pending updates are visible to the writer, but not to others.
+        self.assertTrue(key in cache)
+        self.assertFalse(key in self.get_db(True))
+        cache['cat/pkg-1'] = dict(raw_data)
+        self.assertEqual(len(list(self.get_db(True).iterkeys())), 2)
+
+    def test_delitem(self):
+        cache = self.get_db()
+        key, raw_data = util.generic_data
+        cache[key] = dict(raw_data)
+        del cache[key]
+        self.assertFalse(key in cache)
+        self.assertRaises(KeyError, cache.__delitem__, key)
+
+    def test_missing_readonly(self):
+        cache = self.get_db(True)
+        self.assertFalse(util.generic_data[0] in cache)
+        self.assertEqual(list(cache.iteritems()), [])
+
+    def test_corruption(self):
+        cache = self.get_db()
+        cache._get_connection().execute(
+            "INSERT INTO metadata (cpv, data) VALUES ('cat/pkg-1', 'garbage')")
+        self.assertRaises(errors.CacheCorruption, cache.__getitem__, 'cat/pkg-1')
+
+
+class TestConvertEntry(TempDirMixin):
+
+    def test_flat_hash(self):
+        key, raw_data = util.generic_data
+        source = flat_hash.database(pjoin(self.dir, 'flat'))
+        d = dict(raw_data)
+        d['_chf_'] = test_base._chf_obj
+        source[key] = d
+
+        target = sqlite.database(pjoin(self.dir, 'cache.sqlite'))
+        target[key] = convert_entry(source, target, key, source[key])
+        back = flat_hash.database(pjoin(self.dir, 'flat2'))
+        back[key] = convert_entry(target, back, key, target[key])
+        orig, new = [dict(x[key].iteritems()) for x in (source, back)]
+        for d in (orig, new):
+            d['_eclasses_'] = sorted(d['_eclasses_'])
+        self.assertEqual(orig, new)
+
+    def test_missing_chfs(self):
+        key, raw_data = util.generic_data
+        source = flat_hash.md5_cache(pjoin(self.dir, 'md5'))
+        target = sqlite.database(pjoin(self.dir, 'cache.sqlite'))
+        entry = {'SLOT': '0', '_md5_': 0x1234, '_eclasses_': []}
+        self.assertRaises(errors.CacheCorruption,
+            convert_entry, source, target, key, entry)
+
+
+class TestProcessRegen(TempDirMixin):
+
+    class pkg(object):
+
+        def __init__(self, cpvstr):
+            self.cpvstr = cpvstr
+            self.category = cpvstr.split('/')[0]
+
+    class repo(object):
+
+        frozen = False
+
+        def __init__(self, cache, pkgs):
+            self.cache = [cache]
+            self.pkgs = pkgs
+            self.categories = sorted(set(x.category for x in pkgs))
+            self.operations = repo_ops.operations(self)
+
+        def itermatch(self, restrict):
+            return (x for x in self.pkgs if restrict.match(x))
+
+        def _regen_operation_helper(self, **options):
+            cache = self.cache[0]
+            def regen(pkg):
+                key, raw_data = util.generic_data
+                cache[pkg.cpvstr] = dict(raw_data)
+                # other workers can't write while this one holds a
+                # transaction open.
+                if pkg.cpvstr not in db(cache.location, readonly=True):
+                    raise AssertionError("%s wasn't committed" % (pkg.cpvstr,))
+                return {}
+            return regen
+
+    def test_regen(self):
+        location = pjoin(self.dir, 'cache.sqlite')
+        cpvs = ['%s/pkg-%i' % (cat, x) for cat in 'abcd' for x in range(5)]
+        cache = db(location, auxdbkeys=util.GenericCacheMixin.cache_keys)
+        repo = self.repo(cache, [self.pkg(x) for x in cpvs])
+        observer = RecordingObserver()
+        repo.operations.regen_cache(
+            threads=2, use_processes=True, observer=observer)
+        self.assertEqual(observer.errors, [])
+        self.assertEqual(
+            list(db(location, readonly=True).iterkeys()), sorted(cpvs))
+        self.assertEqual(cache.sync_rate, 1)
+
+
+class RecordingObserver(null_output):
+
+    def __init__(self):
+        self.errors = []
+
+    def error(self, msg, *args, **kwds):
+        self.errors.append(msg % args)
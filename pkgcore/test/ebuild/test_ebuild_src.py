@@ -447,3 +447,39 @@ class test_package_factory(TestCase):
         pass
 
     test_required_use.skip = "TODO"
+
+    def test_get_metadata_batch(self):
+        ec = FakeEclassCache('/nonexistent/path')
+        eapi = malleable_obj(is_supported=True)
+        pkgs = [malleable_obj(cpvstr='dev-util/diffball-0.%i' % x,
+                              path='bollocks', eapi_obj=eapi)
+                for x in range(5)]
+
+        class fake_cache(dict):
+            readonly = True
+            def validate_entry(self, *args):
+                return True
+
+        cache = fake_cache({pkgs[1].cpvstr: {'marker': 1}})
+        batches = []
+
+        def update_batch(stale, ebp, batch_size):
+            batches.append([x.cpvstr for x in stale])
+            return ((x, {'regen': x.cpvstr}) for x in stale)
+
+        pf = self.mkinst(cache=(cache,), eclasses=ec,
+            _update_metadata_batch=update_batch)
+
+        results = list(pf._get_metadata_batch(pkgs, batch_size=2))
+        self.assertEqual([x[0] for x in results],
+                         [pkgs[1], pkgs[0], pkgs[2], pkgs[3], pkgs[4]])
+        self.assertEqual(dict((x.cpvstr, y) for x, y in results)[pkgs[1].cpvstr],
+                         {'marker': 1})
+        self.assertEqual(batches, [
+            ['dev-util/diffball-0.0', 'dev-util/diffball-0.2'],
+            ['dev-util/diffball-0.3', 'dev-util/diffball-0.4']])
+
+        # forced regen bypasses the cache entirely.
+        del batches[:]
+        list(pf._get_metadata_batch(pkgs, force_regen=True, batch_size=5))
+        self.assertEqual(batches, [[x.cpvstr for x in pkgs]])
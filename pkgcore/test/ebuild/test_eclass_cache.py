@@ -40,6 +40,17 @@ class TestBase(TestCase):
         assertRebuildResults(True, 'eclass1', 100)
         assertRebuildResults(False, 'eclass1', 200)
 
+    def test_rebuild_cache_entry_memoized(self):
+        data = (('eclass1', (('mtime', 100),)),)
+        got = self.ec.rebuild_cache_entry(data)
+        self.assertEqual(got, {'eclass1': self.ec.eclasses['eclass1']})
+        self.assertIdentical(got, self.ec.rebuild_cache_entry(data))
+        # unhashable forms of the same data share the verdict.
+        self.assertIdentical(
+            got, self.ec.rebuild_cache_entry([('eclass1', [('mtime', 100)])]))
+        self.assertIdentical(
+            None, self.ec.rebuild_cache_entry((('eclass1', (('mtime', 1),)),)))
+
     def test_get_eclass_data(self):
         keys = self.ec.eclasses.keys()
         data = self.ec.get_eclass_data([])
@@ -63,6 +74,19 @@ class TestEclassCache(TempDirMixin, TestBase):
         self.ec = eclass_cache.cache(self.dir)
         self.ec_locs = {x: self.dir for x in ("eclass1", "eclass2")}
 
+    def test_reload(self):
+        path = pjoin(self.ec_locs['eclass1'], 'eclass1.eclass')
+        old = (('eclass1', (('mtime', 100),)),)
+        new = (('eclass1', (('mtime', 300),)),)
+        self.assertTrue(self.ec.rebuild_cache_entry(old))
+        os.utime(path, (300, 300))
+        # verdicts hold until the eclasses are reloaded.
+        self.assertTrue(self.ec.rebuild_cache_entry(old))
+        self.assertEqual(None, self.ec.rebuild_cache_entry(new))
+        self.ec.reload()
+        self.assertEqual(None, self.ec.rebuild_cache_entry(old))
+        self.assertTrue(self.ec.rebuild_cache_entry(new))
+
     def test_get_eclass(self):
         for x in ("eclass1", "eclass2"):
             handle = self.ec.get_eclass(x)
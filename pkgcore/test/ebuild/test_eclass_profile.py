@@ -0,0 +1,81 @@
+# License: GPL2/BSD
+
+from snakeoil.osutils import ensure_dirs, pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.ebuild import eclass_cache, eclass_profile
+from pkgcore.test import silence_logging
+
+
+class FakePkg(object):
+
+    def __init__(self, cpvstr):
+        self.cpvstr = cpvstr
+
+
+class FakeRepo(object):
+
+    def __init__(self, cache):
+        self.cache = (cache,)
+
+
+class TestEclassProfile(TempDirMixin):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.eclassdir = pjoin(self.dir, 'eclass')
+        ensure_dirs(self.eclassdir)
+        self.path = pjoin(self.dir, 'profile')
+
+    def write_eclass(self, name, data):
+        with open(pjoin(self.eclassdir, name + '.eclass'), 'w') as f:
+            f.write(data)
+
+    def test_save(self):
+        profile = eclass_profile.EclassProfile(self.path)
+        self.assertEqual(profile.counts, {})
+        profile.update([('eutils', 'multilib'), ('eutils',), ()])
+        profile.save()
+        self.assertEqual(eclass_profile.EclassProfile(self.path).counts,
+                         {'eutils': 2, 'multilib': 1})
+
+    @silence_logging
+    def test_corrupt(self):
+        with open(self.path, 'w') as f:
+            f.write('garbage\n')
+        self.assertEqual(eclass_profile.EclassProfile(self.path).counts, {})
+        with open(self.path, 'w') as f:
+            f.write(eclass_profile.PROFILE_HEADER + '\nfoo\tbar\n')
+        self.assertEqual(eclass_profile.EclassProfile(self.path).counts, {})
+
+    def test_top(self):
+        profile = eclass_profile.EclassProfile(self.path)
+        profile.counts = {'eutils': 5, 'multilib': 3, 'autotools': 3, 'git': 1}
+        self.assertEqual(profile.top(3), ['eutils', 'autotools', 'multilib'])
+        self.assertEqual(profile.top(10)[-1], 'git')
+
+    def test_preload_set(self):
+        self.write_eclass('eutils', 'inherit multilib\n')
+        self.write_eclass('multilib', '  inherit toolchain-funcs # comment\n')
+        self.write_eclass('toolchain-funcs', 'foo() { :; }\n')
+        self.write_eclass('git', 'inherit ${VCS_ECLASS} eutils\n')
+        ecache = eclass_cache.cache(self.eclassdir)
+        profile = eclass_profile.EclassProfile(self.path)
+        profile.counts = {'eutils': 5, 'git': 2, 'missing': 10}
+        # unavailable eclasses are skipped.
+        self.assertEqual(profile.preload_set(1, ecache), [])
+        self.assertEqual(profile.preload_set(2, ecache),
+                         ['eutils', 'multilib', 'toolchain-funcs'])
+        self.assertEqual(profile.preload_set(3, ecache),
+                         ['eutils', 'git', 'multilib', 'toolchain-funcs'])
+
+    def test_order_by_inherits(self):
+        repo = FakeRepo({
+            'cat/a-1': {'_eclasses_': {'multilib': None}},
+            'cat/b-1': {'INHERITED': 'eutils'},
+            'cat/c-1': {'_eclasses_': {'multilib': None}},
+        })
+        pkgs = [FakePkg(x) for x in ('cat/c-1', 'cat/d-1', 'cat/b-1', 'cat/a-1')]
+        self.assertEqual(
+            [x.cpvstr for x in eclass_profile.order_by_inherits(repo, pkgs)],
+            ['cat/d-1', 'cat/b-1', 'cat/a-1', 'cat/c-1'])
@@ -0,0 +1,221 @@
+# License: GPL2/BSD
+
+from StringIO import StringIO
+import textwrap
+
+from snakeoil.data_source import local_source
+from snakeoil.osutils import ensure_dirs, pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.ebuild import eclass_cache, processor
+from pkgcore.test import TestCase, malleable_obj
+
+
+class FakeProcessor(object):
+
+    def __init__(self, uses=0, rss=None, onetime=False):
+        self.uses = uses
+        self._rss = rss
+        self._onetime = onetime
+
+    def rss(self):
+        return self._rss
+
+    def onetime(self):
+        return self._onetime
+
+
+class TestProcessorPool(TestCase):
+
+    def test_needs_recycling(self):
+        pool = processor.ProcessorPool()
+        self.assertFalse(pool.needs_recycling(FakeProcessor(uses=10000)))
+
+        pool.configure(max_uses=10)
+        self.assertFalse(pool.needs_recycling(FakeProcessor(uses=9)))
+        self.assertTrue(pool.needs_recycling(FakeProcessor(uses=10)))
+        # onetime processors are never reused, thus never recycled.
+        self.assertFalse(pool.needs_recycling(
+            FakeProcessor(uses=10, onetime=True)))
+
+        pool.configure(max_rss=1024)
+        self.assertFalse(pool.needs_recycling(FakeProcessor(rss=1024)))
+        self.assertTrue(pool.needs_recycling(FakeProcessor(rss=1025)))
+        # unknown memory usage isn't grounds for recycling.
+        self.assertFalse(pool.needs_recycling(FakeProcessor()))
+
+    def test_configure(self):
+        pool = processor.ProcessorPool()
+        pool.configure(min_size=2, max_size=4)
+        pool.configure(max_uses=5)
+        self.assertEqual(
+            [pool.min_size, pool.max_size, pool.max_uses, pool.max_rss],
+            [2, 4, 5, None])
+
+    def test_stats(self):
+        pool = processor.ProcessorPool()
+        pool.hits, pool.spawns, pool.spawn_time = 3, 1, 0.5
+        other = processor.ProcessorPool()
+        other.merge_stats(pool.stats())
+        other.merge_stats({'misses': 2})
+        self.assertEqual(
+            [other.hits, other.misses, other.spawns, other.spawn_time],
+            [3, 2, 1, 0.5])
+        other.reset_stats()
+        self.assertEqual(set(other.stats().itervalues()), set([0]))
+
+
+class TestRecycling(TempDirMixin):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.policy = (processor.pool.max_uses, processor.pool.preload)
+        eclassdir = pjoin(self.dir, 'eclass')
+        ensure_dirs(eclassdir)
+        for name in ('foo', 'bar'):
+            with open(pjoin(eclassdir, '%s.eclass' % name), 'w') as f:
+                f.write('%s_func() { :; }\n' % name)
+        self.eclass_cache = eclass_cache.cache(eclassdir)
+
+    def tearDown(self):
+        processor.shutdown_all_processors()
+        processor.pool.max_uses, processor.pool.preload = self.policy
+        TempDirMixin.tearDown(self)
+
+    def test_preload(self):
+        processor.pool.configure(max_uses=2)
+        processor.warm_ebuild_processors(
+            sandbox=False, count=1, eclass_cache=self.eclass_cache,
+            eclasses=['foo'])
+        ebp = processor.request_ebuild_processor(sandbox=False)
+        self.assertEqual(list(ebp._preloaded_eclasses), ['foo'])
+        self.assertIdentical(processor.recycle_ebuild_processor(ebp), ebp)
+
+        # replacements get the same eclasses preloaded.
+        ebp.uses = 2
+        new = processor.recycle_ebuild_processor(ebp)
+        self.assertNotIdentical(new, ebp)
+        self.assertFalse(ebp.is_alive)
+        self.assertEqual(new._preloaded_eclasses,
+                         {'foo': self.eclass_cache.eclasses['foo'].path})
+        processor.release_ebuild_processor(new)
+
+    def test_force(self):
+        ebp = processor.request_ebuild_processor(sandbox=False)
+        ebp.allow_eclass_caching()
+        new = processor.recycle_ebuild_processor(ebp, force=True)
+        self.assertNotIdentical(new, ebp)
+        self.assertFalse(ebp.is_alive)
+        self.assertTrue(new._eclass_caching)
+        # the replaced processor is neither active nor idle.
+        self.assertEqual(processor.active_ebp_list, [new])
+        self.assertNotIn(ebp, processor.inactive_ebp_list)
+        processor.release_ebuild_processor(new)
+        self.assertEqual(processor.inactive_ebp_list, [new])
+
+
+class TestFraming(TempDirMixin):
+
+    # exercises the env transfer with a value needing quoting, spanning
+    # lines, and holding (NUL free) binary data.
+    version = "1\nsecond 'line' \"q\" $x \\ \x01\x7f\xc3\xa9\xff"
+
+    ebuild = textwrap.dedent("""\
+        EAPI=5
+        inherit %s
+        DESCRIPTION="${PV}"
+        HOMEPAGE="http://example.com/a b"
+        SLOT="0"
+        KEYWORDS="x86 ~amd64"
+        IUSE="foo"
+        LICENSE=$'binary\\x01\\x02\\x7f\\xc3\\xa9\\xff\\ttab'
+        RESTRICT="multi
+        line"
+        """)
+
+    class eclasses(object):
+
+        """eclass cache handing some eclasses over by content"""
+
+        def __init__(self, cache, by_content=()):
+            self.cache = cache
+            self.by_content = by_content
+
+        def get_eclass(self, name):
+            data = self.cache.get_eclass(name)
+            if name not in self.by_content:
+                return data
+            with open(data.path) as f:
+                text = f.read()
+            return malleable_obj(path=None, text_fileobj=lambda: StringIO(text))
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        eclassdir = pjoin(self.dir, 'eclass')
+        ensure_dirs(eclassdir)
+        with open(pjoin(eclassdir, 'pathclass.eclass'), 'w') as f:
+            f.write('DEPEND="dev-lang/from-path"\n')
+        with open(pjoin(eclassdir, 'contentclass.eclass'), 'w') as f:
+            f.write('RDEPEND="dev-lang/from-content"\n'
+                    'content_func() {\n\t:\n}\n')
+        self.eclass_cache = eclass_cache.cache(eclassdir)
+        self.processors = []
+
+    def tearDown(self):
+        for ebp in self.processors:
+            ebp.shutdown_processor()
+        TempDirMixin.tearDown(self)
+
+    def mk_pkg(self, name, inherits='pathclass'):
+        ensure_dirs(pjoin(self.dir, 'cat', name))
+        path = pjoin(self.dir, 'cat', name, '%s-1.ebuild' % name)
+        with open(path, 'w') as f:
+            f.write(self.ebuild % (inherits,))
+        return malleable_obj(
+            category='cat', package=name, version=self.version,
+            fullver=self.version, revision=None, ebuild=local_source(path))
+
+    def mk_processor(self, framing):
+        ebp = processor.EbuildProcessor(False, False, False, None,
+                                        framing=framing)
+        self.processors.append(ebp)
+        self.assertEqual(ebp.framed, framing == 'length')
+        return ebp
+
+    def test_keys(self):
+        pkg = self.mk_pkg('pkg')
+        results = [self.mk_processor(framing).get_keys(pkg, self.eclass_cache)
+                   for framing in ('line', 'length')]
+        self.assertEqual(results[0], results[1])
+        keys = results[0]
+        self.assertEqual(keys['DESCRIPTION'], self.version.replace('\n', ' '))
+        self.assertEqual(keys['LICENSE'], 'binary\x01\x02\x7f\xc3\xa9\xff tab')
+        self.assertEqual(keys['RESTRICT'], 'multi line')
+        self.assertEqual(keys['DEPEND'], 'dev-lang/from-path')
+        self.assertEqual(keys['INHERITED'], 'pathclass')
+
+    def test_batch(self):
+        pkgs = [self.mk_pkg('pkg%i' % x) for x in range(3)]
+        for framing in ('line', 'length'):
+            ebp = self.mk_processor(framing)
+            single = [ebp.get_keys(pkg, self.eclass_cache) for pkg in pkgs]
+            batched = list(ebp.get_keys_batch(
+                pkgs, self.eclass_cache, batch_size=2))
+            self.assertEqual([x[0] for x in batched], pkgs)
+            self.assertEqual([x[1] for x in batched], single)
+            self.assertEqual(single[0]['DESCRIPTION'],
+                             self.version.replace('\n', ' '))
+
+    def test_transfer_frame(self):
+        # line framing can't transfer multiline eclasses by content.
+        ebp = self.mk_processor('length')
+        eclasses = self.eclasses(self.eclass_cache, ('contentclass',))
+        pkgs = [self.mk_pkg('pkg%i' % x, 'pathclass contentclass')
+                for x in range(2)]
+        expected = [ebp.get_keys(pkg, self.eclass_cache) for pkg in pkgs]
+        self.assertEqual(expected[0]['RDEPEND'], 'dev-lang/from-content')
+        # the daemon stays in sync after transfers, singly or batched.
+        self.assertEqual(
+            [ebp.get_keys(pkg, eclasses) for pkg in pkgs], expected)
+        self.assertEqual(
+            [x[1] for x in ebp.get_keys_batch(pkgs, eclasses)], expected)
@@ -0,0 +1,85 @@
+# License: GPL2/BSD
+
+import os
+
+from snakeoil.osutils import ensure_dirs, pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.ebuild import eclass_cache, regen_journal, repository
+from pkgcore.test import silence_logging
+
+
+class TestRegenJournal(TempDirMixin):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        ensure_dirs(pjoin(self.dir, 'profiles'))
+        self.eclassdir = pjoin(self.dir, 'eclass')
+        ensure_dirs(self.eclassdir)
+        self.journal_path = pjoin(self.dir, 'journal')
+        self.write_eclass('eutils', 'foo() { :; }')
+        self.write_eclass('multilib', 'bar() { :; }')
+        for pkg in ('foo', 'bar'):
+            ensure_dirs(pjoin(self.dir, 'cat', pkg))
+            self.write_ebuild(pkg, '1')
+
+    def write_eclass(self, name, data):
+        with open(pjoin(self.eclassdir, name + '.eclass'), 'w') as f:
+            f.write(data)
+
+    def write_ebuild(self, pkg, ver, mtime=1000):
+        path = pjoin(self.dir, 'cat', pkg, '%s-%s.ebuild' % (pkg, ver))
+        with open(path, 'w') as f:
+            f.write('EAPI=5\n')
+        os.utime(path, (mtime, mtime))
+
+    def mk_journal(self):
+        repo = repository._UnconfiguredTree(
+            self.dir, eclass_cache.cache(self.eclassdir))
+        return regen_journal.RegenJournal(repo, self.journal_path)
+
+    def regen(self, journal, inherits={}):
+        stale = sorted(pkg.cpvstr for pkg in journal.iter_stale())
+        for pkg in journal.repo:
+            if pkg.cpvstr in stale:
+                eclasses = dict.fromkeys(inherits.get(pkg.package, ()))
+                journal.record(pkg, {'_eclasses_': eclasses})
+        journal.save()
+        return stale
+
+    @silence_logging
+    def test_stale(self):
+        inherits = {'foo': ('eutils',), 'bar': ('multilib',)}
+        journal = self.mk_journal()
+        self.assertEqual(self.regen(journal, inherits),
+                         ['cat/bar-1', 'cat/foo-1'])
+        # nothing changed.
+        self.assertEqual(self.regen(self.mk_journal(), inherits), [])
+
+        # ebuild change.
+        self.write_ebuild('foo', '1', mtime=2000)
+        self.assertEqual(self.regen(self.mk_journal(), inherits), ['cat/foo-1'])
+
+        # eclass change only invalidates its consumers.
+        self.write_eclass('multilib', 'bar() { true; }')
+        self.assertEqual(self.regen(self.mk_journal(), inherits), ['cat/bar-1'])
+
+        # new ebuilds are picked up, removed ones dropped.
+        self.write_ebuild('foo', '2')
+        os.unlink(pjoin(self.dir, 'cat', 'bar', 'bar-1.ebuild'))
+        self.assertEqual(self.regen(self.mk_journal(), inherits), ['cat/foo-2'])
+        self.assertEqual(sorted(self.mk_journal().entries),
+                         ['cat/foo-1', 'cat/foo-2'])
+
+    @silence_logging
+    def test_failed_entries_are_retried(self):
+        journal = self.mk_journal()
+        list(journal.iter_stale())
+        journal.save()
+        self.assertEqual(len(list(self.mk_journal().iter_stale())), 2)
+
+    @silence_logging
+    def test_corrupt(self):
+        with open(self.journal_path, 'w') as f:
+            f.write('garbage\n')
+        self.assertEqual(self.mk_journal().entries, {})
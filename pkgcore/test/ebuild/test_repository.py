@@ -5,14 +5,17 @@
 import os
 import textwrap
 
+from snakeoil.data_source import local_source
 from snakeoil.osutils import ensure_dirs, pjoin
 from snakeoil.test.mixins import TempDirMixin
 
 from pkgcore.ebuild import errors as ebuild_errors
-from pkgcore.ebuild import repository, eclass_cache
+from pkgcore.ebuild import repository, eclass_cache, processor
 from pkgcore.ebuild.atom import atom
+from pkgcore.fetch import fetchable
+from pkgcore.operations.observer import null_output, repo_observer
 from pkgcore.repository import errors
-from pkgcore.test import silence_logging
+from pkgcore.test import TestCase, malleable_obj, silence_logging
 
 
 class UnconfiguredTreeTest(TempDirMixin):
@@ -181,3 +184,135 @@ class SlavedTreeTest(UnconfiguredTreeTest):
                 f.write('\n'.join(cats[1]))
             repo = self.mk_tree(self.dir)
             self.assertEqual(tuple(sorted(repo.categories)), ('cat', 'foo-bar', 'sys-apps'))
+
+
+class HashDistfilesTest(TempDirMixin):
+
+    class fetcher(object):
+
+        def __init__(self):
+            self.hashed = []
+
+        def get_chksums(self, path, *chfs):
+            self.hashed.append(path)
+            if path.endswith('broken'):
+                raise EnvironmentError(path)
+            return [len(path)] * len(chfs)
+
+    def test_hash_distfiles(self):
+        fetcher = self.fetcher()
+        distfiles = dict((pjoin(self.dir, x), fetcher) for x in 'abcd')
+        for jobs in (1, 3):
+            fetcher.hashed = []
+            self.assertEqual(
+                repository._hash_distfiles(distfiles, ('size', 'md5'), jobs=jobs),
+                (dict((path, {'size': len(path), 'md5': len(path)})
+                      for path in distfiles), {}))
+            self.assertEqual(sorted(fetcher.hashed), sorted(distfiles))
+
+        # failures are reported per file, the rest still being hashed.
+        broken = pjoin(self.dir, 'broken')
+        distfiles[broken] = fetcher
+        chksums, failures = repository._hash_distfiles(
+            distfiles, ('size',), jobs=2)
+        self.assertEqual(
+            sorted(chksums), sorted(set(distfiles).difference([broken])))
+        self.assertEqual(list(failures), [broken])
+        self.assertTrue(isinstance(failures[broken], EnvironmentError))
+
+
+class DigestsTest(TempDirMixin):
+
+    class repo(object):
+
+        frozen = False
+
+        def __init__(self, pkgs):
+            self.pkgs = pkgs
+            self.config = malleable_obj(manifests=malleable_obj(
+                disabled=False, hashes=('size',), thin=True))
+
+        def match(self, query, sorter=None):
+            return [x for x in self.pkgs if x.key == query]
+
+    class pkg(object):
+
+        def __init__(self, path, distfiles):
+            self.key = os.path.basename(os.path.dirname(path))
+            self.unversioned_atom = self.key
+            self.ebuild = local_source(path)
+            self.distfiles = distfiles
+            self._get_attr = {'fetchables': lambda pkg, **kwds: ()}
+
+        def release_cached_data(self, all=False):
+            pass
+
+    def mk_domain(self, fetcher):
+        d = self.dir
+
+        class pkg_ops(object):
+
+            def __init__(self, pkg, observer=None):
+                self.pkg = pkg
+                self._mirror_op = malleable_obj(fetcher=fetcher, verified_files={})
+
+            def supports(self, op):
+                return True
+
+            def mirror(self, observer):
+                if 'broken' in self.pkg.distfiles:
+                    return False
+                self._mirror_op.verified_files.update(
+                    (pjoin(d, x), fetchable(x)) for x in self.pkg.distfiles)
+                return True
+
+        return malleable_obj(pkg_operations=pkg_ops)
+
+    @silence_logging
+    def test_digests(self):
+        pkgs = []
+        for name, distfiles in (('a', ('shared', 'a')), ('b', ('shared',)),
+                                ('c', ('broken',)),
+                                ('d', ('shared', 'unreadable-broken'))):
+            ensure_dirs(pjoin(self.dir, name))
+            pkgs.append(self.pkg(
+                pjoin(self.dir, name, '%s-1.ebuild' % name), distfiles))
+        fetcher = HashDistfilesTest.fetcher()
+        ops = repository.repo_operations(self.repo(pkgs))
+        observer = repo_observer(null_output())
+        self.assertFalse(ops._cmd_implementation_digests(
+            self.mk_domain(fetcher), pkgs, observer, jobs=2))
+
+        # distfiles shared between pkg dirs are hashed once, and pkgs that
+        # fetched and hashed fine still get manifests when others fail.
+        self.assertEqual(sorted(fetcher.hashed), [
+            pjoin(self.dir, 'a'), pjoin(self.dir, 'shared'),
+            pjoin(self.dir, 'unreadable-broken')])
+        size = len(pjoin(self.dir, 'shared'))
+        for name, lines in (
+                ('a', ['DIST a %i' % (size - 5), 'DIST shared %i' % size]),
+                ('b', ['DIST shared %i' % size])):
+            with open(pjoin(self.dir, name, 'Manifest')) as f:
+                self.assertEqual(sorted(f.read().splitlines()), lines)
+        for name in 'cd':
+            self.assertFalse(
+                os.path.exists(pjoin(self.dir, name, 'Manifest')))
+
+
+class BatchedRegenHelperTest(TestCase):
+
+    def tearDown(self):
+        processor.shutdown_all_processors()
+
+    def test_replace_processor(self):
+        helper = repository._BatchedRegenOpHelper(
+            malleable_obj(package_class=None), batch_size=2)
+        ebp = helper.ebp
+        helper._replace_processor()
+        self.assertNotIdentical(helper.ebp, ebp)
+        self.assertTrue(helper.ebp._eclass_caching)
+        helper.finish()
+        # the processor that was swapped out isn't handed out again.
+        self.assertNotIn(ebp, processor.active_ebp_list)
+        self.assertNotIn(ebp, processor.inactive_ebp_list)
+        self.assertTrue(all(x.is_alive for x in processor.inactive_ebp_list))
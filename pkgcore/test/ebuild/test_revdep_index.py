@@ -0,0 +1,127 @@
+# License: GPL2/BSD
+
+import os
+
+from snakeoil.chksum import LazilyHashedPath
+from snakeoil.osutils import ensure_dirs, pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.cache import flat_hash
+from pkgcore.ebuild import eclass_cache, repository, revdep_index
+from pkgcore.test import silence_logging
+
+
+class TestRevdepIndex(TempDirMixin):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.tree = pjoin(self.dir, 'tree')
+        ensure_dirs(pjoin(self.tree, 'profiles'))
+        ensure_dirs(pjoin(self.tree, 'eclass'))
+        for pkg in ('a', 'b', 'c'):
+            self.write_ebuild(pkg, 100)
+        self.cache = flat_hash.database(pjoin(self.dir, 'cache'))
+        self.repo = repository._UnconfiguredTree(
+            self.tree, eclass_cache.cache(pjoin(self.tree, 'eclass')),
+            cache=self.cache)
+        self.path = revdep_index.default_index_path(self.repo)
+
+    def write_ebuild(self, pkg, mtime):
+        ensure_dirs(pjoin(self.tree, 'cat', pkg))
+        path = self.ebuild_path(pkg)
+        open(path, 'w').close()
+        os.utime(path, (mtime, mtime))
+
+    def ebuild_path(self, pkg):
+        return pjoin(self.tree, 'cat', pkg, '%s-1.ebuild' % (pkg,))
+
+    def set_entry(self, pkg, **deps):
+        deps['_eclasses_'] = {}
+        deps['_chf_'] = LazilyHashedPath(self.ebuild_path(pkg))
+        self.cache['cat/%s-1' % (pkg,)] = deps
+
+    def test_dependents(self):
+        self.set_entry('a', DEPEND='x? ( >=dev-libs/foo-1 ) || ( cat/b o/t )',
+                       RDEPEND='!cat/c')
+        self.set_entry('b', PDEPEND='dev-libs/foo')
+        index = revdep_index.RevdepIndex(self.repo, self.path)
+        index.update()
+        self.assertEqual(index.unindexed, set(['cat/c-1']))
+        self.assertEqual(index.entries['cat/a-1'][1],
+                         frozenset(['dev-libs/foo', 'cat/b', 'o/t', 'cat/c']))
+        # packages lacking cache entries are always candidates.
+        self.assertEqual(index.dependents('dev-libs/foo'),
+                         set([('cat', 'a'), ('cat', 'b'), ('cat', 'c')]))
+        self.assertEqual(index.dependents('cat/b'),
+                         set([('cat', 'a'), ('cat', 'c')]))
+        self.assertEqual(index.dependents('cat/nonexistent'),
+                         set([('cat', 'c')]))
+
+    def test_update(self):
+        self.set_entry('a', DEPEND='dev-libs/foo')
+        self.set_entry('b', DEPEND='dev-libs/foo')
+        index = revdep_index.RevdepIndex(self.repo, self.path)
+        index.update()
+        index.save()
+
+        index = revdep_index.RevdepIndex(self.repo, self.path)
+        self.assertEqual(sorted(index.entries), ['cat/a-1', 'cat/b-1'])
+        index.update()
+        self.assertFalse(index.dirty)
+
+        # stale cache entries aren't trusted.
+        self.write_ebuild('a', 200)
+        index.update()
+        self.assertTrue(index.dirty)
+        self.assertEqual(sorted(index.unindexed), ['cat/a-1', 'cat/c-1'])
+
+        self.set_entry('a', DEPEND='dev-libs/bar')
+        index.update()
+        self.assertEqual(index.entries['cat/a-1'][1],
+                         frozenset(['dev-libs/bar']))
+        self.assertEqual(index.dependents('dev-libs/foo'),
+                         set([('cat', 'b'), ('cat', 'c')]))
+
+    def test_unchanged(self):
+        self.set_entry('a', DEPEND='dev-libs/foo')
+        self.set_entry('b', DEPEND='dev-libs/foo')
+        revdep_index.get_index(self.repo)
+
+        # nothing changed; no cache entries are read.
+        read = []
+        def getitem(cpv):
+            read.append(cpv)
+            return self.cache.__class__._getitem(self.cache, cpv)
+        def fail():
+            raise AssertionError("cache walked")
+        self.cache._getitem = getitem
+        self.cache.iteritems = fail
+        index = revdep_index.RevdepIndex(self.repo, self.path)
+        index.update()
+        self.assertFalse(index.dirty)
+        self.assertEqual(read, [])
+        self.assertEqual(index.dependents('dev-libs/foo'),
+                         set([('cat', 'a'), ('cat', 'b'), ('cat', 'c')]))
+
+        # just the changed entry is.
+        self.write_ebuild('a', 200)
+        self.set_entry('a', DEPEND='dev-libs/bar')
+        index.update()
+        self.assertTrue(index.dirty)
+        self.assertEqual(read, ['cat/a-1'])
+        self.assertEqual(index.dependents('dev-libs/foo'),
+                         set([('cat', 'b'), ('cat', 'c')]))
+
+    @silence_logging
+    def test_corrupt(self):
+        with open(self.path, 'w') as f:
+            f.write('garbage\n')
+        self.assertEqual(
+            revdep_index.RevdepIndex(self.repo, self.path).entries, {})
+
+    def test_get_index(self):
+        self.set_entry('a', DEPEND='dev-libs/foo')
+        index = revdep_index.get_index(self.repo)
+        self.assertEqual(index.path, pjoin(self.dir, 'cache.revdep-index'))
+        self.assertTrue(os.path.exists(index.path))
+        self.assertIdentical(revdep_index.get_index(object()), None)
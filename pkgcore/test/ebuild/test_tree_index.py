@@ -0,0 +1,150 @@
+# License: GPL2/BSD
+
+import os
+
+from snakeoil.osutils import ensure_dirs, listdir_dirs, pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore import spawn
+from pkgcore.cache import flat_hash
+from pkgcore.ebuild import eclass_cache, repository, tree_index
+from pkgcore.test import silence_logging
+
+
+class TestTreeIndex(TempDirMixin):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.tree = pjoin(self.dir, 'tree')
+        self.path = pjoin(self.dir, 'index')
+        self.listed = []
+
+    def mk_dirs(self, *dirs):
+        for x in dirs:
+            ensure_dirs(pjoin(self.tree, x))
+        self.age()
+
+    def age(self, mtime=100):
+        # listings of recently modified directories aren't trusted.
+        for root, dirs, files in os.walk(self.tree):
+            os.utime(root, (mtime, mtime))
+
+    def lister(self, path):
+        self.listed.append(path)
+        return sorted(listdir_dirs(path))
+
+    def test_listing(self):
+        self.mk_dirs('cat/pkg', 'cat/pkg2')
+        index = tree_index.TreeIndex(self.tree, self.path)
+        self.assertEqual(index.listing('cat', self.lister), ('pkg', 'pkg2'))
+        self.assertEqual(index.listing('cat', self.lister), ('pkg', 'pkg2'))
+        self.assertEqual(len(self.listed), 1)
+        self.assertRaises(EnvironmentError, index.listing, 'missing', self.lister)
+        index.save()
+
+        index = tree_index.TreeIndex(self.tree, self.path)
+        self.assertEqual(index.listing('', self.lister), ('cat',))
+        self.assertEqual(index.listing('cat', self.lister), ('pkg', 'pkg2'))
+        self.assertEqual(len(self.listed), 2)
+
+    def test_stale(self):
+        self.mk_dirs('cat/pkg/a', 'cat/pkg2')
+        index = tree_index.TreeIndex(self.tree, self.path)
+        index.listing('cat', self.lister)
+        index.listing('cat/pkg', self.lister)
+        index.save()
+
+        os.rmdir(pjoin(self.tree, 'cat', 'pkg', 'a'))
+        os.rmdir(pjoin(self.tree, 'cat', 'pkg'))
+        self.age(200)
+        index = tree_index.TreeIndex(self.tree, self.path)
+        self.assertFalse(index.dirty)
+        self.assertEqual(index.listing('cat', self.lister), ('pkg2',))
+        self.assertTrue(index.dirty)
+        self.assertEqual(sorted(index.entries), ['cat'])
+
+    def test_same_mtime(self):
+        # changes that leave the mtime untouched are still noticed.
+        self.mk_dirs('cat/pkg', 'cat/pkg2')
+        index = tree_index.TreeIndex(self.tree, self.path)
+        index.listing('cat', self.lister)
+        os.rmdir(pjoin(self.tree, 'cat', 'pkg'))
+        self.age()
+        self.assertEqual(index.listing('cat', self.lister), ('pkg2',))
+        ensure_dirs(pjoin(self.tree, 'cat', 'pkg3'))
+        self.age()
+        self.assertEqual(index.listing('cat', self.lister), ('pkg2', 'pkg3'))
+        self.assertEqual(len(self.listed), 3)
+
+    def test_racy(self):
+        ensure_dirs(pjoin(self.tree, 'cat'))
+        index = tree_index.TreeIndex(self.tree, self.path)
+        index.listing('cat', self.lister)
+        index.listing('cat', self.lister)
+        self.assertEqual(len(self.listed), 2)
+        self.assertEqual(index.entries, {})
+
+    @silence_logging
+    def test_corrupt(self):
+        with open(self.path, 'w') as f:
+            f.write('garbage\n')
+        self.assertEqual(tree_index.TreeIndex(self.tree, self.path).entries, {})
+        with open(self.path, 'w') as f:
+            f.write(tree_index.INDEX_HEADER + '\ncat\tfoo\t1\t2\t3\tpkg\n')
+        self.assertEqual(tree_index.TreeIndex(self.tree, self.path).entries, {})
+
+
+class TestRepoIndex(TempDirMixin):
+
+    def forget_exit_save(self, repo):
+        index = repo._tree_index
+        if index is not None:
+            while (index.save, (), {}) in spawn._exithandlers:
+                spawn._exithandlers.remove((index.save, (), {}))
+
+    @silence_logging
+    def test_repo(self):
+        tree = pjoin(self.dir, 'tree')
+        ensure_dirs(pjoin(tree, 'profiles'))
+        ensure_dirs(pjoin(tree, 'eclass'))
+        ensure_dirs(pjoin(tree, 'cat', 'pkg'))
+        open(pjoin(tree, 'cat', 'pkg', 'pkg-1.ebuild'), 'w').close()
+        for root, dirs, files in os.walk(tree):
+            os.utime(root, (100, 100))
+
+        def mk_repo(cache='cache'):
+            cache = flat_hash.database(pjoin(self.dir, cache))
+            repo = repository._UnconfiguredTree(
+                tree, eclass_cache.cache(pjoin(tree, 'eclass')), cache=cache)
+            self.addCleanup(self.forget_exit_save, repo)
+            return repo
+
+        repo = mk_repo()
+        self.assertEqual(repo._tree_index.path,
+                         pjoin(self.dir, 'cache.tree-index'))
+        self.assertEqual(dict(repo.versions), {('cat', 'pkg'): ('1',)})
+        repo.operations.flush_cache()
+
+        repo = mk_repo()
+        self.assertEqual(sorted(repo._tree_index.entries),
+                         ['', 'cat', 'cat/pkg'])
+        self.assertEqual(dict(repo.versions), {('cat', 'pkg'): ('1',)})
+        self.assertFalse(repo._tree_index.dirty)
+
+        # listings are saved on exit too, not just by regens.
+        ensure_dirs(pjoin(tree, 'cat', 'pkg2'))
+        for root, dirs, files in os.walk(tree):
+            os.utime(root, (100, 100))
+        repo = mk_repo()
+        self.assertEqual(sorted(repo.packages['cat']), ['pkg', 'pkg2'])
+        self.assertTrue(repo._tree_index.dirty)
+        self.assertIn((repo._tree_index.save, (), {}), spawn._exithandlers)
+        repo._tree_index.save()
+        self.assertEqual(sorted(mk_repo()._tree_index.entries),
+                         ['', 'cat', 'cat/pkg', 'cat/pkg2'])
+
+        # but not if the index can't be written.
+        repo = mk_repo(pjoin('missing', 'cache'))
+        self.assertFalse(repo._tree_index.writable())
+        self.assertNotIn(
+            (repo._tree_index.save, (), {}), spawn._exithandlers)
@@ -3,6 +3,8 @@
 
 from functools import partial
 import os
+import threading
+import time
 
 from snakeoil import data_source
 from snakeoil.chksum import get_handlers
@@ -51,6 +53,34 @@ class TestFetcher(TempDirMixin, TestCase):
         self.assertFailure(self.fetcher._verify, self.fp, self.obj,
                            resumable=True)
 
+    def test_locking(self):
+        active, overlapped = [], []
+        distdir = os.path.join(self.dir, "distdir")
+
+        class c(base.fetcher):
+            def fetch(self, target):
+                active.append(target.filename)
+                if active.count(target.filename) > 1:
+                    overlapped.append(target.filename)
+                time.sleep(0.05)
+                active.remove(target.filename)
+                return os.path.join(distdir, target.filename)
+
+            def get_storage_path(self):
+                return distdir
+
+        o = c()
+        targets = [fetchable(x, uri=("http://foo/%s" % x,))
+                   for x in ("a", "a", "a", "b")]
+        threads = [threading.Thread(target=o, args=(x,)) for x in targets]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(overlapped, [])
+        self.assertEqual(sorted(os.listdir(os.path.join(distdir, ".locks"))),
+                         ["a", "b"])
+
     def assertFailure(self, functor, path, fetchable, resumable=False,
                       kls=None, **kwds):
         try:
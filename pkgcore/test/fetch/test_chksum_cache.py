@@ -0,0 +1,93 @@
+# License: GPL2/BSD
+
+import hashlib
+import logging
+import os
+
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.fetch import chksum_cache
+from pkgcore.test import TestCase, silence_logging
+from pkgcore.util import chksum
+
+data = 'asdf' * 1000
+
+
+def md5(data):
+    return long(hashlib.md5(data).hexdigest(), 16)
+
+
+class TestChksumCache(TempDirMixin, TestCase):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.path = pjoin(self.dir, 'distfiles', 'foo.tar')
+        os.mkdir(os.path.dirname(self.path))
+        self.write(data)
+        self.db = pjoin(self.dir, 'cache', 'chksums.sqlite')
+        self.computed = []
+        self.orig = chksum_cache.get_chksums
+        def get_chksums(location, *chfs):
+            self.computed.append(chfs)
+            return self.orig(location, *chfs)
+        chksum_cache.get_chksums = get_chksums
+
+    def tearDown(self):
+        chksum_cache.get_chksums = self.orig
+        TempDirMixin.tearDown(self)
+
+    def write(self, content, mtime=100):
+        with open(self.path, 'w') as f:
+            f.write(content)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_cached(self):
+        cache = chksum_cache.ChksumCache(self.db)
+        expected = chksum.get_chksums(self.path, 'size', 'md5', 'sha1')
+        self.assertEqual(
+            cache.get_chksums(self.path, 'size', 'md5', 'sha1'), expected)
+        self.assertEqual(self.computed, [('size', 'md5', 'sha1')])
+        # a fresh instance reads back what was stored.
+        cache = chksum_cache.ChksumCache(self.db)
+        self.assertEqual(cache.get_chksums(self.path, 'md5', 'size'),
+                         [expected[1], expected[0]])
+        self.assertEqual(len(self.computed), 1)
+        # only chksums not yet stored are computed.
+        cache.get_chksums(self.path, 'md5', 'sha256')
+        self.assertEqual(self.computed[1:], [('sha256',)])
+
+    def test_invalidation(self):
+        cache = chksum_cache.ChksumCache(self.db)
+        self.assertEqual(cache.get_chksums(self.path, 'md5'), [md5(data)])
+        # changed mtime.
+        self.write('fdsa' * 1000, mtime=200)
+        self.assertEqual(cache.get_chksums(self.path, 'md5'),
+                         [md5('fdsa' * 1000)])
+        # changed size.
+        self.write('fdsa' * 999, mtime=200)
+        self.assertEqual(cache.get_chksums(self.path, 'md5'),
+                         [md5('fdsa' * 999)])
+        self.assertEqual(len(self.computed), 3)
+
+    def test_paranoid(self):
+        chksum_cache.ChksumCache(self.db).get_chksums(self.path, 'md5')
+        cache = chksum_cache.ChksumCache(self.db, paranoid=True)
+        self.assertEqual(cache.get_chksums(self.path, 'md5'), [md5(data)])
+        self.assertEqual(len(self.computed), 2)
+
+    def test_update(self):
+        cache = chksum_cache.ChksumCache(self.db)
+        cache.update(self.path, {'md5': 1L, 'size': long(len(data))})
+        self.assertEqual(cache.get_chksums(self.path, 'md5', 'size'),
+                         [1L, long(len(data))])
+        self.assertEqual(self.computed, [])
+
+    @silence_logging(logging.root)
+    def test_corrupt(self):
+        os.mkdir(os.path.dirname(self.db))
+        with open(self.db, 'w') as f:
+            f.write('garbage' * 1000)
+        cache = chksum_cache.ChksumCache(self.db)
+        self.assertEqual(cache.get_chksums(self.path, 'md5'), [md5(data)])
+        self.assertTrue(cache.disabled)
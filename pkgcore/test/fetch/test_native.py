@@ -0,0 +1,160 @@
+# License: GPL2/BSD
+
+import BaseHTTPServer
+import hashlib
+import logging
+import os
+import SocketServer
+import threading
+
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.fetch import errors, fetchable, native
+from pkgcore.test import TestCase, silence_logging
+
+data = 'asdf' * 40000
+
+
+def chksums(data):
+    return {"size": long(len(data)),
+            "md5": long(hashlib.md5(data).hexdigest(), 16),
+            "sha256": long(hashlib.sha256(data).hexdigest(), 16)}
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("range")))
+        content = self.server.files.get(self.path)
+        if content is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        start = 0
+        rng = self.headers.get("range")
+        if rng and self.server.ranges:
+            start = int(rng.split("=")[1].rstrip("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %i-%i/%i" % (
+                start, len(content) - 1, len(content)))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(content) - start))
+        self.end_headers()
+        self.wfile.write(content[start:])
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+
+class TestFetcher(TempDirMixin, TestCase):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.files = {}
+        self.server.requests = []
+        self.server.connections = 0
+        self.server.ranges = True
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.base = 'http://127.0.0.1:%i' % self.server.server_address[1]
+        self.distdir = pjoin(self.dir, 'distfiles')
+        self.fetcher = native.fetcher(
+            self.distdir, userpriv=False, attempts=3, timeout=10)
+
+    def tearDown(self):
+        self.fetcher._pool.close()
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        TempDirMixin.tearDown(self)
+
+    def mk_fetchable(self, name, content, uris=None):
+        self.server.files['/' + name] = content
+        if uris is None:
+            uris = ['%s/%s' % (self.base, name)]
+        return fetchable(name, uris, chksums(content))
+
+    def read(self, name):
+        with open(pjoin(self.distdir, name)) as f:
+            return f.read()
+
+    def test_fetch(self):
+        target = self.mk_fetchable('foo.tar', data)
+        self.assertEqual(self.fetcher(target), pjoin(self.distdir, 'foo.tar'))
+        self.assertEqual(self.read('foo.tar'), data)
+        # already there; no request.
+        self.assertEqual(self.fetcher(target), pjoin(self.distdir, 'foo.tar'))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_connection_reuse(self):
+        for name in ('a', 'b', 'c'):
+            self.fetcher(self.mk_fetchable(name, data + name))
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_resume(self):
+        target = self.mk_fetchable('foo.tar', data)
+        os.makedirs(self.distdir)
+        with open(pjoin(self.distdir, 'foo.tar'), 'w') as f:
+            f.write(data[:1000])
+        self.fetcher(target)
+        self.assertEqual(self.read('foo.tar'), data)
+        self.assertEqual(self.server.requests, [('/foo.tar', 'bytes=1000-')])
+
+        # servers ignoring ranges send everything.
+        self.server.ranges = False
+        target = self.mk_fetchable('bar.tar', data)
+        with open(pjoin(self.distdir, 'bar.tar'), 'w') as f:
+            f.write(data[:1000])
+        self.fetcher(target)
+        self.assertEqual(self.read('bar.tar'), data)
+
+    def test_mirror_fallback(self):
+        bad = 'http://localhost:%i' % self.server.server_address[1]
+        target = self.mk_fetchable(
+            'foo.tar', data, ['%s/missing' % bad, '%s/foo.tar' % self.base])
+        self.fetcher(target)
+        self.assertEqual(self.read('foo.tar'), data)
+        self.assertEqual([x[0] for x in self.server.requests],
+                         ['/missing', '/foo.tar'])
+        # the failing host is tried last from then on.
+        self.server.requests = []
+        target = self.mk_fetchable(
+            'bar.tar', data, ['%s/bar.tar' % bad, '%s/bar.tar' % self.base])
+        self.fetcher(target)
+        self.assertEqual(self.server.requests, [('/bar.tar', None)])
+
+    def test_bad_chksum(self):
+        target = self.mk_fetchable('foo.tar', data)
+        target.chksums['md5'] += 1
+        self.assertRaises(errors.FetchFailed, self.fetcher, target)
+        self.assertFalse(os.path.exists(pjoin(self.distdir, 'foo.tar')))
+
+    @silence_logging(logging.root)
+    def test_fetch_many(self):
+        self.fetcher.jobs = 3
+        targets = [self.mk_fetchable(name, data + name)
+                   for name in ('a', 'b', 'c', 'd')]
+        targets.append(fetchable('e', ['%s/e' % self.base], chksums(data)))
+        results = dict((t.filename, fp) for t, fp in
+                       self.fetcher.fetch_many(targets))
+        self.assertEqual(results, {
+            'a': pjoin(self.distdir, 'a'), 'b': pjoin(self.distdir, 'b'),
+            'c': pjoin(self.distdir, 'c'), 'd': pjoin(self.distdir, 'd'),
+            'e': None})
+        self.assertEqual(self.read('d'), data + 'd')
@@ -0,0 +1,74 @@
+# License: GPL2/BSD
+
+import os
+
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.fs import durability
+from pkgcore.test import TestCase
+
+
+class TestSyncPaths(TempDirMixin, TestCase):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.synced, self.fsynced = [], []
+        self._syncfs, self._fsync = durability.syncfs, durability._fsync
+        durability.syncfs = self.synced.append
+        durability._fsync = lambda path, datasync=False: \
+            self.fsynced.append((path, datasync))
+        os.mkdir(pjoin(self.dir, "sub"))
+        self.paths = [pjoin(self.dir, x) for x in ("file1", "sub/file2")]
+        for path in self.paths:
+            open(path, "w").close()
+        self.paths.append(pjoin(self.dir, "sub"))
+        os.symlink("file1", pjoin(self.dir, "sym"))
+        self.paths.append(pjoin(self.dir, "sym"))
+        # an unmerged entry.
+        self.paths.append(pjoin(self.dir, "missing"))
+
+    def tearDown(self):
+        durability.syncfs, durability._fsync = self._syncfs, self._fsync
+        TempDirMixin.tearDown(self)
+
+    def test_none(self):
+        durability.sync_paths(self.paths, "none")
+        self.assertFalse(self.synced)
+        self.assertFalse(self.fsynced)
+
+    def test_per_package(self):
+        durability.sync_paths(self.paths, "per-package")
+        # one filesystem, synced once.
+        self.assertEqual(len(self.synced), 1)
+        self.assertFalse(self.fsynced)
+
+    def test_per_file(self):
+        durability.sync_paths(self.paths, "per-file")
+        self.assertFalse(self.synced)
+        self.assertEqual(sorted(self.fsynced), sorted([
+            (self.paths[0], True),
+            (self.paths[1], True),
+            (self.dir, False),
+            (pjoin(self.dir, "sub"), False),
+            ]))
+
+    def test_unknown_mode(self):
+        self.assertRaises(ValueError, durability.sync_paths, self.paths, "foo")
+
+
+class TestSync(TempDirMixin, TestCase):
+
+    def test_syncfs(self):
+        durability.syncfs(self.dir)
+        self.assertRaises(
+            EnvironmentError, durability.syncfs, pjoin(self.dir, "missing"))
+
+    def test_sync_filesystems(self):
+        # missing paths are ignored.
+        durability.sync_filesystems([self.dir, pjoin(self.dir, "missing")])
+
+    def test_fsync(self):
+        path = pjoin(self.dir, "file")
+        open(path, "w").close()
+        durability.sync_paths([path], "per-file")
@@ -0,0 +1,145 @@
+# License: GPL2/BSD
+
+import errno
+import os
+
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.fs import fastcopy
+from pkgcore.test import TestCase
+
+
+class TestCopyFile(TempDirMixin, TestCase):
+
+    data = "".join(chr(x % 256) for x in xrange(300000))
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self._methods = fastcopy.methods
+        fastcopy._unusable.clear()
+        self.src = pjoin(self.dir, "src")
+        with open(self.src, "wb") as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        fastcopy.methods = self._methods
+        fastcopy._unusable.clear()
+        TempDirMixin.tearDown(self)
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_copy(self):
+        dest = pjoin(self.dir, "dest")
+        method = fastcopy.copy_file(self.src, dest)
+        self.assertIn(method, [name for name, func in fastcopy.methods])
+        self.assertEqual(self.read(dest), self.data)
+        self.assertNotEqual(os.stat(dest).st_ino, os.stat(self.src).st_ino)
+        self.assertEqual(os.stat(dest).st_mode & 07777, 0600)
+
+    def test_each_method(self):
+        for name, func in fastcopy.methods:
+            dest = pjoin(self.dir, name)
+            src_fd = os.open(self.src, os.O_RDONLY)
+            dst_fd = os.open(dest, os.O_WRONLY | os.O_CREAT, 0600)
+            try:
+                try:
+                    func(src_fd, dst_fd, len(self.data))
+                except EnvironmentError as e:
+                    # not every filesystem or kernel supports every method.
+                    self.assertIn(e.errno, fastcopy._unsupported_errnos)
+                    continue
+            finally:
+                os.close(src_fd)
+                os.close(dst_fd)
+            self.assertEqual(self.read(dest), self.data, name)
+
+    def test_overwrite(self):
+        dest = pjoin(self.dir, "dest")
+        with open(dest, "wb") as f:
+            f.write("x" * (len(self.data) * 2))
+        fastcopy.copy_file(self.src, dest)
+        self.assertEqual(self.read(dest), self.data)
+
+    def test_empty(self):
+        src = pjoin(self.dir, "empty")
+        open(src, "w").close()
+        dest = pjoin(self.dir, "dest")
+        fastcopy.copy_file(src, dest)
+        self.assertEqual(self.read(dest), "")
+
+    def test_link(self):
+        dest = pjoin(self.dir, "dest")
+        self.assertEqual(fastcopy.copy_file(self.src, dest, link=True), "link")
+        self.assertEqual(os.stat(dest).st_ino, os.stat(self.src).st_ino)
+
+    def test_link_overwrite(self):
+        dest = pjoin(self.dir, "dest")
+        with open(dest, "wb") as f:
+            f.write("leftover")
+        self.assertEqual(fastcopy.copy_file(self.src, dest, link=True), "link")
+        self.assertEqual(os.stat(dest).st_ino, os.stat(self.src).st_ino)
+        self.assertEqual(self.read(dest), self.data)
+
+    def test_overwrite_hardlink(self):
+        # copying over a hardlink must not truncate the other path.
+        other = pjoin(self.dir, "other")
+        with open(other, "wb") as f:
+            f.write("other")
+        dest = pjoin(self.dir, "dest")
+        os.link(other, dest)
+        fastcopy.copy_file(self.src, dest)
+        self.assertEqual(self.read(dest), self.data)
+        self.assertEqual(self.read(other), "other")
+
+    def test_fallback(self):
+        calls = []
+
+        def unsupported(src_fd, dst_fd, size):
+            calls.append("unsupported")
+            # partial output must not survive into the next attempt.
+            os.write(dst_fd, "garbage")
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+        def failing(src_fd, dst_fd, size):
+            raise OSError(errno.EIO, os.strerror(errno.EIO))
+
+        fastcopy.methods = (
+            ("unsupported", unsupported),
+            ("read_write", fastcopy._read_write))
+        dest = pjoin(self.dir, "dest")
+        self.assertEqual(fastcopy.copy_file(self.src, dest), "read_write")
+        self.assertEqual(self.read(dest), self.data)
+        self.assertEqual(calls, ["unsupported"])
+
+        # the unsupported method is skipped from then on.
+        self.assertEqual(fastcopy.copy_file(self.src, dest), "read_write")
+        self.assertEqual(calls, ["unsupported"])
+
+        # real failures propagate.
+        fastcopy.methods = (("failing", failing),) + fastcopy.methods
+        self.assertRaises(EnvironmentError, fastcopy.copy_file, self.src, dest)
+
+    def test_short_copy(self):
+        def short(src_fd, dst_fd, size):
+            # copies half, then claims the source is exhausted.
+            sent = []
+            def call(count):
+                if sent:
+                    return 0
+                sent.append(os.write(dst_fd, os.read(src_fd, size // 2)))
+                return sent[0]
+            fastcopy._call_loop(call, size)
+
+        fastcopy.methods = (
+            ("short", short), ("read_write", fastcopy._read_write))
+        dest = pjoin(self.dir, "dest")
+        self.assertEqual(fastcopy.copy_file(self.src, dest), "read_write")
+        self.assertEqual(self.read(dest), self.data)
+
+    def test_missing_source(self):
+        self.assertRaises(
+            EnvironmentError, fastcopy.copy_file,
+            pjoin(self.dir, "missing"), pjoin(self.dir, "dest"))
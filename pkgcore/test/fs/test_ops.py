@@ -81,6 +81,33 @@ class TestCopyFile(VerifyMixin, TempDirMixin, TestCase):
             self.assertEqual("asdf\n" * 10, f.read())
         self.verify(o, kwds, os.stat(o.location))
 
+    def test_disposable(self):
+        src = pjoin(self.dir, "copy_test_src")
+        dest = pjoin(self.dir, "copy_test_dest")
+        with open(src, "w") as f:
+            f.write("asdf\n")
+        kwds = {"mtime":10321, "uid":os.getuid(), "gid":os.getgid(),
+                "mode":0664, "data":local_source(src), "dev":None,
+                "inode":None}
+        o = fs.fsFile(dest, **kwds)
+        self.assertTrue(ops.default_copyfile(o))
+        self.assertNotEqual(os.stat(src).st_ino, os.stat(dest).st_ino)
+        os.unlink(dest)
+        self.assertTrue(ops.default_copyfile(o, disposable=True))
+        self.assertEqual(os.stat(src).st_ino, os.stat(dest).st_ino)
+        with open(dest, "r") as f:
+            self.assertEqual("asdf\n", f.read())
+        self.verify(o, kwds, os.stat(o.location))
+
+        if os.getuid() == 0:
+            # sources owned by someone else, e.g. the build user, aren't
+            # linked; the merged file would otherwise share their inode.
+            os.unlink(dest)
+            os.chown(src, 250, 250)
+            self.assertTrue(ops.default_copyfile(o, disposable=True))
+            self.assertNotEqual(os.stat(src).st_ino, os.stat(dest).st_ino)
+            self.verify(o, kwds, os.stat(o.location))
+
     def test_sym_perms(self):
         curgid = os.getgid()
         group = [x for x in os.getgroups() if x != curgid]
@@ -132,6 +159,15 @@ class ContentsMixin(VerifyMixin, TempDirMixin, TestCase):
         "dir/link":["sym", "../dir"]
         }
 
+    # enough entries to be merged/unmerged in parallel.
+    entries_many = dict(
+        [("many", ["dir"])] +
+        [("many/d%i" % i, ["dir"]) for i in xrange(10)] +
+        [("many/d%i/f%i" % (i, j), ["reg"])
+            for i in xrange(10) for j in xrange(20)] +
+        [("many/d%i/l%i" % (i, j), ["sym", "f%i" % j])
+            for i in xrange(10) for j in xrange(5)])
+
     def generate_tree(self, base, entries):
         s_ents = [(pjoin(base, k), entries[k]) for k in sorted(entries)]
         for k, v in s_ents:
@@ -214,6 +250,31 @@ class Test_merge_contents(ContentsMixin):
         ops.merge_contents(cset)
 
 
+    def test_parallel(self):
+        src = self.gen_dir("src")
+        self.generate_tree(src, self.entries_many)
+        os.link(pjoin(src, "many/d0/f0"), pjoin(src, "many/hardlink"))
+        cset = livefs.scan(src, offset=src)
+        dest = self.gen_dir("dest")
+        s = set(contents.offset_rewriter(dest, cset))
+        self.assertTrue(ops.merge_contents(
+            cset, offset=dest, callback=s.remove, parallelism=4))
+        self.assertFalse(s)
+        self.assertEqual(cset, livefs.scan(dest, offset=dest))
+        self.assertEqual(os.stat(pjoin(dest, "many/d0/f0")).st_ino,
+                         os.stat(pjoin(dest, "many/hardlink")).st_ino)
+
+    def test_parallel_failure(self):
+        src = self.gen_dir("src")
+        self.generate_tree(src, self.entries_many)
+        cset = livefs.scan(src, offset=src)
+        dest = self.gen_dir("dest")
+        # a symlink can't replace a dir it doesn't point at.
+        os.makedirs(pjoin(dest, "many/d3/l2/blocker"))
+        self.assertRaises(ops.FailedCopy, ops.merge_contents, cset,
+                          offset=dest, parallelism=4)
+
+
 class Test_unmerge_contents(ContentsMixin):
 
     def generic_unmerge_bits(self, entries, img="img"):
@@ -251,3 +312,20 @@ class Test_unmerge_contents(ContentsMixin):
         open(fp, "w").close()
         self.assertTrue(ops.unmerge_contents(cset, offset=img))
         self.assertTrue(os.path.exists(fp))
+
+    def test_parallel(self):
+        img, cset = self.generic_unmerge_bits(self.entries_many)
+        s = set(contents.offset_rewriter(img, cset))
+        self.assertTrue(ops.unmerge_contents(
+            cset, offset=img, callback=s.remove, parallelism=4))
+        self.assertFalse(s, s)
+        self.assertFalse(livefs.scan(img, offset=img))
+
+    def test_parallel_lingering_file(self):
+        img, cset = self.generic_unmerge_bits(self.entries_many)
+        fp = os.path.join(img, "many/d5/linger")
+        open(fp, "w").close()
+        self.assertTrue(
+            ops.unmerge_contents(cset, offset=img, parallelism=4))
+        self.assertTrue(os.path.exists(fp))
+        self.assertFalse(os.path.exists(os.path.join(img, "many/d4")))
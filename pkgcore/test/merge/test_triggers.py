@@ -13,7 +13,7 @@ from snakeoil.osutils import pjoin, ensure_dirs, normpath
 from snakeoil.test import mixins
 
 from pkgcore import spawn
-from pkgcore.fs import fs
+from pkgcore.fs import durability, fs
 from pkgcore.merge import triggers, const
 from pkgcore.fs.contents import contentsSet
 from pkgcore.fs.livefs import gen_obj, scan
@@ -650,3 +650,62 @@ class TestPruneFiles(TestCase):
         self.assertNotIn('/sporks-suck', ' '.join(info))
         self.assertIn('/foons-rule', ' '.join(info))
         self.assertIn('/mango', ' '.join(info))
+
+
+class TestSyncMerged(TestCase):
+
+    kls = triggers.SyncMerged
+
+    def test_mode(self):
+        self.assertEqual(self.kls().mode, 'per-package')
+        self.assertEqual(self.kls('per-file').mode, 'per-file')
+        self.assertRaises(ValueError, self.kls, 'foo')
+
+    def test_it(self):
+        synced = []
+        trigger = self.kls('per-file')
+        orig = durability.sync_paths
+        durability.sync_paths = lambda paths, mode: synced.append(
+            (sorted(paths), mode))
+        try:
+            new = contentsSet([fs.fsFile('/new', strict=False)])
+            old = contentsSet([fs.fsFile('/old', strict=False)])
+            engine = fake_engine(mode=const.INSTALL_MODE, phase='merge')
+            trigger(engine, {'install':new})
+            self.assertEqual(synced, [(['/new'], 'per-file')])
+
+            # replacing syncs what each phase touched.
+            del synced[:]
+            engine = fake_engine(mode=const.REPLACE_MODE, phase='merge')
+            trigger(engine, {'install':new, 'uninstall':old})
+            engine.phase = 'unmerge'
+            trigger(engine, {'install':new, 'uninstall':old})
+            self.assertEqual(synced, [
+                (['/new'], 'per-file'), (['/old'], 'per-file')])
+        finally:
+            durability.sync_paths = orig
+
+
+
+class TestMergeJobs(TestCase):
+
+    def test_it(self):
+        calls = []
+        def op(cset, callback, **kwds):
+            calls.append(kwds)
+            return True
+        orig = triggers.get_plugin
+        triggers.get_plugin = lambda key: op
+        try:
+            reporter = fake_reporter(installing_fs_obj=None,
+                                     removing_fs_obj=None)
+            for kls in (triggers.merge, triggers.unmerge):
+                # serial unless the domain asks for more.
+                engine = fake_engine(observer=reporter, merge_jobs=1,
+                                     parallelism=8, new=None)
+                kls().trigger(engine, contentsSet())
+                engine.merge_jobs = 4
+                kls().trigger(engine, contentsSet())
+            self.assertEqual(calls, [{}, {'parallelism': 4}] * 2)
+        finally:
+            triggers.get_plugin = orig
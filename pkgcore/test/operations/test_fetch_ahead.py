@@ -0,0 +1,73 @@
+# License: GPL2/BSD
+
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.operations import fetch_ahead
+
+
+class FakePkg(object):
+
+    def __init__(self, cpvstr, result=True):
+        self.cpvstr = cpvstr
+        self.result = result
+
+
+class FakeOps(object):
+
+    def __init__(self, pkg, observer):
+        self.pkg = pkg
+        self.observer = observer
+
+    def run_if_supported(self, name, or_return=None):
+        assert name == "fetch"
+        if isinstance(self.pkg.result, Exception):
+            raise self.pkg.result
+        self.observer.info("fetched %s", self.pkg.cpvstr)
+        return self.pkg.result
+
+
+class FakeDomain(object):
+
+    def pkg_operations(self, pkg, observer=None):
+        return FakeOps(pkg, observer)
+
+
+class TestFetchPipeline(TempDirMixin):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.pipelines = []
+
+    def tearDown(self):
+        for pipeline in self.pipelines:
+            pipeline.stop()
+        TempDirMixin.tearDown(self)
+
+    def mk_pipeline(self, pkgs, **kwds):
+        pipeline = fetch_ahead.FetchPipeline(
+            FakeDomain(), pkgs, pjoin(self.dir, 'logs', 'fetch.log'), **kwds)
+        pipeline.start()
+        self.pipelines.append(pipeline)
+        return pipeline
+
+    def test_results(self):
+        pkgs = [FakePkg('cat/a-1'), None, FakePkg('cat/b-1', False),
+                FakePkg('cat/c-1', ValueError('broken'))]
+        pipeline = self.mk_pipeline(pkgs, jobs=2)
+        self.assertTrue(pipeline.ready(1))
+        self.assertTrue(pipeline.wait(0))
+        self.assertTrue(pipeline.ready(0))
+        self.assertEqual(sorted(pipeline), [(0, True), (2, False), (3, False)])
+        with open(pipeline.log_path) as f:
+            log = f.read()
+        self.assertIn('info: fetched cat/a-1\n', log)
+        self.assertIn('fetching cat/c-1 failed:', log)
+        self.assertIn('ValueError: broken', log)
+
+    def test_stop(self):
+        pipeline = self.mk_pipeline([FakePkg('cat/a-1')])
+        pipeline.stop()
+        # nothing is left to wait on; stopping again is harmless.
+        self.assertTrue(pipeline.ready(0))
+        pipeline.stop()
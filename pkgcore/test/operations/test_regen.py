@@ -0,0 +1,129 @@
+# License: GPL2/BSD
+
+import os
+
+from pkgcore.ebuild import processor
+from pkgcore.operations import regen
+from pkgcore.operations.observer import null_output
+from pkgcore.test import TestCase
+
+
+class FakePkg(object):
+
+    def __init__(self, cpvstr):
+        self.cpvstr = cpvstr
+        self.category = cpvstr.split('/')[0]
+
+
+class FakeRepo(object):
+
+    def __init__(self, pkgs):
+        self.pkgs = pkgs
+        self.regenerated = []
+
+    def __iter__(self):
+        return iter(self.pkgs)
+
+    def __len__(self):
+        raise AssertionError("len() walks every version of a repo")
+
+    def _regen_operation_helper(self, **options):
+        return self.regenerated.append
+
+
+class TestRegenRepository(TestCase):
+
+    def setUp(self):
+        self.warmed = []
+        self.orig_warm = processor.warm_ebuild_processors
+        processor.warm_ebuild_processors = \
+            lambda count, **kwds: self.warmed.append(count)
+
+    def tearDown(self):
+        processor.warm_ebuild_processors = self.orig_warm
+
+    def test_warm_count(self):
+        pkgs = [FakePkg('cat/pkg-%i' % x) for x in range(3)]
+        repo = FakeRepo(pkgs)
+        regen.regen_repository(repo, null_output(), threads=1)
+        regen.regen_repository(repo, null_output(), threads=2)
+        self.assertEqual(self.warmed, [1, 2])
+        self.assertEqual(repo.regenerated, pkgs * 2)
+
+    def test_processes_fallback(self):
+        observer = RecordingObserver()
+        repo = FakeRepo([FakePkg('cat/pkg-1')])
+        regen.regen_repository(repo, observer, threads=1, use_processes=True)
+        self.assertEqual(len(observer.messages['warn']), 1)
+        self.assertEqual(repo.regenerated, repo.pkgs)
+
+
+class RecordingObserver(null_output):
+
+    def __init__(self):
+        self.messages = {'error': [], 'warn': [], 'debug': []}
+
+    def error(self, msg, *args, **kwds):
+        self.messages['error'].append(msg % args)
+
+    def warn(self, msg, *args, **kwds):
+        self.messages['warn'].append(msg % args)
+
+    def debug(self, msg, *args, **kwds):
+        self.messages['debug'].append(msg % args)
+
+
+class FakeOperations(object):
+
+    def run_if_supported(self, name, *args, **kwds):
+        pass
+
+
+class ShardedRepo(object):
+
+    operations = FakeOperations()
+
+    def __init__(self, pkgs):
+        self.pkgs = pkgs
+        self.categories = sorted(set(x.category for x in pkgs))
+
+    def itermatch(self, restrict):
+        return (x for x in self.pkgs if restrict.match(x))
+
+    def _regen_operation_helper(self, **options):
+        # record which worker handled each pkg.
+        return lambda pkg: {'_eclasses_': (str(os.getpid()),)}
+
+
+class TestRegenRepositoryProcesses(TestCase):
+
+    def setUp(self):
+        self.pkgs = [FakePkg(x) for x in (
+            'a/pkg-1', 'a/pkg-2', 'b/pkg-1', 'c/pkg-1', 'c/other-1')]
+        self.repo = ShardedRepo(self.pkgs)
+
+    def regen(self, **kwds):
+        observer = RecordingObserver()
+        inherits = {}
+        regen.regen_repository_processes(
+            self.repo, observer, processes=2, inherits=inherits, **kwds)
+        self.assertEqual(observer.messages['error'], [])
+        # each category is handled by a single worker.
+        workers = {}
+        for cpv, (pid,) in inherits.iteritems():
+            self.assertNotEqual(int(pid), os.getpid())
+            workers.setdefault(cpv.split('/')[0], set()).add(pid)
+        self.assertTrue(all(len(x) == 1 for x in workers.itervalues()))
+        self.assertEqual(
+            len([x for x in observer.messages['debug']
+                 if x.startswith('regenerated ')]), len(workers))
+        return sorted(inherits)
+
+    def test_repo(self):
+        self.assertEqual(self.regen(), sorted(x.cpvstr for x in self.pkgs))
+        self.assertEqual(self.regen(pkgs=self.repo), self.regen())
+
+    def test_pkgs(self):
+        pkgs = [self.pkgs[0], self.pkgs[3]]
+        self.assertEqual(self.regen(pkgs=pkgs), ['a/pkg-1', 'c/pkg-1'])
+        self.assertEqual(self.regen(pkgs=[]), [])
@@ -0,0 +1,120 @@
+# License: GPL2/BSD
+
+import os
+
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.ebuild.atom import atom
+from pkgcore.ebuild.conditionals import DepSet
+from pkgcore.operations import scheduler
+from pkgcore.test import TestCase
+from pkgcore.test.misc import FakePkg
+
+
+class FakeOp(object):
+
+    def __init__(self, desc, cpv, depends='', rdepends=''):
+        self.desc = desc
+        self.pkg = FakePkg(cpv)
+        object.__setattr__(self.pkg, 'depends', DepSet.parse(depends, atom))
+        object.__setattr__(self.pkg, 'rdepends', DepSet.parse(rdepends, atom))
+
+    def __repr__(self):
+        return '%s %s' % (self.desc, self.pkg.cpvstr)
+
+
+class TestOpDependencies(TestCase):
+
+    def test_independent(self):
+        ops = [FakeOp('add', 'dev-libs/a-1'), FakeOp('add', 'dev-libs/b-1')]
+        self.assertEqual(scheduler.op_dependencies(ops),
+                         [frozenset(), frozenset()])
+
+    def test_edges(self):
+        ops = [
+            FakeOp('add', 'dev-libs/a-1'),
+            FakeOp('add', 'dev-libs/b-1', depends='>=dev-libs/a-2'),
+            FakeOp('add', 'dev-libs/c-1', depends='dev-libs/a',
+                   rdepends='|| ( dev-libs/x dev-libs/b ) !dev-libs/c'),
+            FakeOp('replace', 'dev-libs/d-1', rdepends='dev-libs/c'),
+        ]
+        self.assertEqual(scheduler.op_dependencies(ops), [
+            frozenset(), frozenset(), frozenset([0, 1]), frozenset([2])])
+
+    def test_remove_barrier(self):
+        ops = [
+            FakeOp('add', 'dev-libs/a-1'),
+            FakeOp('add', 'dev-libs/b-1'),
+            FakeOp('remove', 'dev-libs/c-1'),
+            FakeOp('add', 'dev-libs/d-1', depends='dev-libs/a'),
+            FakeOp('remove', 'dev-libs/e-1'),
+        ]
+        self.assertEqual(scheduler.op_dependencies(ops), [
+            frozenset(), frozenset(), frozenset([0, 1]), frozenset([2]),
+            frozenset([2, 3])])
+
+
+class TestScheduler(TempDirMixin):
+
+    def run_ops(self, ops, failing=(), **kwds):
+        def job(op, logfile):
+            logfile.write('building %s\n' % op.pkg.cpvstr)
+            return op.pkg.package not in failing
+        sched = scheduler.Scheduler(ops, job, self.dir, **kwds)
+        sched.poll_interval = 0.01
+        results = []
+        ret = sched.run(
+            finished=lambda op, path, result: results.append(
+                (op.pkg.package, result)))
+        return sched, ret, results
+
+    def test_run(self):
+        ops = [FakeOp('add', 'dev-libs/a-1'),
+               FakeOp('add', 'dev-libs/b-1', depends='dev-libs/a')]
+        sched, ret, results = self.run_ops(ops, jobs=2)
+        self.assertTrue(ret)
+        self.assertEqual(results, [('a', True), ('b', True)])
+        path = pjoin(self.dir, 'dev-libs', 'a-1.log')
+        self.assertEqual(sched.log_path(ops[0]), path)
+        with open(path) as f:
+            self.assertEqual(f.read(), 'building dev-libs/a-1\n')
+
+    def test_failure(self):
+        ops = [FakeOp('add', 'dev-libs/a-1'),
+               FakeOp('add', 'dev-libs/b-1', depends='dev-libs/a'),
+               FakeOp('add', 'dev-libs/c-1')]
+        sched, ret, results = self.run_ops(ops, failing=('a',))
+        self.assertFalse(ret)
+        self.assertEqual(results, [('a', False)])
+
+        sched, ret, results = self.run_ops(
+            ops, failing=('a',), keep_going=True)
+        self.assertFalse(ret)
+        self.assertEqual(results, [('a', False), ('b', None), ('c', True)])
+        self.assertEqual(sched.succeeded, set([2]))
+        self.assertEqual(sched.failed, set([0, 1]))
+
+
+    def test_ready(self):
+        ops = [FakeOp('add', 'dev-libs/a-1'), FakeOp('add', 'dev-libs/b-1')]
+        checked = []
+        def ready(i):
+            # every op is held back the first time it's asked about.
+            checked.append(i)
+            return checked.count(i) > 1
+        sched, ret, results = self.run_ops(ops, jobs=2, ready=ready)
+        self.assertTrue(ret)
+        self.assertEqual(sorted(results), [('a', True), ('b', True)])
+
+
+class TestFsLock(TempDirMixin):
+
+    def test_lock(self):
+        lock = scheduler.FsLock(pjoin(self.dir, 'vdb'))
+        with lock:
+            self.assertTrue(os.path.isdir(lock.path))
+            self.assertNotEqual(lock._fd, None)
+        self.assertEqual(lock._fd, None)
+        # releasing twice is harmless.
+        lock.release()
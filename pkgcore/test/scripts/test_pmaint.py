@@ -235,3 +235,20 @@ class TestRegen(TestCase, helpers.ArgParseMixin):
         self.assertEqual(
             [options.repo.__class__, options.threads],
             [TestSimpleTree, 2])
+
+        options = self.parse(
+            'spork', '--threads', '4', '--use-processes',
+            spork=basics.HardCodedConfigSection({'class': fake_repo}))
+        self.assertEqual(
+            [options.threads, options.use_processes], [4, True])
+
+        options = self.parse(
+            'spork', '--recycle-after', '500', '--recycle-rss', '256',
+            spork=basics.HardCodedConfigSection({'class': fake_repo}))
+        self.assertEqual(
+            [options.recycle_after, options.recycle_rss], [500, 256])
+
+        options = self.parse(
+            'spork', '--pool-min', '2', '--pool-max', '8',
+            spork=basics.HardCodedConfigSection({'class': fake_repo}))
+        self.assertEqual([options.pool_min, options.pool_max], [2, 8])
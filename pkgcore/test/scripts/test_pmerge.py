@@ -1,11 +1,13 @@
 # Copyright: 2006 Marien Zwart <marienz@gentoo.org>
 # License: BSD/GPL2
 
+from snakeoil.process import get_proc_count
+
 from pkgcore.config import basics
 from pkgcore.ebuild import formatter
 from pkgcore.repository import util
 from pkgcore.scripts import pmerge
-from pkgcore.test import TestCase
+from pkgcore.test import TestCase, malleable_obj
 from pkgcore.util.parserestrict import parse_match
 
 default_formatter = basics.HardCodedConfigSection({
@@ -59,3 +61,20 @@ class TargetParsingTest(TestCase):
         self.assertEqual(len(a), 1)
         self.assertEqual(a[0].key, 'foo/bar')
         self.assertTrue(isinstance(a[0].key, str))
+
+
+class FetchJobsTest(TestCase):
+
+    def fetch_jobs(self, fetch_jobs=None, jobs=1, fetchonly=False):
+        return pmerge.fetch_jobs(malleable_obj(
+            fetch_jobs=fetch_jobs, jobs=jobs, fetchonly=fetchonly))
+
+    def test_fetch_jobs(self):
+        self.assertEqual(self.fetch_jobs(), 2)
+        self.assertEqual(self.fetch_jobs(jobs=4), 2)
+        self.assertEqual(self.fetch_jobs(fetchonly=True), get_proc_count())
+        self.assertEqual(self.fetch_jobs(jobs=4, fetchonly=True), 4)
+        # explicit values are always respected.
+        self.assertEqual(self.fetch_jobs(0, fetchonly=True), 0)
+        self.assertEqual(self.fetch_jobs(3, jobs=4, fetchonly=True), 3)
+        self.assertEqual(self.fetch_jobs(3), 3)
@@ -0,0 +1,62 @@
+# License: GPL2/BSD
+
+import hashlib
+
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.test import TestCase
+from pkgcore.util import chksum
+
+data = ''.join(chr(x % 251) for x in xrange(300000))
+
+
+def expected(data, *chfs):
+    values = {"size": long(len(data))}
+    for chf in ("md5", "sha1", "sha256", "sha512"):
+        values[chf] = long(hashlib.new(chf, data).hexdigest(), 16)
+    return [values[x] for x in chfs]
+
+
+class TestMultiHash(TestCase):
+
+    def test_update(self):
+        hashes = chksum.MultiHash(["size", "md5", "sha256"])
+        self.assertEqual(hashes.unsupported, ())
+        hashes.update(data[:1000])
+        hashes.update(data[1000:])
+        self.assertEqual(hashes.values(), dict(zip(
+            ("size", "md5", "sha256"), expected(data, "size", "md5", "sha256"))))
+        hashes.reset()
+        hashes.update(data[:10])
+        self.assertEqual(hashes.values()["md5"], expected(data[:10], "md5")[0])
+        self.assertEqual(hashes.size, 10)
+
+
+class TestGetChksums(TempDirMixin, TestCase):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.path = pjoin(self.dir, "file")
+        with open(self.path, "wb") as f:
+            f.write(data)
+        self.orig = chksum.blocksize, chksum.parallel_threshold
+
+    def tearDown(self):
+        chksum.blocksize, chksum.parallel_threshold = self.orig
+        TempDirMixin.tearDown(self)
+
+    def test_get_chksums(self):
+        chfs = ("sha512", "size", "md5", "sha1")
+        self.assertEqual(chksum.get_chksums(self.path, *chfs),
+                         expected(data, *chfs))
+        self.assertEqual(chksum.get_chksums(self.path, "md5"),
+                         expected(data, "md5"))
+        self.assertEqual(chksum.get_chksums(self.path), [])
+
+    def test_threaded(self):
+        chksum.blocksize = 4096
+        chksum.parallel_threshold = 0
+        chfs = ("sha256", "size", "md5", "sha1")
+        self.assertEqual(chksum.get_chksums(self.path, *chfs),
+                         expected(data, *chfs))
@@ -0,0 +1,111 @@
+# License: GPL2/BSD
+
+from snakeoil.osutils import pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.fs import fs
+from pkgcore.fs.contents import contentsSet
+from pkgcore.test import TestCase
+from pkgcore.vdb import contents
+
+lines = [
+    "dir /usr/bin",
+    "obj /usr/bin/foo bar d41d8cd98f00b204e9800998ecf8427e 100",
+    "sym /usr/bin/link -> foo bar 200",
+    "fif /run/fifo",
+]
+
+
+class TestParsing(TestCase):
+
+    def test_iter_contents(self):
+        self.assertEqual(list(contents.iter_contents(lines + [''])), [
+            ('dir', '/usr/bin', None, None, None),
+            ('obj', '/usr/bin/foo bar',
+             'd41d8cd98f00b204e9800998ecf8427e', '100', None),
+            ('sym', '/usr/bin/link', None, '200', 'foo bar'),
+            ('fif', '/run/fifo', None, None, None),
+        ])
+        self.assertEqual(
+            list(contents.iter_contents_paths(lines)),
+            ['/usr/bin', '/usr/bin/foo bar', '/usr/bin/link', '/run/fifo'])
+        for bad in ("foo /bar", "sym /usr/bin/link foo 200", "obj /bar"):
+            self.assertRaises(
+                ValueError, list, contents.iter_contents([bad]))
+
+
+class TestContentsFile(TempDirMixin):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.path = pjoin(self.dir, 'CONTENTS')
+        with open(self.path, 'w') as f:
+            f.write(''.join(x + '\n' for x in lines))
+
+    def test_lazy(self):
+        cset = contents.ContentsFile(self.path)
+        self.assertEqual(len(cset), 4)
+        self.assertEqual(sorted(cset.iterpaths()),
+            ['/run/fifo', '/usr/bin', '/usr/bin/foo bar', '/usr/bin/link'])
+        # assertIn would repr the set, creating every object.
+        self.assertTrue('/usr/bin/' in cset)
+        self.assertFalse('/usr/bin/missing' in cset)
+        self.assertEqual(len(cset._dict._objs), 0)
+
+        obj = cset['/usr/bin/foo bar']
+        self.assertTrue(obj.is_reg)
+        self.assertEqual(obj.chksums, {'md5': 0xd41d8cd98f00b204e9800998ecf8427e})
+        self.assertEqual(obj.mtime, 100)
+        self.assertEqual(len(cset._dict._objs), 1)
+
+        link = cset['/usr/bin/link']
+        self.assertTrue(link.is_sym)
+        self.assertEqual((link.target, link.mtime), ('foo bar', 200))
+        self.assertEqual(sorted(x.location for x in cset.iterdirs()),
+                         ['/usr/bin'])
+        self.assertEqual(len(cset.files()), 1)
+
+    def test_lazy_set_ops(self):
+        cset = contents.ContentsFile(self.path, mutable=True)
+        other = contentsSet([fs.fsDir('/usr/bin', strict=False),
+                             fs.fsFifo('/run/fifo', strict=False)])
+
+        diff = cset.difference(other)
+        self.assertEqual(sorted(diff.iterpaths()),
+                         ['/usr/bin/foo bar', '/usr/bin/link'])
+        self.assertEqual(len(cset._dict._objs), 2)
+        self.assertEqual(sorted(cset.difference(['/usr/bin']).iterpaths()),
+            ['/run/fifo', '/usr/bin/foo bar', '/usr/bin/link'])
+
+        cset = contents.ContentsFile(self.path, mutable=True)
+        self.assertEqual(sorted(cset.intersection(other).iterpaths()),
+                         ['/run/fifo', '/usr/bin'])
+        self.assertEqual(len(cset._dict._objs), 0)
+        self.assertEqual(
+            sorted(cset.intersection(
+                contents.ContentsFile(self.path)).iterpaths()),
+            sorted(cset.iterpaths()))
+        self.assertEqual(len(cset._dict._objs), 0)
+
+        self.assertEqual(
+            sorted(x.location for x in cset.iter_child_nodes('/usr/bin')),
+            ['/usr/bin/foo bar', '/usr/bin/link'])
+        self.assertEqual(len(cset._dict._objs), 2)
+
+        cset = contents.ContentsFile(self.path, mutable=True)
+        cset.intersection_update(other)
+        self.assertEqual(sorted(cset.iterpaths()), ['/run/fifo', '/usr/bin'])
+        self.assertEqual(len(cset._dict._objs), 0)
+
+    def test_clone(self):
+        cset = contents.ContentsFile(self.path)
+        clone = cset.clone()
+        clone.remove('/run/fifo')
+        clone.add(fs.fsDir('/etc', strict=False))
+        self.assertEqual(len(cset), 4)
+        self.assertIn('/run/fifo', cset)
+        self.assertEqual(sorted(clone.iterpaths()),
+            ['/etc', '/usr/bin', '/usr/bin/foo bar', '/usr/bin/link'])
+        self.assertEqual(cset, contents.ContentsFile(self.path))
+        self.assertNotEqual(cset, clone)
+
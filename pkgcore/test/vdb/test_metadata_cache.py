@@ -0,0 +1,92 @@
+# License: GPL2/BSD
+
+import os
+
+from snakeoil.osutils import ensure_dirs, pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.test import silence_logging
+from pkgcore.vdb import metadata_cache
+
+
+class TestMetadataCache(TempDirMixin):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.pkg_path = pjoin(self.dir, 'vdb', 'cat', 'pkg-1')
+        ensure_dirs(self.pkg_path)
+        for name, value in (('SLOT', '0\n'), ('USE', 'x y\n'),
+                            ('CONTENTS', 'dir /usr\n'),
+                            ('pkg-1.ebuild', ''), ('environment.bz2', '')):
+            self.write(name, value)
+        self.location = pjoin(self.dir, 'cache', 'metadata.sqlite')
+
+    def write(self, name, value, mtime=100):
+        with open(pjoin(self.pkg_path, name), 'w') as f:
+            f.write(value)
+        os.utime(self.pkg_path, (mtime, mtime))
+
+    def test_get(self):
+        cache = metadata_cache.MetadataCache(self.location)
+        self.assertEqual(cache.get('cat/pkg-1', self.pkg_path),
+                         {'SLOT': '0\n', 'USE': 'x y\n'})
+        self.assertTrue(os.path.exists(self.location))
+
+        # cached entries are used as long as the directory is unchanged.
+        self.write('SLOT', '1\n')
+        cache = metadata_cache.MetadataCache(self.location)
+        self.assertEqual(cache.get('cat/pkg-1', self.pkg_path)['SLOT'], '0\n')
+
+        self.write('SLOT', '2\n', mtime=200)
+        cache = metadata_cache.MetadataCache(self.location)
+        self.assertEqual(cache.get('cat/pkg-1', self.pkg_path)['SLOT'], '2\n')
+        cache = metadata_cache.MetadataCache(self.location)
+        self.assertEqual(cache.get('cat/pkg-1', self.pkg_path)['SLOT'], '2\n')
+
+    def test_validated_once(self):
+        cache = metadata_cache.MetadataCache(self.location)
+        stamps = []
+        def stamp(path, orig=cache._stamp):
+            stamps.append(path)
+            return orig(path)
+        cache._stamp = stamp
+        for x in range(3):
+            self.assertEqual(
+                cache.get('cat/pkg-1', self.pkg_path)['SLOT'], '0\n')
+        self.assertEqual(len(stamps), 1)
+        self.assertTrue(cache.writable())
+
+        # changes made via update are picked up, and discarded entries are
+        # checked again.
+        self.write('SLOT', '1\n', mtime=200)
+        cache.update('cat/pkg-1', self.pkg_path)
+        self.assertEqual(cache.get('cat/pkg-1', self.pkg_path)['SLOT'], '1\n')
+        self.assertEqual(len(stamps), 2)
+        cache.discard('cat/pkg-1')
+        self.assertEqual(cache.get('cat/pkg-1', self.pkg_path)['SLOT'], '1\n')
+        self.assertEqual(len(stamps), 3)
+
+    def test_update_discard(self):
+        cache = metadata_cache.MetadataCache(self.location)
+        cache.get('cat/pkg-1', self.pkg_path)
+        self.write('SLOT', '1\n')
+        self.assertEqual(cache.update('cat/pkg-1', self.pkg_path)['SLOT'], '1\n')
+        cache.discard('cat/pkg-1')
+        cache = metadata_cache.MetadataCache(self.location)
+        self.assertEqual(cache._load(), {})
+
+    def test_cacheable_key(self):
+        self.assertTrue(metadata_cache.cacheable_key('RDEPEND'))
+        self.assertTrue(metadata_cache.cacheable_key('repository'))
+        for key in ('CONTENTS', 'NEEDED', 'NEEDED.ELF.2', 'environment',
+                    'environment.bz2', 'pkg-1.ebuild'):
+            self.assertFalse(metadata_cache.cacheable_key(key))
+
+    @silence_logging
+    def test_corrupt(self):
+        ensure_dirs(os.path.dirname(self.location))
+        with open(self.location, 'w') as f:
+            f.write('garbage' * 1024)
+        cache = metadata_cache.MetadataCache(self.location)
+        self.assertIdentical(cache.get('cat/pkg-1', self.pkg_path), None)
+        self.assertTrue(cache.disabled)
@@ -0,0 +1,22 @@
+# License: GPL2/BSD
+
+from snakeoil.osutils import ensure_dirs, pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.vdb import ondisk
+
+
+class TestTree(TempDirMixin):
+
+    def test_reload(self):
+        vdb = pjoin(self.dir, 'vdb')
+        ensure_dirs(pjoin(vdb, 'cat', 'a-1'))
+        repo = ondisk.tree(vdb, disable_cache=True)
+        self.assertEqual(sorted(x.cpvstr for x in repo), ['cat/a-1'])
+        # pkgs merged by another process aren't seen until reloaded.
+        ensure_dirs(pjoin(vdb, 'cat', 'a-2'))
+        ensure_dirs(pjoin(vdb, 'dev', 'b-1'))
+        self.assertEqual(sorted(x.cpvstr for x in repo), ['cat/a-1'])
+        repo.reload()
+        self.assertEqual(sorted(x.cpvstr for x in repo),
+                         ['cat/a-1', 'cat/a-2', 'dev/b-1'])
@@ -0,0 +1,84 @@
+# License: GPL2/BSD
+
+import os
+
+from snakeoil.osutils import ensure_dirs, pjoin
+from snakeoil.test.mixins import TempDirMixin
+
+from pkgcore.vdb import owners
+
+
+class TestOwnersIndex(TempDirMixin):
+
+    def setUp(self):
+        TempDirMixin.setUp(self)
+        self.vdb = pjoin(self.dir, 'vdb')
+        self.add_pkg('cat/a-1', 'obj /usr/bin/a 0 0', 'dir /usr/bin',
+                     'sym /usr/bin/a link -> a 0')
+        self.add_pkg('cat/b-2', 'obj /usr/bin/b with space 0 0',
+                     'dir /usr/bin', 'fif /var/run/b')
+        self.index = owners.OwnersIndex(
+            pjoin(self.dir, 'cache', 'owners.sqlite'), self.vdb)
+
+    def add_pkg(self, cpv, *lines):
+        ensure_dirs(pjoin(self.vdb, cpv))
+        with open(pjoin(self.vdb, cpv, 'CONTENTS'), 'w') as f:
+            f.write(''.join(x + '\n' for x in lines))
+        self.bump()
+
+    def bump(self):
+        st = os.stat(self.vdb)
+        os.utime(self.vdb, (st.st_atime, st.st_mtime + 1))
+
+    def test_rebuild(self):
+        self.assertFalse(self.index.is_current())
+        self.assertEqual(self.index.owners(['/usr/bin']), {})
+        self.index.rebuild()
+        self.assertTrue(self.index.is_current())
+        self.assertEqual(
+            self.index.owners(['/usr/bin', '/usr/bin/a link', '/missing']),
+            {'/usr/bin': set(['cat/a-1', 'cat/b-2']),
+             '/usr/bin/a link': set(['cat/a-1'])})
+        self.assertEqual(
+            self.index.owners_matching(lambda x: x.startswith('/var/')),
+            set(['cat/b-2']))
+        self.bump()
+        self.assertFalse(self.index.is_current())
+
+    def test_transaction(self):
+        self.index.rebuild()
+        self.bump()
+        with self.index.transaction() as index:
+            index.remove('cat/a-1')
+            index.add('cat/c-1', ['/usr/bin/c'])
+        self.assertTrue(self.index.is_current())
+        self.assertEqual(
+            self.index.owners(['/usr/bin', '/usr/bin/c']),
+            {'/usr/bin': set(['cat/b-2']), '/usr/bin/c': set(['cat/c-1'])})
+
+        self.bump()
+        try:
+            with self.index.transaction() as index:
+                index.remove('cat/b-2')
+                raise ValueError()
+        except ValueError:
+            pass
+        # aborted updates leave the index untouched, and thus stale.
+        self.assertFalse(self.index.is_current())
+        self.assertEqual(self.index.owners(['/usr/bin']),
+                         {'/usr/bin': set(['cat/b-2'])})
+
+    def test_get_index(self):
+        class repo(object):
+            owners = self.index
+        self.assertIdentical(owners.get_index([repo()]), self.index)
+        self.assertTrue(self.index.is_current())
+        self.assertIdentical(owners.get_index([repo(), repo()]), None)
+        self.assertIdentical(owners.get_index([object()]), None)
+
+    def test_writable(self):
+        # the cache directory is created on rebuild, so needn't exist yet.
+        self.assertFalse(os.path.exists(os.path.dirname(self.index.location)))
+        self.assertTrue(self.index.writable())
+        self.index.rebuild()
+        self.assertTrue(self.index.writable())
@@ -0,0 +1,155 @@
+# License: GPL2/BSD
+
+"""
+computing several chksums of a file in a single read
+
+Every chksum type hashlib provides is fed from the same buffer; for large
+files each hash runs in its own thread, as hashlib releases the GIL while
+hashing.  Types hashlib lacks fall back to snakeoil's handlers, costing a
+read apiece.
+"""
+
+__all__ = ("MultiHash", "get_chksums")
+
+import hashlib
+import Queue
+import threading
+
+from snakeoil.demandload import demandload
+
+demandload(
+    'snakeoil.chksum:get_handlers',
+)
+
+# chksum names mapped to the hashlib algorithm computing them.
+hashlib_names = {
+    "md5": "md5",
+    "sha1": "sha1",
+    "sha256": "sha256",
+    "sha512": "sha512",
+    "rmd160": "ripemd160",
+    "whirlpool": "whirlpool",
+}
+
+# bytes read at a time.
+blocksize = 1 << 20
+
+# files at least this large are hashed in parallel.
+parallel_threshold = 64 << 20
+
+
+def _new_hasher(chf):
+    try:
+        return hashlib.new(hashlib_names[chf])
+    except (KeyError, ValueError):
+        return None
+
+
+class MultiHash(object):
+
+    """
+    track the size and chksums of a stream of data
+
+    :ivar size: number of bytes seen
+    :ivar unsupported: chksum types hashlib can't compute
+    """
+
+    def __init__(self, chksums):
+        """
+        :param chksums: chksum types to compute; size is always tracked
+        """
+        self.chksums = tuple(x for x in chksums if x != "size")
+        self.reset()
+
+    def reset(self):
+        """Start over, as if no data was seen."""
+        self.size = 0
+        self.hashers = {}
+        unsupported = []
+        for chf in self.chksums:
+            hasher = _new_hasher(chf)
+            if hasher is None:
+                unsupported.append(chf)
+            else:
+                self.hashers[chf] = hasher
+        self.unsupported = tuple(unsupported)
+
+    def update(self, data):
+        self.size += len(data)
+        for hasher in self.hashers.itervalues():
+            hasher.update(data)
+
+    def update_from_file(self, f, threaded=False):
+        """Feed the remaining contents of a file object.
+
+        :param threaded: if True and multiple chksums are computed, hash in
+            a thread per chksum type
+        """
+        if not threaded or len(self.hashers) < 2:
+            while True:
+                data = f.read(blocksize)
+                if not data:
+                    return
+                self.update(data)
+
+        def hash_queue(queue, hasher):
+            while True:
+                data = queue.get()
+                if data is None:
+                    return
+                hasher.update(data)
+
+        queues = []
+        threads = []
+        for hasher in self.hashers.itervalues():
+            queue = Queue.Queue(maxsize=4)
+            queues.append(queue)
+            threads.append(threading.Thread(
+                target=hash_queue, args=(queue, hasher)))
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                data = f.read(blocksize)
+                if not data:
+                    break
+                self.size += len(data)
+                for queue in queues:
+                    queue.put(data)
+        finally:
+            for queue in queues:
+                queue.put(None)
+            for thread in threads:
+                thread.join()
+
+    def values(self):
+        """Return a dict of the chksums hashlib computed, plus size."""
+        d = dict((chf, long(hasher.hexdigest(), 16))
+                 for chf, hasher in self.hashers.iteritems())
+        d["size"] = long(self.size)
+        return d
+
+
+def get_chksums(location, *chksums):
+    """Compute the given chksum types of a file, reading it just once.
+
+    A drop-in for :obj:`snakeoil.chksum.get_chksums`.
+
+    :param location: path of the file
+    :return: list of the chksum values, in the order requested
+    :raise EnvironmentError: if the file can't be read
+    """
+    hashes = MultiHash(chksums)
+    with open(location, "rb") as f:
+        threaded = False
+        if len(hashes.hashers) > 1:
+            f.seek(0, 2)
+            threaded = f.tell() >= parallel_threshold
+            f.seek(0)
+        hashes.update_from_file(f, threaded=threaded)
+    values = hashes.values()
+    if hashes.unsupported:
+        handlers = get_handlers(hashes.unsupported)
+        for chf in hashes.unsupported:
+            values[chf] = handlers[chf](location)
+    return [values[chf] for chf in chksums]
@@ -28,9 +28,10 @@ def map_async(iterable, functor, *args, **kwds):
     if parallelism is None:
         parallelism = get_proc_count()
 
-    if hasattr(iterable, '__len__'):
+    if isinstance(iterable, (list, tuple)):
         # if there are less items than parallelism, don't
-        # spawn pointless threads.
+        # spawn pointless threads.  other sized objects (repos for example)
+        # may have to walk everything to compute their length.
         parallelism = max(min(len(iterable), parallelism), 0)
 
     # note we allow an infinite queue since .put below
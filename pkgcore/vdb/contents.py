@@ -1,11 +1,16 @@
 # Copyright: 2005-2010 Brian Harring <ferringb@gmail.com>
 # License: GPL2/BSD
 
-__all__ = ("LookupFsDev", "ContentsFile")
+__all__ = ("LookupFsDev", "ContentsFile", "iter_contents", "iter_contents_paths")
+
+from array import array
+from itertools import chain
 
 from snakeoil import data_source
 from snakeoil.demandload import demandload
 from snakeoil.fileutils import AtomicWriteFile
+from snakeoil.mappings import DictMixin
+from snakeoil.osutils import normpath
 
 from pkgcore.fs import fs
 from pkgcore.fs.contents import contentsSet
@@ -43,8 +48,187 @@ class LookupFsDev(fs.fsDev):
         fs.fsDev.__init__(self, path, **kwds)
 
 
+def iter_contents(lines):
+    """Parse CONTENTS lines without building fs objects.
+
+    :param lines: iterable of lines, sans newlines
+    :return: iterable of (type, path, md5, mtime, target) tuples; type is one
+        of obj, sym, dir, dev, or fif, the rest are the unconverted strings
+        from the line, or None if the type lacks them
+    :raise ValueError: for malformed lines
+    """
+    for line in lines:
+        if not line:
+            continue
+        kind = line[:3]
+        if kind == "obj":
+            path, md5, mtime = line[4:].rsplit(" ", 2)
+            yield kind, path, md5, mtime, None
+        elif kind == "sym":
+            p = line.index(" -> ", 3)
+            target, mtime = line[p+4:].rsplit(" ", 1)
+            yield kind, line[4:p], None, mtime, target
+        elif kind in ("dir", "dev", "fif") and line[3:4] == " ":
+            yield kind, line[4:], None, None, None
+        else:
+            raise ValueError("unknown entry type %r" % (line,))
+
+
+def iter_contents_paths(lines):
+    """Yield just the paths from CONTENTS lines; see :obj:`iter_contents`."""
+    for kind, path, md5, mtime, target in iter_contents(lines):
+        yield path
+
+
+class _ContentsRows(object):
+
+    """compact, append only store of parsed CONTENTS entries"""
+
+    __slots__ = ("types", "paths", "md5s", "mtimes", "targets")
+
+    _types = {"obj": "f", "sym": "l", "dir": "d", "dev": "v", "fif": "p"}
+
+    def __init__(self):
+        self.types = array("c")
+        self.paths = []
+        self.md5s = []
+        self.mtimes = array("l")
+        self.targets = []
+
+    def append(self, kind, path, md5, mtime, target):
+        """Store an entry, returning its row number."""
+        self.types.append(self._types[kind])
+        self.paths.append(path)
+        self.md5s.append(md5)
+        self.mtimes.append(-1 if mtime is None else long(mtime))
+        self.targets.append(target)
+        return len(self.paths) - 1
+
+    def materialize(self, row):
+        """Create the fs object for a row."""
+        kind, path = self.types[row], self.paths[row]
+        if kind == "f":
+            return fs.fsFile(
+                path, chksums={"md5": long(self.md5s[row], 16)},
+                mtime=self.mtimes[row], strict=False)
+        elif kind == "l":
+            return fs.fsLink(path, self.targets[row],
+                             mtime=self.mtimes[row], strict=False)
+        elif kind == "d":
+            return fs.fsDir(path, strict=False)
+        elif kind == "v":
+            return LookupFsDev(path, strict=False)
+        return fs.fsFifo(path, strict=False)
+
+
+class _LazyContents(DictMixin):
+
+    """
+    location to fs object mapping, creating objects on demand
+
+    Entries parsed from a CONTENTS file are held in a :obj:`_ContentsRows`,
+    thus lookups, membership tests, and iterating over locations don't build
+    fs objects; iterating over the objects builds them all.  See
+    :obj:`ContentsFile` for set operations working from locations.
+    """
+
+    def __init__(self, rows=None, index=None):
+        if rows is None:
+            rows = _ContentsRows()
+        self._rows = rows
+        # location -> row, for entries that haven't been materialized.
+        self._index = {} if index is None else index
+        self._objs = {}
+
+    @classmethod
+    def from_lines(cls, lines):
+        rows = _ContentsRows()
+        append = rows.append
+        index = {}
+        for kind, path, md5, mtime, target in iter_contents(lines):
+            path = normpath(path)
+            index[path] = append(kind, path, md5, mtime, target)
+        return cls(rows, index)
+
+    def _materialize_all(self):
+        index = self._index
+        if index:
+            materialize = self._rows.materialize
+            self._objs.update(
+                (key, materialize(row)) for key, row in index.iteritems())
+            index.clear()
+            self._rows = _ContentsRows()
+
+    def __getitem__(self, key):
+        obj = self._objs.get(key)
+        if obj is None:
+            obj = self._objs[key] = self._rows.materialize(self._index[key])
+            del self._index[key]
+        return obj
+
+    def __setitem__(self, key, obj):
+        self._index.pop(key, None)
+        self._objs[key] = obj
+
+    def __delitem__(self, key):
+        if self._index.pop(key, None) is None:
+            del self._objs[key]
+
+    def pop(self, key, *default):
+        row = self._index.pop(key, None)
+        if row is not None:
+            return self._rows.materialize(row)
+        return self._objs.pop(key, *default)
+
+    def __contains__(self, key):
+        return key in self._objs or key in self._index
+
+    def __len__(self):
+        return len(self._objs) + len(self._index)
+
+    def iterkeys(self):
+        return chain(self._objs.keys(), self._index.keys())
+
+    __iter__ = iterkeys
+
+    def itervalues(self):
+        self._materialize_all()
+        return self._objs.itervalues()
+
+    def iteritems(self):
+        self._materialize_all()
+        return self._objs.iteritems()
+
+    def clear(self):
+        self._index.clear()
+        self._objs.clear()
+        self._rows = _ContentsRows()
+
+    def copy(self):
+        # rows are never modified, thus can be shared.
+        obj = self.__class__(self._rows, self._index.copy())
+        obj._objs = self._objs.copy()
+        return obj
+
+    def __eq__(self, other):
+        self._materialize_all()
+        if isinstance(other, _LazyContents):
+            other._materialize_all()
+            other = other._objs
+        return self._objs == other
+
+    def __ne__(self, other):
+        return not self == other
+
+
 class ContentsFile(contentsSet):
-    """class wrapping a contents file"""
+    """class wrapping a contents file
+
+    The file is parsed into a compact form up front, fs objects being created
+    as they're accessed; see :obj:`iterpaths` for getting at the locations
+    alone.  Differences, intersections, and child node lookups only create
+    the fs objects they return.
+    """
 
     def __init__(self, source, mutable=False, create=False):
 
@@ -53,8 +237,10 @@ class ContentsFile(contentsSet):
         contentsSet.__init__(self, mutable=True)
         self._source = source
 
-        if not create:
-            self.update(self._iter_contents())
+        if create:
+            self._dict = _LazyContents()
+        else:
+            self._dict = _LazyContents.from_lines(self._iter_lines())
 
         self.mutable = mutable
 
@@ -62,9 +248,48 @@ class ContentsFile(contentsSet):
         # create is used to block it from reading.
         cset = self.__class__(self._source, mutable=True, create=True)
         if not empty:
-            cset.update(self)
+            cset._dict = self._dict.copy()
         return cset
 
+    def iterpaths(self):
+        """Yield the location of every entry without creating fs objects."""
+        return iter(self._dict)
+
+    # the following work from locations, creating fs objects for just the
+    # entries they return rather than for the whole set.
+
+    def _iter_objs(self, paths):
+        d = self._dict
+        return (d[x] for x in paths)
+
+    def difference(self, other):
+        if not hasattr(other, '__contains__'):
+            other = set(self._convert_loc(other))
+        return contentsSet(
+            self._iter_objs([x for x in self.iterpaths() if x not in other]),
+            mutable=self.mutable)
+
+    def intersection(self, other):
+        if isinstance(other, ContentsFile):
+            return contentsSet(
+                other._iter_objs([x for x in other.iterpaths() if x in self]),
+                mutable=self.mutable)
+        return contentsSet.intersection(self, other)
+
+    def intersection_update(self, other):
+        if not self.mutable:
+            raise TypeError("%r isn't mutable" % self)
+        if not hasattr(other, '__contains__'):
+            other = set(self._convert_loc(other))
+        for x in [x for x in self.iterpaths() if x not in other]:
+            self.remove(x)
+
+    def iter_child_nodes(self, start_point):
+        prefix = self._child_nodes_root(start_point).rstrip(
+            os.path.sep) + os.path.sep
+        return self._iter_objs(
+            [x for x in self.iterpaths() if x.startswith(prefix)])
+
     def add(self, obj):
         if obj.is_reg:
             # strict checks
@@ -85,42 +310,18 @@ class ContentsFile(contentsSet):
             fobj.truncate(0)
         return fobj
 
+    def _iter_lines(self):
+        lines = self._get_fd()
+        if isinstance(self._source, basestring):
+            return lines
+        return (line.rstrip("\n") for line in lines)
+
     def flush(self):
         return self._write()
 
     def _iter_contents(self):
         self.clear()
-        for line in self._get_fd():
-            if not line:
-                continue
-            s = line.split(" ")
-            if s[0] in ("dir", "dev", "fif"):
-                path = ' '.join(s[1:])
-                if s[0] == 'dir':
-                    obj = fs.fsDir(path, strict=False)
-                elif s[0] == 'dev':
-                    obj = LookupFsDev(path, strict=False)
-                else:
-                    obj = fs.fsFifo(path, strict=False)
-            elif s[0] == "obj":
-                path = ' '.join(s[1:-2])
-                obj = fs.fsFile(
-                    path, chksums={"md5":long(s[-2], 16)},
-                        mtime=long(s[-1]), strict=False)
-            elif s[0] == "sym":
-                try:
-                    p = s.index("->")
-                    obj = fs.fsLink(' '.join(s[1:p]), ' '.join(s[p+1:-1]),
-                        mtime=long(s[-1]), strict=False)
-
-                except ValueError:
-                    # XXX throw a corruption error
-                    raise
-            else:
-                raise Exception(
-                    "unknown entry type %r" % (line,))
-
-            yield obj
+        return _LazyContents.from_lines(self._iter_lines()).itervalues()
 
     def _write(self):
         md5_handler = get_handler('md5')
@@ -0,0 +1,206 @@
+# License: GPL2/BSD
+
+"""
+consolidated cache of installed packages' metadata
+
+The vdb stores each metadata key of a package as a separate file; loading
+the installed packages thus costs a couple dozen small reads apiece.  This
+keeps the keys of every package in one sqlite database, with each package's
+entry validated against the mtime of its vdb directory the first time it's
+used.  The whole database is pulled in with a single query on first use.
+"""
+
+__all__ = ("MetadataCache", "MetadataCacheError", "cacheable_key")
+
+import os
+import sqlite3
+import threading
+
+from snakeoil.compatibility import raise_from
+from snakeoil.demandload import demandload
+from snakeoil.fileutils import readfile
+from snakeoil.osutils import ensure_dirs, listdir_files, pjoin
+
+from pkgcore.repository import errors
+
+demandload('pkgcore.log:logger')
+
+# large, or not plain strings; these are always read from the vdb itself.
+_uncached_keys = frozenset(["CONTENTS", "NEEDED", "environment"])
+
+
+def cacheable_key(name):
+    """Is the vdb file of the given name stored in the cache?"""
+    return '.' not in name and name not in _uncached_keys
+
+
+class MetadataCacheError(errors.TreeCorruption):
+    """The metadata cache couldn't be accessed or updated."""
+
+    def __str__(self):
+        return "vdb metadata cache failure: %s" % (self.err,)
+
+
+class MetadataCache(object):
+
+    """
+    sqlite backed cache of the metadata files of vdb entries
+
+    Failures accessing the database are logged and the cache disabled;
+    lookups then read the vdb directly.  An entry is checked against its vdb
+    directory once per instance; later changes are expected to go through
+    :obj:`update` and :obj:`discard`.
+    """
+
+    def __init__(self, location):
+        """
+        :param location: path of the database file
+        """
+        self.location = location
+        self._lock = threading.RLock()
+        self._conn = self._conn_pid = None
+        self._entries = None
+        # cpvs whose entries were checked against the vdb.
+        self._validated = set()
+        self._writable = None
+        self.disabled = False
+
+    def writable(self):
+        if self._writable is None:
+            # the nearest existing path decides; missing directories are
+            # created.
+            path = os.path.abspath(self.location)
+            while not os.path.exists(path):
+                path = os.path.dirname(path)
+            self._writable = os.access(path, os.W_OK)
+        return self._writable
+
+    def _get_connection(self):
+        pid = os.getpid()
+        if self._conn is not None and self._conn_pid == pid:
+            return self._conn
+        writable = self.writable()
+        if not writable and not os.path.exists(self.location):
+            return None
+        try:
+            if writable and not ensure_dirs(os.path.dirname(self.location),
+                                            mode=0755, minimal=True):
+                raise MetadataCacheError(
+                    "failed creating the directory for %r" % (self.location,))
+            conn = sqlite3.connect(self.location, timeout=60,
+                                   check_same_thread=False)
+            conn.text_factory = str
+            if writable:
+                # entries are validated on use, and the vdb is the
+                # authority; durability isn't worth a sync per package.
+                conn.executescript(
+                    "PRAGMA synchronous=OFF;"
+                    "CREATE TABLE IF NOT EXISTS packages "
+                    "(cpv TEXT PRIMARY KEY, mtime TEXT NOT NULL);"
+                    "CREATE TABLE IF NOT EXISTS metadata "
+                    "(cpv TEXT NOT NULL, key TEXT NOT NULL, "
+                    "value TEXT NOT NULL, PRIMARY KEY (cpv, key));")
+                conn.commit()
+        except sqlite3.Error as e:
+            raise_from(MetadataCacheError("%s: %s" % (self.location, e)))
+        self._conn, self._conn_pid = conn, pid
+        return conn
+
+    def _disable(self, e):
+        logger.warning("disabling vdb metadata cache: %s", e)
+        self.disabled = True
+        self._entries = {}
+
+    def _load(self):
+        entries = self._entries
+        if entries is not None:
+            return entries
+        entries = {}
+        try:
+            conn = self._get_connection()
+            if conn is not None:
+                for cpv, mtime in conn.execute(
+                        "SELECT cpv, mtime FROM packages"):
+                    entries[cpv] = (mtime, {})
+                for cpv, key, value in conn.execute(
+                        "SELECT cpv, key, value FROM metadata"):
+                    entry = entries.get(cpv)
+                    if entry is not None:
+                        entry[1][key] = value
+        except (sqlite3.Error, MetadataCacheError) as e:
+            self._disable(e)
+            return self._entries
+        self._entries = entries
+        return entries
+
+    @staticmethod
+    def _stamp(path):
+        return repr(os.stat(path).st_mtime)
+
+    def get(self, cpv, path):
+        """Return a dict of the cacheable metadata of a vdb entry.
+
+        :param cpv: cpv string of the package
+        :param path: vdb directory of the package
+        :return: None if the cache is disabled
+        :raise EnvironmentError: if the vdb directory can't be read
+        """
+        with self._lock:
+            entries = self._load()
+            if self.disabled:
+                return None
+            entry = entries.get(cpv)
+            if entry is not None and cpv in self._validated:
+                return entry[1]
+            stamp = self._stamp(path)
+            if entry is not None and entry[0] == stamp:
+                self._validated.add(cpv)
+                return entry[1]
+            return self._update(cpv, path, stamp)
+
+    def update(self, cpv, path):
+        """Read in the metadata of a vdb entry, storing it in the cache."""
+        with self._lock:
+            self._load()
+            if self.disabled:
+                return None
+            return self._update(cpv, path, self._stamp(path))
+
+    def _update(self, cpv, path, stamp):
+        data = {}
+        for name in listdir_files(path):
+            if cacheable_key(name):
+                value = readfile(pjoin(path, name), True)
+                if value is not None:
+                    data[name] = value
+        self._entries[cpv] = (stamp, data)
+        self._validated.add(cpv)
+        self._store(cpv, (stamp, data))
+        return data
+
+    def discard(self, cpv):
+        """Drop a package from the cache."""
+        with self._lock:
+            self._validated.discard(cpv)
+            if self._load().pop(cpv, None) is not None:
+                self._store(cpv, None)
+
+    def _store(self, cpv, entry):
+        if not self.writable():
+            return
+        try:
+            conn = self._get_connection()
+            with conn:
+                conn.execute("DELETE FROM packages WHERE cpv=?", (cpv,))
+                conn.execute("DELETE FROM metadata WHERE cpv=?", (cpv,))
+                if entry is not None:
+                    stamp, data = entry
+                    conn.execute(
+                        "INSERT INTO packages (cpv, mtime) VALUES (?, ?)",
+                        (cpv, stamp))
+                    conn.executemany(
+                        "INSERT INTO metadata (cpv, key, value) "
+                        "VALUES (?, ?, ?)",
+                        ((cpv, k, v) for k, v in data.iteritems()))
+        except (sqlite3.Error, MetadataCacheError) as e:
+            self._disable(e)
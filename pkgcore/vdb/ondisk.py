@@ -22,7 +22,7 @@ from pkgcore.repository import errors, multiplex, prototype
 
 demandload(
     'pkgcore.log:logger',
-    'pkgcore.vdb:repo_ops',
+    'pkgcore.vdb:metadata_cache,owners,repo_ops',
     'pkgcore.vdb.contents:ContentsFile',
 )
 
@@ -67,6 +67,26 @@ class tree(prototype.tree):
 
         self.package_class = self.package_factory(self)
 
+    @klass.jit_attr
+    def owners(self):
+        """index of the paths installed packages own; None if caching is disabled"""
+        if self.cache_location is None:
+            return None
+        return owners.OwnersIndex(
+            pjoin(self.cache_location, 'owners.sqlite'), self.location)
+
+    @klass.jit_attr
+    def metadata_cache(self):
+        """consolidated cache of package metadata; None if caching is disabled"""
+        if self.cache_location is None:
+            return None
+        return metadata_cache.MetadataCache(
+            pjoin(self.cache_location, 'metadata.sqlite'))
+
+    def reload(self):
+        prototype.tree.reload(self)
+        self._versions_tmp_cache = {}
+
     def _get_categories(self, *optional_category):
         # return if optional_category is passed... cause it's not yet supported
         if optional_category:
@@ -142,9 +162,20 @@ class tree(prototype.tree):
     def _get_metadata(self, pkg):
         return IndeterminantDict(partial(self._internal_load_key,
             pjoin(self.location, pkg.category,
-                "%s-%s" % (pkg.package, pkg.fullver))))
+                "%s-%s" % (pkg.package, pkg.fullver)), pkg.cpvstr))
 
-    def _internal_load_key(self, path, key):
+    def _read_key(self, path, cpv, key):
+        cache = self.metadata_cache
+        if cache is not None and metadata_cache.cacheable_key(key):
+            try:
+                data = cache.get(cpv, path)
+            except EnvironmentError:
+                data = None
+            if data is not None:
+                return data.get(key)
+        return readfile(pjoin(path, key), True)
+
+    def _internal_load_key(self, path, cpv, key):
         key = self._metadata_rewrites.get(key, key)
         if key == "contents":
             data = ContentsFile(pjoin(path, "CONTENTS"), mutable=True)
@@ -163,13 +194,13 @@ class tree(prototype.tree):
             data = data_source.local_source(fp)
         elif key == 'repo':
             # try both, for portage/paludis compatibility.
-            data = readfile(pjoin(path, 'repository'), True)
+            data = self._read_key(path, cpv, 'repository')
             if data is None:
-                data = readfile(pjoin(path, 'REPOSITORY'), True)
+                data = self._read_key(path, cpv, 'REPOSITORY')
                 if data is None:
                     raise KeyError(key)
         else:
-            data = readfile(pjoin(path, key), True)
+            data = self._read_key(path, cpv, key)
             if data is None:
                 raise KeyError((path, key))
         return data
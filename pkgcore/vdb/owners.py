@@ -0,0 +1,255 @@
+# License: GPL2/BSD
+
+"""
+index of the paths installed packages own
+
+Answering who owns a path otherwise means parsing the CONTENTS of every
+installed package.  The index is kept in an sqlite database, updated along
+with the vdb by its repo operations; it records the vdb's mtime as of the
+last update, and is considered stale if that no longer matches.
+"""
+
+__all__ = ("OwnersIndex", "OwnersIndexError", "get_index")
+
+import os
+import sqlite3
+import threading
+
+from snakeoil.compatibility import raise_from
+from snakeoil.demandload import demandload
+from snakeoil.osutils import ensure_dirs, listdir_dirs, normpath, pjoin
+
+from pkgcore.repository import errors
+
+demandload(
+    'errno',
+    'snakeoil.fileutils:readlines_ascii',
+    'pkgcore.log:logger',
+    'pkgcore.util.repo_utils:get_virtual_repos',
+    'pkgcore.vdb.contents:iter_contents_paths',
+)
+
+
+class OwnersIndexError(errors.TreeCorruption):
+    """The owners index couldn't be accessed or updated."""
+
+    def __str__(self):
+        return "owners index failure: %s" % (self.err,)
+
+
+def get_index(repos):
+    """Return a current owners index covering the given vdb repos, or None.
+
+    The index is rebuilt if it's stale and writable; if it's stale and can't
+    be rebuilt, None is returned so callers fall back to scanning CONTENTS.
+    Virtual repos are ignored since they own nothing.
+    """
+    raw_repos = get_virtual_repos(repos, False)
+    if len(raw_repos) != 1:
+        return None
+    index = getattr(raw_repos[0], 'owners', None)
+    if index is None:
+        return None
+    try:
+        if not index.is_current():
+            if not index.writable():
+                return None
+            index.rebuild()
+    except OwnersIndexError as e:
+        logger.warning("ignoring vdb owners index: %s", e)
+        return None
+    return index
+
+
+class OwnersIndex(object):
+
+    """
+    sqlite backed mapping of paths to the cpvs of the packages owning them
+
+    Updates happen within a transaction; see :obj:`transaction`.
+    """
+
+    def __init__(self, location, vdb_location):
+        """
+        :param location: path of the database file
+        :param vdb_location: on disk location of the vdb this indexes
+        """
+        self.location = location
+        self.vdb_location = vdb_location
+        self._lock = threading.RLock()
+        self._conn = self._conn_pid = None
+
+    def writable(self):
+        # the nearest existing path decides; missing directories are created.
+        path = os.path.abspath(self.location)
+        while not os.path.exists(path):
+            path = os.path.dirname(path)
+        return os.access(path, os.W_OK)
+
+    def _get_connection(self, create=False):
+        pid = os.getpid()
+        if self._conn is not None and self._conn_pid == pid:
+            return self._conn
+        if not create and not os.path.exists(self.location):
+            return None
+        try:
+            if create and not ensure_dirs(os.path.dirname(self.location),
+                                          mode=0755, minimal=True):
+                raise OwnersIndexError(
+                    "failed creating the directory for %r" % (self.location,))
+            conn = sqlite3.connect(self.location, timeout=60,
+                                   check_same_thread=False)
+            conn.text_factory = str
+            if create:
+                conn.executescript(
+                    "CREATE TABLE IF NOT EXISTS owners "
+                    "(path TEXT NOT NULL, cpv TEXT NOT NULL, "
+                    "PRIMARY KEY (path, cpv));"
+                    "CREATE INDEX IF NOT EXISTS owners_cpv ON owners (cpv);"
+                    "CREATE TABLE IF NOT EXISTS state "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL);")
+                conn.commit()
+        except sqlite3.Error as e:
+            raise_from(OwnersIndexError("%s: %s" % (self.location, e)))
+        self._conn, self._conn_pid = conn, pid
+        return conn
+
+    def _vdb_stamp(self):
+        try:
+            return repr(os.stat(self.vdb_location).st_mtime)
+        except EnvironmentError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return ''
+
+    def is_current(self):
+        """Is the index in sync with the vdb?"""
+        with self._lock:
+            conn = self._get_connection()
+            if conn is None:
+                return False
+            try:
+                row = conn.execute(
+                    "SELECT value FROM state WHERE key='vdb_mtime'").fetchone()
+            except sqlite3.Error:
+                # not initialized.
+                return False
+        return row is not None and row[0] == self._vdb_stamp()
+
+    def transaction(self):
+        """Return a context manager for updating the index.
+
+        Within it, call :obj:`add` and :obj:`remove`; on exit the changes
+        are committed along with the vdb's current mtime, or rolled back if
+        an exception was raised.
+        """
+        return _Transaction(self)
+
+    def add(self, cpv, paths):
+        """record paths as owned by cpv; only valid within a transaction"""
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO owners (path, cpv) VALUES (?, ?)",
+            ((path, cpv) for path in paths))
+
+    def remove(self, cpv):
+        """drop everything owned by cpv; only valid within a transaction"""
+        self._conn.execute("DELETE FROM owners WHERE cpv=?", (cpv,))
+
+    def rebuild(self):
+        """Regenerate the index from the CONTENTS of every installed package."""
+        with self.transaction():
+            self._conn.execute("DELETE FROM owners")
+            base = self.vdb_location
+            try:
+                categories = listdir_dirs(base)
+            except EnvironmentError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                categories = ()
+            for category in categories:
+                if category.startswith('.'):
+                    continue
+                for pkg in listdir_dirs(pjoin(base, category)):
+                    if pkg.startswith((".tmp.", "-MERGING-")) or \
+                            pkg.endswith(".lockfile"):
+                        continue
+                    cpath = pjoin(base, category, pkg, "CONTENTS")
+                    try:
+                        paths = [normpath(x) for x in iter_contents_paths(
+                            readlines_ascii(cpath, True))]
+                    except EnvironmentError as e:
+                        if e.errno != errno.ENOENT:
+                            raise
+                        continue
+                    except ValueError as e:
+                        logger.warning("owners index: skipping %s: %s",
+                                       cpath, e)
+                        continue
+                    self.add("%s/%s" % (category, pkg), paths)
+
+    def _query(self, query, args=()):
+        with self._lock:
+            conn = self._get_connection()
+            if conn is None:
+                return []
+            try:
+                return conn.execute(query, args).fetchall()
+            except sqlite3.Error as e:
+                raise_from(OwnersIndexError("%s: %s" % (self.location, e)))
+
+    def owners(self, paths):
+        """:return: dict mapping each owned path to the set of its owners"""
+        d = {}
+        paths = list(paths)
+        # stay beneath sqlite's limit on bound parameters.
+        for i in xrange(0, len(paths), 500):
+            chunk = paths[i:i + 500]
+            rows = self._query(
+                "SELECT path, cpv FROM owners WHERE path IN (%s)" %
+                (', '.join('?' * len(chunk)),), chunk)
+            for path, cpv in rows:
+                d.setdefault(path, set()).add(cpv)
+        return d
+
+    def owners_matching(self, match):
+        """:return: set of cpvs owning a path for which match returns True"""
+        # walking the table in python is still far cheaper than parsing
+        # every CONTENTS file.
+        return set(cpv for path, cpv in
+                   self._query("SELECT path, cpv FROM owners") if match(path))
+
+
+class _Transaction(object):
+
+    def __init__(self, index):
+        self.index = index
+
+    def __enter__(self):
+        index = self.index
+        index._lock.acquire()
+        try:
+            index._get_connection(create=True)
+        except:
+            index._lock.release()
+            raise
+        return index
+
+    def __exit__(self, exc_type, exc_value, tb):
+        index = self.index
+        conn = index._conn
+        try:
+            if exc_type is None:
+                try:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO state (key, value) "
+                        "VALUES ('vdb_mtime', ?)", (index._vdb_stamp(),))
+                    conn.commit()
+                except sqlite3.Error as e:
+                    conn.rollback()
+                    raise_from(OwnersIndexError("%s: %s" % (index.location, e)))
+            else:
+                conn.rollback()
+                if issubclass(exc_type, sqlite3.Error):
+                    raise OwnersIndexError("%s: %s" % (index.location, exc_value))
+        finally:
+            index._lock.release()
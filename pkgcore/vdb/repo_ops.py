@@ -19,6 +19,7 @@ demandload(
     'pkgcore.ebuild:conditionals',
     'pkgcore.log:logger',
     'pkgcore.vdb.contents:ContentsFile',
+    'pkgcore.vdb.owners:OwnersIndexError',
 )
 
 
@@ -32,6 +33,36 @@ def update_mtime(path, timestamp=None):
         logger.error("failed updated vdb timestamp for %r: %s", path, e)
 
 
+def _owners_index(repo):
+    # only an index in sync prior to the op can be updated incrementally;
+    # the op itself bumps the vdb mtime before the index is touched.
+    index = getattr(repo, 'owners', None)
+    if index is None:
+        return None
+    try:
+        if index.is_current():
+            return index
+    except OwnersIndexError as e:
+        logger.warning("ignoring vdb owners index: %s", e)
+    return None
+
+
+def _update_owners(index, remove=None, add=None):
+    if index is None:
+        return None
+    try:
+        with index.transaction():
+            if remove is not None:
+                index.remove(remove.cpvstr)
+            if add is not None:
+                index.add(add.cpvstr, (x.location for x in add.contents))
+    except OwnersIndexError as e:
+        # left stale, it'll be rebuilt the next time it's needed.
+        logger.warning("failed updating vdb owners index: %s", e)
+        return None
+    return index
+
+
 class install(repo_ops.install):
 
     def __init__(self, repo, newpkg, observer):
@@ -39,6 +70,7 @@ class install(repo_ops.install):
         dirname = "%s-%s" % (newpkg.package, newpkg.fullver)
         self.install_path = pjoin(base, dirname)
         self.tmp_write_path = pjoin(base, '.tmp.%s' % (dirname,))
+        self._owners = _owners_index(repo)
         repo_ops.install.__init__(self, repo, newpkg, observer)
 
     def add_data(self, domain):
@@ -121,6 +153,10 @@ class install(repo_ops.install):
     def finalize_data(self):
         os.rename(self.tmp_write_path, self.install_path)
         update_mtime(self.repo.location)
+        cache = getattr(self.repo, 'metadata_cache', None)
+        if cache is not None:
+            cache.update(self.new_pkg.cpvstr, self.install_path)
+        self._owners = _update_owners(self._owners, add=self.new_pkg)
         return True
 
 
@@ -129,6 +165,7 @@ class uninstall(repo_ops.uninstall):
     def __init__(self, repo, pkg, observer):
         self.remove_path = pjoin(
             repo.location, pkg.category, pkg.package+"-"+pkg.fullver)
+        self._owners = _owners_index(repo)
         repo_ops.uninstall.__init__(self, repo, pkg, observer)
 
     def remove_data(self):
@@ -138,6 +175,10 @@ class uninstall(repo_ops.uninstall):
         update_mtime(self.repo.location)
         shutil.rmtree(self.remove_path)
         update_mtime(self.repo.location)
+        cache = getattr(self.repo, 'metadata_cache', None)
+        if cache is not None:
+            cache.discard(self.old_pkg.cpvstr)
+        self._owners = _update_owners(self._owners, remove=self.old_pkg)
         return True
 
 